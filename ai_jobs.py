@@ -0,0 +1,216 @@
+"""
+AI后台任务
+AI助手的请求提交到有界线程池后立即返回任务编号，Web 请求不再等待大模型往返：
+- 线程池大小 MAX_WORKERS，排队+运行中的任务总数不超过 MAX_PENDING，每个会话同时最多
+  MAX_PER_OWNER 个任务，超出时拒绝提交
+- 每个任务有超时时间：排队超时不再调用，剩余时间作为单次调用超时传给大模型接口，
+  流式输出在两段之间检查超时并中止；已标记超时但线程仍卡在调用中的任务继续计入并发限制，
+  直到线程返回
+- 任务事件（状态、token、结果）保存在内存中，/ai-assistant/jobs/<id>/stream 以
+  Server-Sent Events 推送，断线重连时从 Last-Event-ID 之后继续
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS = 4
+MAX_PENDING = 16
+MAX_PER_OWNER = 2
+# 单次调用超时（秒）
+DEFAULT_TIMEOUT = 120.0
+# 已结束任务在内存中保留的时间（秒）
+RETENTION_SECONDS = 3600
+# SSE 心跳间隔（秒）
+HEARTBEAT_SECONDS = 15.0
+
+FINISHED = ('done', 'failed', 'timeout')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='ai-job')
+_lock = threading.Lock()
+_jobs = {}
+
+
+class JobRejected(Exception):
+    """任务数超过并发限制"""
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class _Job:
+    def __init__(self, kind, owner, timeout):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.deadline = self.created_at + timeout
+        self.finished_at = None
+        self.result = None
+        self.message = ''
+        self.events = []
+        self.condition = threading.Condition()
+        # 线程池中的 _run 已返回（或尚未开始排队）；为 False 时任务仍占用线程池
+        self.released = False
+
+    def emit(self, event, data):
+        with self.condition:
+            self.events.append((event, data))
+            self.condition.notify_all()
+
+    def check_deadline(self):
+        if time.time() > self.deadline:
+            raise JobTimeout()
+
+    def remaining(self):
+        """距截止时间的秒数，作为单次大模型调用的超时；已超时时抛出 JobTimeout"""
+        self.check_deadline()
+        return max(0.1, self.deadline - time.time())
+
+    def finish(self, status, result=None, message=''):
+        with self.condition:
+            if self.status in FINISHED:
+                return
+            self.status = status
+            self.result = result
+            self.message = message
+            self.finished_at = time.time()
+            self.events.append(('done', {'status': status, 'message': message, 'result': result}))
+            self.condition.notify_all()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'finished': self.status in FINISHED,
+            'message': self.message,
+            'result': self.result,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'elapsed': round((self.finished_at or time.time()) - self.created_at, 3)
+        }
+
+
+def _purge_finished():
+    cutoff = time.time() - RETENTION_SECONDS
+    for job_id in [job_id for job_id, job in _jobs.items()
+                   if job.released and job.finished_at is not None and job.finished_at < cutoff]:
+        del _jobs[job_id]
+
+
+def _run(job, work):
+    """在线程池中执行；work(job) 返回 (是否成功, 消息, 结果)"""
+    try:
+        job.check_deadline()
+        with job.condition:
+            job.status = 'running'
+        job.emit('status', {'status': 'running'})
+        success, message, result = work(job)
+        job.check_deadline()
+        job.finish('done' if success else 'failed', result, message)
+    except JobTimeout:
+        job.finish('timeout', message='AI响应超时，请稍后重试')
+    except Exception as e:
+        if time.time() > job.deadline:
+            job.finish('timeout', message='AI响应超时，请稍后重试')
+        else:
+            job.finish('failed', message=str(e))
+    finally:
+        with job.condition:
+            job.released = True
+
+
+def submit(kind, owner, work, timeout=DEFAULT_TIMEOUT):
+    """
+    提交任务，返回任务编号；超过并发限制时抛出 JobRejected
+    work(job) 在线程池中执行，可调用 job.emit('token', {'text': ...}) 推送流式输出，
+    在耗时步骤之间调用 job.check_deadline()，调用大模型时传入 timeout=job.remaining()
+    """
+    with _lock:
+        _purge_finished()
+        # 按线程池占用计数：已超时但线程还没返回的任务同样占着线程
+        active = [job for job in _jobs.values() if not job.released]
+        if len(active) >= MAX_PENDING:
+            raise JobRejected('AI任务过多，请稍后再试')
+        if sum(1 for job in active if job.owner == owner) >= MAX_PER_OWNER:
+            raise JobRejected(f'每个会话最多同时进行 {MAX_PER_OWNER} 个AI任务')
+        job = _Job(kind, owner, timeout)
+        _jobs[job.id] = job
+    job.emit('status', {'status': 'queued'})
+    _executor.submit(_run, job, work)
+    return job.id
+
+
+def get_job(job_id):
+    """任务状态字典，不存在返回None"""
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return None
+    _check_timeout(job)
+    return job.to_dict()
+
+
+def _check_timeout(job):
+    # 调用卡在远程接口内时，由查询方按截止时间标记超时，迟到的结果被丢弃
+    if job.status not in FINISHED and time.time() > job.deadline:
+        job.finish('timeout', message='AI响应超时，请稍后重试')
+
+
+def _format_event(event_id, event, data):
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'
+
+
+def stream_events(job_id, last_event_id=None):
+    """
+    SSE 事件流：先补发 last_event_id 之后的事件，再等待新事件，任务结束后发送 done 并结束
+    任务不存在时返回None
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is None:
+        return None
+    position = last_event_id + 1 if last_event_id is not None else 0
+
+    def generate():
+        nonlocal position
+        while True:
+            with job.condition:
+                if position >= len(job.events):
+                    job.condition.wait(timeout=min(HEARTBEAT_SECONDS, max(0.0, job.deadline - time.time()) + 0.1))
+                pending = job.events[position:]
+            if not pending:
+                _check_timeout(job)
+                if job.status in FINISHED and position >= len(job.events):
+                    return
+                yield ': keepalive\n\n'
+                continue
+            for event, data in pending:
+                yield _format_event(position, event, data)
+                position += 1
+                if event == 'done':
+                    return
+
+    return generate()
+
+
+def get_stats():
+    with _lock:
+        jobs = list(_jobs.values())
+    by_status = {}
+    for job in jobs:
+        by_status[job.status] = by_status.get(job.status, 0) + 1
+    return {
+        'max_workers': MAX_WORKERS,
+        'max_pending': MAX_PENDING,
+        'max_per_owner': MAX_PER_OWNER,
+        'jobs': by_status,
+        'active': sum(1 for job in jobs if not job.released),
+        # 已超时、线程仍在等待远程接口返回的任务
+        'stuck': sum(1 for job in jobs if job.status in FINISHED and not job.released)
+    }
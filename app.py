@@ -1,20 +1,49 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+from flask import (
+    Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session,
+    Response, stream_with_context
+)
 import os
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
-from database import init_database, get_connection
+from database import init_database
+import db_pool
+from db_pool import get_db
 from import_data import import_excel_to_database
+from import_stream import import_excel_streaming
+from import_jobs import (
+    init_jobs_table, submit_import_job, submit_bulk_import_job, submit_batch_optimize_job,
+    get_job, get_recent_jobs
+)
 from formula_manager import (
     get_all_formulas, get_formulas_with_cost, get_today_lowest_cost_formulas,
     get_formulas_with_materials_for_display, get_formula_materials_with_prices
 )
+from formula_pagination import (
+    init_pagination_indexes, get_formulas_page, get_materials_detail_page,
+    max_material_count, normalize_page_size, DEFAULT_PAGE_SIZE
+)
+from search_index import init_search_index, search_materials, search_formulas
+from typeahead import suggest_materials, suggest_products
+import price_intervals
+from price_intervals import init_price_intervals, get_material_price_history
+import cost_timeline
+import price_scenario
+import price_impact
+import formula_lp
+import optimize_cache
+import substitution_graph
+from xlsx_stream import xlsx_response
+import export_stream
+from export_cache import cached_xlsx_response
+from data_version import init_data_version_table, bump_data_version, bump_rule_version
 from export_data import (
     export_formula_list_to_excel, export_lowest_cost_to_excel,
     export_materials_detail_to_excel, export_materials_library_to_excel,
     export_customer_demands_to_excel
 )
 from material_customer_query import (
-    get_all_materials, get_material_price_history, search_materials,
+    get_all_materials,
     get_daily_customer_demands, get_all_dates_with_data, get_customer_demand_statistics
 )
 from formula_optimizer import (
@@ -25,9 +54,20 @@ from formula_optimizer import (
     apply_optimized_formula, get_optimized_formula_history,
     get_all_materials_for_selection, get_quotation_formulas_for_optimization
 )
-from llm_service import (
-    get_api_config, set_api_key, set_provider, LLM_CONFIG,
-    ai_suggest_substitutions, ai_optimize_formula, ai_chat_assistant
+from llm_service import get_api_config, set_api_key
+# AI调用经由缓存层（含本地模拟提供方 local-stub），参数与 llm_service 相同
+import llm_cache
+from llm_cache import (
+    init_llm_cache, set_provider, current_provider,
+    ai_optimize_formula, ai_chat_assistant_stream
+)
+import ai_jobs
+import suggest_buckets
+import price_index
+import cost_engine
+import cost_snapshot
+from formula_hash import (
+    init_formula_hash_column, update_formula_hash, refresh_formula_hash, backfill_formula_hashes
 )
 
 app = Flask(__name__)
@@ -44,11 +84,53 @@ os.makedirs(EXPORT_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['EXPORT_FOLDER'] = EXPORT_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024
+# xlsx 文件使用流式导入（逐行读取、分块写入），内存占用不随文件大小增长
+app.config['STREAMING_IMPORT'] = True
+# 导入在后台进程池中执行，/upload 立即返回任务编号
+app.config['BACKGROUND_IMPORT'] = True
+
+# 导出报表直接流式写入响应，不在 EXPORT_FOLDER 生成临时文件
+app.config['STREAMING_EXPORT'] = True
+
+# 请求级数据库连接池（WAL + 调优PRAGMA）
+db_pool.init_app(app)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def refresh_after_import(result=None):
+    """导入完成后补齐配方哈希，刷新价格索引和成本缓存"""
+    # 流式导入写入时已计算哈希；.xls 等非流式导入的新配方在这里补上（按索引只查哈希为空的配方）
+    backfill_formula_hashes()
+    bump_data_version()
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+    cost_snapshot.clear_snapshots()
+    optimize_cache.clear()
+
+def flash_impact_report(report_id):
+    """价格变动后提示影响报告"""
+    if report_id:
+        report = price_impact.get_report(report_id)
+        flash(f"价格变动影响 {report['formula_count']} 个配方，"
+              f"详见影响报告 #{report_id}（{url_for('price_impact_detail', report_id=report_id)}）", 'info')
+
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+def job_submitted_response(job_id):
+    """任务提交后的响应：JSON客户端返回任务编号，页面提交则提示后返回首页"""
+    # 记录到session，页面刷新后仍可继续查询进度
+    session['import_job_ids'] = (session.get('import_job_ids', []) + [job_id])[-10:]
+    
+    if wants_json():
+        return jsonify({'success': True,
+                        'job_id': job_id,
+                        'status_url': url_for('job_status', job_id=job_id)}), 202
+    flash(f'任务已提交，任务编号: {job_id}', 'info')
+    return redirect(url_for('index'))
+
 @app.route('/')
 def index():
     return render_template('index.html', current_date=datetime.now().strftime('%Y-%m-%d'))
@@ -73,7 +155,17 @@ def upload_file():
         file.save(filepath)
         
         import_date = request.form.get('import_date', datetime.now().strftime('%Y-%m-%d'))
-        result = import_excel_to_database(filepath, import_date)
+        streaming = app.config['STREAMING_IMPORT'] and filename.rsplit('.', 1)[1].lower() == 'xlsx'
+        
+        if app.config['BACKGROUND_IMPORT']:
+            job_id = submit_import_job(filepath, import_date, streaming, on_complete=refresh_after_import)
+            return job_submitted_response(job_id)
+        
+        if streaming:
+            result = import_excel_streaming(filepath, import_date)
+        else:
+            result = import_excel_to_database(filepath, import_date)
+        refresh_after_import(result)
         
         if result['success']:
             flash(result['message'], 'success')
@@ -85,45 +177,177 @@ def upload_file():
         flash('文件格式不支持，请上传xlsx或xls文件', 'danger')
         return redirect(url_for('index'))
 
+@app.route('/upload-bulk', methods=['POST'])
+def upload_bulk():
+    """多文件批量导入（历史数据补录）"""
+    files = [f for f in request.files.getlist('files') if f and f.filename]
+    
+    if not files:
+        flash('没有选择文件', 'danger')
+        return redirect(url_for('index'))
+    
+    # 批量导入使用流式解析，仅支持 xlsx
+    invalid = [f.filename for f in files if not f.filename.lower().endswith('.xlsx')]
+    if invalid:
+        flash(f'批量导入仅支持xlsx文件: {", ".join(invalid)}', 'danger')
+        return redirect(url_for('index'))
+    
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filepaths = []
+    for i, file in enumerate(files):
+        filename = f"{timestamp}_{i:03d}_{secure_filename(file.filename)}"
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        file.save(filepath)
+        filepaths.append(filepath)
+    
+    # 未指定导入日期时按每个文件的价格日期推断
+    import_date = request.form.get('import_date') or None
+    job_id = submit_bulk_import_job(filepaths, import_date, on_complete=refresh_after_import)
+    return job_submitted_response(job_id)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询导入任务进度"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/jobs')
+def job_list():
+    """当前会话提交的导入任务（及最近任务）"""
+    job_ids = session.get('import_job_ids', [])
+    my_jobs = [job for job in (get_job(job_id) for job_id in reversed(job_ids)) if job]
+    return jsonify({'success': True,
+                    'jobs': my_jobs,
+                    'recent_jobs': get_recent_jobs()})
+
 @app.route('/formulas')
 def formula_list():
     search_keyword = request.args.get('search', '')
     formula_type = request.args.get('type', '')  # 确保默认值为空字符串而不是None
     target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    sort = request.args.get('sort', 'type')
+    page_size = normalize_page_size(request.args.get('page_size', DEFAULT_PAGE_SIZE))
+    
+    # 游标分页：cursor 为上一页返回的 next_cursor
+    formulas, next_cursor = get_formulas_page(target_date, search_keyword, formula_type,
+                                              sort, request.args.get('cursor'), page_size)
     
-    formulas = get_formulas_with_cost(target_date, search_keyword, formula_type)
+    if wants_json():
+        return jsonify({'success': True, 'formulas': formulas, 'next_cursor': next_cursor})
     
     return render_template('formula_list.html',
                          formulas=formulas or [],
                          search_keyword=search_keyword,
                          formula_type=formula_type,  # 现在这里不会是None
                          target_date=target_date,
+                         sort=sort,
+                         page_size=page_size,
+                         next_cursor=next_cursor,
                          current_date=datetime.now().strftime('%Y-%m-%d'))
 
 @app.route('/lowest-cost-today')
 def lowest_cost_today():
-    """今日最低成本配方页面（可选择日期）"""
+    """今日最低成本配方页面（可选择日期，传入 start/end 时按日期区间逐日计算）"""
     target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    start_date = request.args.get('start', '')
+    end_date = request.args.get('end', '')
+    
+    if start_date and end_date:
+        try:
+            segments = cost_timeline.lowest_cost_range(start_date, end_date)
+        except ValueError as e:
+            if wants_json():
+                return jsonify({'success': False, 'message': str(e)}), 400
+            flash(str(e), 'danger')
+            return redirect(url_for('lowest_cost_today'))
+        
+        # 每个 (产品, 配方类型) 的区段列表：区段内最低成本配方及成本不变
+        range_results = [{'product_code': key[0], 'formula_type': key[1], 'segments': items}
+                         for key, items in sorted(segments.items(),
+                                                  key=lambda kv: (kv[0][0] or '', kv[0][1] or ''))]
+        if wants_json():
+            return jsonify({'success': True, 'start': start_date, 'end': end_date,
+                            'results': range_results})
+        return render_template('lowest_cost_today.html',
+                             results=[],
+                             range_results=range_results,
+                             start_date=start_date,
+                             end_date=end_date,
+                             target_date=target_date,
+                             current_date=datetime.now().strftime('%Y-%m-%d'))
     
-    from formula_manager import get_lowest_cost_formulas_by_date
-    results = get_lowest_cost_formulas_by_date(target_date)
+    # 与 /export/lowest-cost 使用同一排序（价格齐全的配方优先）
+    results = cost_engine.get_lowest_cost_list(target_date)
     
+    if wants_json():
+        return jsonify({'success': True, 'date': target_date, 'results': results})
     return render_template('lowest_cost_today.html',
                          results=results,
                          target_date=target_date,
                          current_date=datetime.now().strftime('%Y-%m-%d'))
 
+def _cost_trend_series():
+    """解析成本走势参数（formula_id 或 product_code、start、end），返回 (参数, 序列列表)"""
+    today = datetime.now().date()
+    params = {
+        'formula_id': request.args.get('formula_id', type=int),
+        'product_code': request.args.get('product_code', '').strip(),
+        'formula_type': request.args.get('type', ''),
+        'start': request.args.get('start', (today - timedelta(days=90)).isoformat()),
+        'end': request.args.get('end', today.isoformat())
+    }
+    if params['formula_id']:
+        formula_ids = [params['formula_id']]
+    elif params['product_code']:
+        formula_ids = cost_timeline.formula_ids_for_product(params['product_code'],
+                                                            params['formula_type'])
+    else:
+        return params, []
+    series = cost_timeline.formula_cost_series(formula_ids, params['start'], params['end'])
+    return params, [series[fid] for fid in formula_ids if fid in series]
+
+@app.route('/api/cost-trend')
+def api_cost_trend():
+    """配方成本走势：?formula_id= 或 ?product_code=&type=，start/end 为日期区间"""
+    try:
+        params, series = _cost_trend_series()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, **params, 'series': series})
+
+@app.route('/cost-trend')
+def cost_trend():
+    """配方成本走势页面"""
+    try:
+        params, series = _cost_trend_series()
+    except ValueError as e:
+        flash(str(e), 'danger')
+        params, series = {'start': '', 'end': ''}, []
+    return render_template('cost_trend.html',
+                         series=series,
+                         params=params,
+                         current_date=datetime.now().strftime('%Y-%m-%d'))
+
 @app.route('/materials-detail')
 def materials_detail():
     """配方原料横向明细页面（按产品编码查询，不需要日期）"""
     search_keyword = request.args.get('search', '')
     formula_type = request.args.get('type', '')
     target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    sort = request.args.get('sort', 'type')
+    page_size = normalize_page_size(request.args.get('page_size', DEFAULT_PAGE_SIZE))
     
-    results = get_formulas_with_materials_for_display(target_date, search_keyword, formula_type)
+    results, next_cursor = get_materials_detail_page(target_date, search_keyword, formula_type,
+                                                     sort, request.args.get('cursor'), page_size)
     
-    # 找出最多的原料数量
-    max_materials = max((len(r['materials']) for r in results), default=0)
+    # 最多的原料数量由聚合查询得出，翻页时列数保持一致
+    max_materials = max_material_count(search_keyword, formula_type)
+    
+    if wants_json():
+        return jsonify({'success': True, 'results': results,
+                        'max_materials': max_materials, 'next_cursor': next_cursor})
     
     return render_template('materials_detail_new.html',
                          results=results,
@@ -131,12 +355,20 @@ def materials_detail():
                          formula_type=formula_type,
                          target_date=target_date,
                          max_materials=max_materials,
+                         sort=sort,
+                         page_size=page_size,
+                         next_cursor=next_cursor,
                          current_date=datetime.now().strftime('%Y-%m-%d'))
 
 @app.route('/export-formulas/<date>')
 def export_formulas(date):
     """导出配方列表Excel"""
     filename = f"配方列表_{date}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response('formula-list', (date, '', ''), filename,
+                                    lambda: [export_stream.formula_list_sheet(date)])
+    
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_cost_summary_to_excel(date, filepath)
@@ -164,6 +396,18 @@ def materials_library():
                          materials=materials,
                          search_keyword=search_keyword)
 
+@app.route('/api/materials/suggest')
+def api_suggest_materials():
+    """原料输入联想：?q=编码或名称前缀&limit=条数"""
+    results = suggest_materials(request.args.get('q', ''), request.args.get('limit'))
+    return jsonify({'success': True, 'results': results})
+
+@app.route('/api/products/suggest')
+def api_suggest_products():
+    """产品输入联想：?q=编码或名称前缀&limit=条数"""
+    results = suggest_products(request.args.get('q', ''), request.args.get('limit'))
+    return jsonify({'success': True, 'results': results})
+
 @app.route('/material/<material_code>')
 def material_detail(material_code):
     """原料详情页面"""
@@ -221,6 +465,12 @@ def export_formula_list():
     formula_type = request.args.get('type', '')
     
     filename = f"配方列表_{target_date}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response(
+            'formula-list', (target_date, search_keyword, formula_type), filename,
+            lambda: [export_stream.formula_list_sheet(target_date, search_keyword, formula_type)])
+    
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_formula_list_to_excel(target_date, search_keyword, formula_type, filepath)
@@ -236,10 +486,27 @@ def export_formula_list():
 
 @app.route('/export/lowest-cost')
 def export_lowest_cost():
-    """导出最低成本配方"""
+    """导出最低成本配方（传入 start/end 时导出区间内每天的最低成本配方）"""
     target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    start_date = request.args.get('start', '')
+    end_date = request.args.get('end', '')
+    
+    if start_date and end_date:
+        try:
+            cost_timeline.parse_date_range(start_date, end_date)
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('lowest_cost_today'))
+        filename = f"最低成本配方_{start_date}_{end_date}.xlsx"
+        return cached_xlsx_response('lowest-cost-range', (start_date, end_date), filename,
+                                    lambda: [export_stream.lowest_cost_range_sheet(start_date, end_date)])
     
     filename = f"最低成本配方_{target_date}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response('lowest-cost', (target_date,), filename,
+                                    lambda: [export_stream.lowest_cost_sheet(target_date)])
+    
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_lowest_cost_to_excel(target_date, filepath)
@@ -261,6 +528,12 @@ def export_materials_detail():
     formula_type = request.args.get('type', '')
     
     filename = f"配方原料明细_{target_date}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response(
+            'materials-detail', (target_date, search_keyword, formula_type), filename,
+            lambda: [export_stream.materials_detail_sheet(target_date, search_keyword, formula_type)])
+    
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_materials_detail_to_excel(target_date, search_keyword, formula_type, filepath)
@@ -280,6 +553,11 @@ def export_materials_library():
     search_keyword = request.args.get('search', '')
     
     filename = f"原料库_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response('materials-library', (search_keyword,), filename,
+                                    lambda: [export_stream.materials_library_sheet(search_keyword)])
+    
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_materials_library_to_excel(search_keyword, filepath)
@@ -300,9 +578,15 @@ def export_material_price_history():
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
     
+    filename = f"原料价格历史_{material_code}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response(
+            'material-price-history', (material_code, start_date, end_date), filename,
+            lambda: [export_stream.price_history_sheet(material_code, start_date, end_date)])
+    
     from export_data import export_material_price_history_to_excel
     
-    filename = f"原料价格历史_{material_code}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_material_price_history_to_excel(material_code, start_date, end_date, filepath)
@@ -322,6 +606,11 @@ def export_customer_demands():
     date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
     
     filename = f"客户需求_{date}.xlsx"
+    
+    if app.config['STREAMING_EXPORT']:
+        return cached_xlsx_response('customer-demands', (date,), filename,
+                                    lambda: [export_stream.customer_demands_sheet(date)])
+    
     filepath = os.path.join(app.config['EXPORT_FOLDER'], filename)
     
     success, message = export_customer_demands_to_excel(date, filepath)
@@ -346,7 +635,7 @@ def add_formula_page():
 def add_formula():
     """处理添加配方"""
     try:
-        conn = get_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 获取配方基本信息
@@ -384,8 +673,12 @@ def add_formula():
                 ''', (formula_id, material_codes[i], material_names[i], 
                       material_models[i], float(usage_ratios[i])))
         
+        update_formula_hash(cursor, formula_id)
+        bump_data_version(cursor)
         conn.commit()
-        conn.close()
+        cost_engine.invalidate()
+        cost_snapshot.refresh_formula(formula_id)
+        optimize_cache.invalidate_formula(formula_id)
         
         flash(f'配方添加成功！配方ID: {formula_id}', 'success')
         return redirect(url_for('formula_list'))
@@ -403,7 +696,7 @@ def add_material_page():
 def add_material():
     """处理添加原料价格"""
     try:
-        conn = get_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         material_code = request.form.get('material_code')
@@ -420,11 +713,18 @@ def add_material():
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (price_date, material_code, material_name, material_model, 
               unit_price, datetime.now().strftime('%Y-%m-%d')))
+        old_prices = price_impact.capture_pending_prices(cursor, price_date)
+        price_intervals.refresh_dirty(cursor)
+        changes = price_impact.collect_changes(cursor, old_prices, price_date)
+        bump_data_version(cursor)
         
         conn.commit()
-        conn.close()
+        price_index.invalidate_material(material_code)
+        cost_snapshot.refresh_material(material_code, price_date)
+        optimize_cache.invalidate_prices([material_code], price_date)
         
         flash(f'原料价格添加成功！原料: {material_code} - {material_name}', 'success')
+        flash_impact_report(price_impact.create_report(changes, price_date, '添加价格'))
         return redirect(url_for('materials_library'))
         
     except Exception as e:
@@ -440,7 +740,7 @@ def add_demand_page():
 def add_demand():
     """处理添加客户需求（实际上是添加配方）"""
     try:
-        conn = get_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # 客户需求就是配方+产品信息
@@ -487,8 +787,12 @@ def add_demand():
                 ''', (formula_id, material_codes[i], material_names[i], 
                       material_models[i], float(usage_ratios[i])))
         
+        update_formula_hash(cursor, formula_id)
+        bump_data_version(cursor)
         conn.commit()
-        conn.close()
+        cost_engine.invalidate()
+        cost_snapshot.refresh_formula(formula_id)
+        optimize_cache.invalidate_formula(formula_id)
         
         flash(f'客户需求添加成功！配方ID: {formula_id}', 'success')
         return redirect(url_for('customer_demands'))
@@ -505,23 +809,16 @@ def add_demand():
 def edit_formula(formula_id):
     """编辑配方"""
     if request.method == 'GET':
-        from data_manager import get_formula_by_id, get_all_products
+        from data_manager import get_formula_by_id
         formula = get_formula_by_id(formula_id)
         
         if not formula:
             flash('配方不存在', 'danger')
             return redirect(url_for('formula_list'))
         
-        # 获取所有产品用于下拉选择
-        products = get_all_products()
-        
-        # 获取所有原料用于选择
-        materials_list = get_all_materials()
-        
+        # 产品和原料选择改为输入联想（/api/products/suggest、/api/materials/suggest），不再整表渲染
         return render_template('edit_formula.html',
                              formula=formula,
-                             products=products,
-                             materials_list=materials_list,
                              current_date=datetime.now().strftime('%Y-%m-%d'))
     
     else:  # POST
@@ -559,6 +856,11 @@ def edit_formula(formula_id):
             success, message = update_formula(formula_id, data)
             
             if success:
+                refresh_formula_hash(formula_id)
+                bump_data_version()
+                cost_engine.invalidate()
+                cost_snapshot.refresh_formula(formula_id)
+                optimize_cache.invalidate_formula(formula_id)
                 flash(message, 'success')
                 return redirect(url_for('formula_list'))
             else:
@@ -578,6 +880,10 @@ def delete_formula_route(formula_id):
         success, message = delete_formula(formula_id)
         
         if success:
+            bump_data_version()
+            cost_engine.invalidate()
+            cost_snapshot.refresh_formula(formula_id)
+            optimize_cache.invalidate_formula(formula_id)
             flash(message, 'success')
         else:
             flash(message, 'danger')
@@ -598,11 +904,21 @@ def edit_material_price():
         price_date = request.form['price_date']
         material_code = request.form['material_code']
         new_price = float(request.form['unit_price'])
+        old_price = price_intervals.get_price_as_of(material_code, price_date)
         
         success, message = update_material_price(price_date, material_code, new_price)
         
         if success:
+            cursor = get_db().cursor()
+            price_intervals.refresh_dirty(cursor)
+            changes = price_impact.collect_changes(cursor, {material_code: old_price}, price_date)
+            get_db().commit()
+            bump_data_version()
+            price_index.invalidate_material(material_code)
+            cost_snapshot.refresh_material(material_code, price_date)
+            optimize_cache.invalidate_prices([material_code], price_date)
             flash(message, 'success')
+            flash_impact_report(price_impact.create_report(changes, price_date, '修改价格'))
         else:
             flash(message, 'danger')
     
@@ -623,6 +939,11 @@ def delete_material_price_route():
         success, message = delete_material_price(price_date, material_code)
         
         if success:
+            price_intervals.refresh_dirty()
+            bump_data_version()
+            price_index.invalidate_material(material_code)
+            cost_snapshot.refresh_material(material_code, price_date)
+            optimize_cache.invalidate_prices([material_code], price_date)
             flash(message, 'success')
         else:
             flash(message, 'danger')
@@ -633,19 +954,108 @@ def delete_material_price_route():
     return redirect(url_for('material_detail', material_code=material_code))
 
 
+# ==================== 价格假设模拟 ====================
+
+@app.route('/price-scenario', methods=['GET', 'POST'])
+def price_scenario_page():
+    """调价模拟页面：每行 "原料编码,8%" 或 "原料编码,12.5"，结果不写入数据库"""
+    target_date = request.values.get('date', datetime.now().strftime('%Y-%m-%d'))
+    override_text = request.form.get('overrides', '')
+    result = None
+    
+    if request.method == 'POST':
+        try:
+            overrides = price_scenario.parse_override_text(override_text)
+            if not overrides:
+                raise ValueError('请至少填写一项调价')
+            result = price_scenario.simulate(target_date, overrides)
+        except ValueError as e:
+            flash(str(e), 'danger')
+    
+    return render_template('price_scenario.html',
+                         result=result,
+                         override_text=override_text,
+                         target_date=target_date,
+                         current_date=datetime.now().strftime('%Y-%m-%d'))
+
+
+@app.route('/api/price-scenario', methods=['POST'])
+def api_price_scenario():
+    """调价模拟接口：{"date": "...", "overrides": [{"material_code": ..., "change_pct"|"unit_price": ...}], "top_n": 50}"""
+    payload = request.get_json(silent=True) or {}
+    target_date = payload.get('date') or datetime.now().strftime('%Y-%m-%d')
+    try:
+        overrides = price_scenario.parse_overrides(payload.get('overrides'))
+        top_n = int(payload.get('top_n') or price_scenario.DEFAULT_TOP_N)
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    result = price_scenario.simulate(target_date, overrides, top_n)
+    return jsonify({'success': True, **result})
+
+
+# ==================== 价格变动影响报告 ====================
+
+@app.route('/price-impact')
+def price_impact_list():
+    """价格变动影响报告列表"""
+    reports = price_impact.get_recent_reports()
+    if wants_json():
+        return jsonify({'success': True, 'reports': reports})
+    return render_template('price_impact_list.html', reports=reports)
+
+
+@app.route('/price-impact/<int:report_id>')
+def price_impact_detail(report_id):
+    """影响报告详情，?threshold= 为变化幅度阈值（%）"""
+    threshold = request.args.get('threshold', price_impact.DEFAULT_THRESHOLD_PCT, type=float)
+    report = price_impact.get_report(report_id, threshold)
+    if report is None:
+        if wants_json():
+            return jsonify({'success': False, 'message': '报告不存在'}), 404
+        flash('报告不存在', 'danger')
+        return redirect(url_for('price_impact_list'))
+    if wants_json():
+        return jsonify({'success': True, **report})
+    return render_template('price_impact_detail.html', report=report)
+
+
+@app.route('/price-impact/<int:report_id>/export')
+def export_price_impact(report_id):
+    """下载影响报告Excel"""
+    threshold = request.args.get('threshold', price_impact.DEFAULT_THRESHOLD_PCT, type=float)
+    report = price_impact.get_report(report_id, threshold)
+    if report is None:
+        flash('报告不存在', 'danger')
+        return redirect(url_for('price_impact_list'))
+    filename = f"价格变动影响_{report['price_date']}_{report_id}.xlsx"
+    return xlsx_response(filename, price_impact.report_sheets(report))
+
+
 # ==================== 配方优化功能 ====================
 
+def rules_changed(material_codes):
+    """替换规则或分组修改后：递增规则版本，增量更新替换关系图，失效相关的优化结果"""
+    bump_rule_version()
+    substitution_graph.refresh()
+    optimize_cache.invalidate_rules(material_codes)
+
+
+def group_member_codes(group_id):
+    """分组当前成员的原料编码（用于失效优化结果缓存）"""
+    group = get_group_with_members(group_id) or {}
+    return [member['material_code'] for member in group.get('members', [])]
+
+
 @app.route('/substitution-rules')
 def substitution_rules():
     """原料替换规则管理页面"""
     groups = get_all_material_groups()
     substitutions = get_all_substitutions()
-    all_materials = get_all_materials_for_selection()
     
+    # 原料选择通过 /api/materials/suggest 输入联想
     return render_template('substitution_rules.html',
                          groups=groups,
-                         substitutions=substitutions,
-                         all_materials=all_materials)
+                         substitutions=substitutions)
 
 
 @app.route('/substitution-rules/add-group', methods=['POST'])
@@ -671,9 +1081,11 @@ def add_material_group():
 @app.route('/substitution-rules/delete-group/<int:group_id>', methods=['POST'])
 def delete_group(group_id):
     """删除原料分组"""
+    member_codes = group_member_codes(group_id)
     success, message = delete_material_group(group_id)
     
     if success:
+        rules_changed(member_codes)
         flash(message, 'success')
     else:
         flash(message, 'danger')
@@ -690,11 +1102,9 @@ def manage_group(group_id):
         flash('分组不存在', 'danger')
         return redirect(url_for('substitution_rules'))
     
-    all_materials = get_all_materials_for_selection()
-    
+    # 原料选择通过 /api/materials/suggest 输入联想
     return render_template('manage_group.html',
-                         group=group,
-                         all_materials=all_materials)
+                         group=group)
 
 
 @app.route('/substitution-rules/add-member', methods=['POST'])
@@ -712,6 +1122,7 @@ def add_group_member():
     success, message = add_member_to_group(group_id, material_code, '', conversion_factor, priority)
     
     if success:
+        rules_changed(group_member_codes(group_id))
         flash(message, 'success')
     else:
         flash(message, 'danger')
@@ -723,10 +1134,12 @@ def add_group_member():
 def remove_group_member(member_id):
     """从分组移除原料"""
     group_id = request.form.get('group_id', type=int)
+    member_codes = group_member_codes(group_id) if group_id else None
     
     success, message = remove_member_from_group(member_id)
     
     if success:
+        rules_changed(member_codes)
         flash(message, 'success')
     else:
         flash(message, 'danger')
@@ -756,6 +1169,7 @@ def add_substitution_rule():
     success, message = add_substitution(source_code, target_code, conversion_factor, max_ratio, notes)
     
     if success:
+        rules_changed([source_code])
         flash(message, 'success')
     else:
         flash(message, 'danger')
@@ -766,9 +1180,11 @@ def add_substitution_rule():
 @app.route('/substitution-rules/delete-substitution/<int:sub_id>', methods=['POST'])
 def delete_substitution_rule(sub_id):
     """删除替换规则"""
+    source_codes = [rule['source_code'] for rule in get_all_substitutions() if rule['id'] == sub_id]
     success, message = delete_substitution(sub_id)
     
     if success:
+        rules_changed(source_codes or None)
         flash(message, 'success')
     else:
         flash(message, 'danger')
@@ -776,31 +1192,71 @@ def delete_substitution_rule(sub_id):
     return redirect(url_for('substitution_rules'))
 
 
+@app.route('/api/substitutes/<material_code>')
+def api_substitutes(material_code):
+    """原料的全部替代品（含多步替代）及指定日期最便宜的替代品，?date="""
+    target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    candidates = substitution_graph.get_graph().get_candidates(material_code)
+    return jsonify({
+        'success': True,
+        'material_code': material_code,
+        'target_date': target_date,
+        'candidates': [{
+            'target_code': target,
+            'conversion_factor': factor,
+            'max_ratio': max_ratio,
+            'path': list(path)
+        } for target, factor, max_ratio, path in candidates],
+        'cheapest': substitution_graph.cheapest_substitute(material_code, target_date)
+    })
+
+
+@app.route('/api/substitution-graph')
+def api_substitution_graph():
+    """替换关系图统计和替换环（含换算系数不一致的环）"""
+    graph = substitution_graph.get_graph()
+    return jsonify({'success': True, 'stats': graph.stats(), 'cycles': graph.cycles})
+
+
 @app.route('/optimize-formula')
 def optimize_formula_page():
     """配方优化页面"""
     search_keyword = request.args.get('search', '')
     target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
     formula_id = request.args.get('formula_id', type=int)
+    mode = request.args.get('mode', '')
     
-    # 获取报价配方列表
-    quotation_formulas = get_quotation_formulas_for_optimization()
-    
-    # 如果有搜索关键词，过滤配方
+    # 获取报价配方列表，有搜索关键词时走全文索引
     if search_keyword:
-        quotation_formulas = [f for f in quotation_formulas 
-                            if search_keyword.lower() in f['product_code'].lower() 
-                            or search_keyword.lower() in f['product_name'].lower()]
+        quotation_formulas = search_formulas(search_keyword, formula_type='报价配方')
+    else:
+        quotation_formulas = get_quotation_formulas_for_optimization()
     
     # 如果选择了配方，执行优化
     selected_formula = None
     if formula_id:
-        result, message = optimize_formula(formula_id, target_date)
+        result, message = optimize_cache.get_or_compute(
+            formula_id, target_date, 'greedy', lambda: optimize_formula(formula_id, target_date))
         if result:
             selected_formula = result
         else:
             flash(message, 'danger')
     
+    # 线性规划 / 混合整数规划模式，结果与贪心优化并列显示；?tolerance= 为总用量允许偏差比例（none 不限制）
+    lp_result = None
+    try:
+        usage_tolerance, cache_suffix = formula_lp.parse_usage_tolerance(request.args.get('tolerance'))
+    except ValueError as e:
+        flash(f'总用量偏差比例无效: {str(e)}', 'danger')
+        usage_tolerance, cache_suffix = formula_lp.TOTAL_USAGE_TOLERANCE, ''
+    if formula_id and mode in formula_lp.MODES:
+        lp_result, lp_message = optimize_cache.get_or_compute(
+            formula_id, target_date, mode + cache_suffix,
+            lambda: formula_lp.optimize_formula_lp(formula_id, target_date, mode,
+                                                   usage_tolerance=usage_tolerance))
+        if not lp_result:
+            flash(lp_message, 'danger')
+    
     # 获取统计信息
     groups = get_all_material_groups()
     substitutions = get_all_substitutions()
@@ -817,10 +1273,48 @@ def optimize_formula_page():
                          selected_formula=selected_formula,
                          search_keyword=search_keyword,
                          target_date=target_date,
+                         mode=mode,
+                         lp_result=lp_result,
+                         usage_tolerance=usage_tolerance,
                          stats=stats,
                          optimization_history=optimization_history)
 
 
+@app.route('/api/optimize-formula/<int:formula_id>/lp')
+def api_optimize_formula_lp(formula_id):
+    """
+    线性规划优化接口，?mode=lp|milp&date=&tolerance=，返回求解耗时、MIP gap 及与贪心基准的对比
+    tolerance 为替换后总用量允许偏离原总用量的比例（默认 TOTAL_USAGE_TOLERANCE，none 为不限制）
+    """
+    target_date = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+    mode = request.args.get('mode', 'lp')
+    if mode not in formula_lp.MODES:
+        return jsonify({'success': False, 'message': f'不支持的优化模式: {mode}'}), 400
+    try:
+        usage_tolerance, cache_suffix = formula_lp.parse_usage_tolerance(request.args.get('tolerance'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'总用量偏差比例无效: {str(e)}'}), 400
+    result, message = optimize_cache.get_or_compute(
+        formula_id, target_date, mode + cache_suffix,
+        lambda: formula_lp.optimize_formula_lp(formula_id, target_date, mode,
+                                               usage_tolerance=usage_tolerance))
+    if not result:
+        return jsonify({'success': False, 'message': message}), 400
+    return jsonify({'success': True, **result})
+
+
+@app.route('/optimize-formula/batch', methods=['POST'])
+def batch_optimize_formulas():
+    """后台批量优化全部报价配方，结果（节省排名）通过 /jobs/<id> 查询"""
+    target_date = request.form.get('target_date') or datetime.now().strftime('%Y-%m-%d')
+    mode = request.form.get('mode', 'greedy')
+    if mode not in formula_lp.SOLVE_MODES:
+        flash(f'不支持的优化模式: {mode}', 'danger')
+        return redirect(url_for('optimize_formula_page'))
+    job_id = submit_batch_optimize_job(target_date, mode)
+    return job_submitted_response(job_id)
+
+
 @app.route('/optimize-formula/apply', methods=['POST'])
 def apply_optimization():
     """应用优化结果生成生产配方"""
@@ -831,8 +1325,9 @@ def apply_optimization():
         flash('参数错误', 'danger')
         return redirect(url_for('optimize_formula_page'))
     
-    # 先执行优化
-    result, message = optimize_formula(formula_id, target_date)
+    # 优先使用页面上刚展示过的优化结果
+    result, message = optimize_cache.get_or_compute(
+        formula_id, target_date, 'greedy', lambda: optimize_formula(formula_id, target_date))
     
     if not result:
         flash(f'优化失败: {message}', 'danger')
@@ -845,10 +1340,21 @@ def apply_optimization():
         flash(f'保存失败: {save_message}', 'danger')
         return redirect(url_for('optimize_formula_page'))
     
-    # 应用优化结果创建生产配方
+    # 应用优化结果创建生产配方；记下此前的最大配方ID，之后只为新建的配方计算哈希
+    cursor = get_db().cursor()
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM formulas')
+    last_formula_id = cursor.fetchone()[0]
     success, apply_message = apply_optimized_formula(opt_id)
     
     if success:
+        cursor.execute('SELECT id FROM formulas WHERE id > ? AND content_hash IS NULL',
+                       (last_formula_id,))
+        for (new_formula_id,) in cursor.fetchall():
+            refresh_formula_hash(new_formula_id)
+        bump_data_version()
+        cost_engine.invalidate()
+        cost_snapshot.sync_new_formulas()
+        optimize_cache.sync_version()
         flash(f'生产配方生成成功！{apply_message}', 'success')
     else:
         flash(f'生成失败: {apply_message}', 'danger')
@@ -858,12 +1364,82 @@ def apply_optimization():
 
 # ==================== AI助手功能 ====================
 
+def ai_job_owner():
+    """当前会话的AI任务归属标识（用于每会话并发限制）"""
+    if 'ai_owner' not in session:
+        session['ai_owner'] = uuid.uuid4().hex
+    return session['ai_owner']
+
+
+def submit_ai_job(kind, work):
+    """提交AI后台任务：JSON客户端返回任务编号和事件流地址，页面提交则提示后返回助手页面"""
+    try:
+        job_id = ai_jobs.submit(kind, ai_job_owner(), work)
+    except ai_jobs.JobRejected as e:
+        if wants_json():
+            return jsonify({'success': False, 'message': str(e)}), 429
+        flash(str(e), 'warning')
+        return redirect(url_for('ai_assistant'))
+    
+    session['ai_job_ids'] = (session.get('ai_job_ids', []) + [job_id])[-10:]
+    if wants_json():
+        return jsonify({'success': True,
+                        'job_id': job_id,
+                        'status_url': url_for('ai_job_status', job_id=job_id),
+                        'stream_url': url_for('ai_job_stream', job_id=job_id)}), 202
+    flash('AI任务已提交，结果将在页面上实时显示', 'info')
+    return redirect(url_for('ai_assistant'))
+
+
+def collect_ai_jobs():
+    """把已结束的AI任务结果写入会话，返回仍在进行的任务编号"""
+    pending = []
+    for job_id in session.get('ai_job_ids', []):
+        job = ai_jobs.get_job(job_id)
+        if job is None:
+            continue
+        if not job['finished']:
+            pending.append(job_id)
+            continue
+        if job['kind'] == 'chat':
+            content = job['result']['content'] if job['status'] == 'done' else f"抱歉，出错了: {job['message']}"
+            session['chat_history'] = (session.get('chat_history', []) +
+                                       [{'role': 'assistant', 'content': content}])[-20:]
+        elif job['status'] == 'done':
+            session['ai_result'] = job['result']
+        else:
+            flash(f"AI分析失败: {job['message']}", 'danger')
+            session['ai_result'] = None
+    session['ai_job_ids'] = pending
+    return pending
+
+
+@app.route('/ai-assistant/jobs/<job_id>')
+def ai_job_status(job_id):
+    """查询AI任务状态和结果"""
+    job = ai_jobs.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/ai-assistant/jobs/<job_id>/stream')
+def ai_job_stream(job_id):
+    """AI任务事件流（Server-Sent Events）：status / token / done"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    events = ai_jobs.stream_events(job_id, last_event_id)
+    if events is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/ai-assistant')
 def ai_assistant():
     """AI配方助手页面"""
     # 获取API配置状态
     config = get_api_config()
-    api_configured = bool(config['api_key'])
+    api_configured = bool(config['api_key']) or current_provider() == llm_cache.STUB_PROVIDER
     
     # 获取统计信息
     materials = get_all_materials_for_selection()
@@ -878,18 +1454,22 @@ def ai_assistant():
         'groups_count': len(groups)
     }
     
+    # 已完成的后台AI任务结果并入会话，未完成的由页面通过 SSE 接收
+    pending_ai_jobs = collect_ai_jobs()
+    
     # 获取session中的对话历史和AI结果
     chat_history = session.get('chat_history', [])
     ai_result = session.get('ai_result', None)
     
     return render_template('ai_assistant.html',
                          api_configured=api_configured,
-                         current_provider=LLM_CONFIG['provider'],
+                         current_provider=current_provider(),
                          current_api_key=config['api_key'][:10] + '***' if config['api_key'] else '',
                          stats=stats,
                          formulas=formulas[:100],  # 限制数量
                          chat_history=chat_history[-10:],  # 只显示最近10条
-                         ai_result=ai_result)
+                         ai_result=ai_result,
+                         pending_ai_jobs=pending_ai_jobs)
 
 
 @app.route('/ai-assistant/settings', methods=['POST'])
@@ -899,7 +1479,9 @@ def save_api_settings():
     api_key = request.form.get('api_key', '').strip()
     
     set_provider(provider)
-    if api_key:
+    if provider == llm_cache.STUB_PROVIDER:
+        flash('已切换到本地模拟（不调用远程接口）', 'success')
+    elif api_key:
         set_api_key(api_key, provider)
         flash(f'API设置已保存！当前使用: {provider}', 'success')
     else:
@@ -908,25 +1490,37 @@ def save_api_settings():
     return redirect(url_for('ai_assistant'))
 
 
+@app.route('/ai-assistant/cache')
+def ai_cache_stats():
+    """AI响应缓存命中统计"""
+    return jsonify({'success': True, 'stats': llm_cache.get_stats()})
+
+
+@app.route('/ai-assistant/cache/clear', methods=['POST'])
+def ai_cache_clear():
+    """清空AI响应缓存"""
+    llm_cache.clear()
+    if wants_json():
+        return jsonify({'success': True})
+    flash('AI响应缓存已清空', 'info')
+    return redirect(url_for('ai_assistant'))
+
+
 @app.route('/ai-assistant/suggest-rules', methods=['POST'])
 def ai_suggest_rules():
     """AI分析原料库，建议替换规则"""
     materials = get_all_materials_for_selection()
+    existing_rules = get_all_substitutions()
     
-    success, summary, result = ai_suggest_substitutions(materials)
+    # 原料库按相似度分桶，各桶并发分析后合并去重
+    def work(job):
+        success, summary, result = suggest_buckets.suggest_substitutions(
+            materials, existing_rules,
+            progress=lambda done, total: job.emit('progress', {'done': done, 'total': total}),
+            remaining=job.remaining)
+        return success, summary, {'type': 'suggestions', 'summary': summary, 'data': result}
     
-    if success:
-        session['ai_result'] = {
-            'type': 'suggestions',
-            'summary': summary,
-            'data': result
-        }
-        flash('AI分析完成！请查看下方建议。', 'success')
-    else:
-        flash(f'AI分析失败: {summary}', 'danger')
-        session['ai_result'] = None
-    
-    return redirect(url_for('ai_assistant'))
+    return submit_ai_job('suggestions', work)
 
 
 @app.route('/ai-assistant/optimize', methods=['POST'])
@@ -940,14 +1534,13 @@ def ai_optimize():
         return redirect(url_for('ai_assistant'))
     
     # 获取配方信息
-    conn = get_connection()
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT id, product_code, product_name, customer_product_name, formula_type
         FROM formulas WHERE id = ?
     ''', (formula_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if not row:
         flash('配方不存在', 'danger')
@@ -967,21 +1560,13 @@ def ai_optimize():
     # 获取所有可用原料
     all_materials = get_all_materials_for_selection()
     
-    # 调用AI优化
-    success, notes, result = ai_optimize_formula(formula_info, materials, all_materials, requirements)
-    
-    if success:
-        session['ai_result'] = {
-            'type': 'optimization',
-            'notes': notes,
-            'data': result
-        }
-        flash('AI优化分析完成！', 'success')
-    else:
-        flash(f'AI优化失败: {notes}', 'danger')
-        session['ai_result'] = None
+    # 后台调用AI优化
+    def work(job):
+        success, notes, result = ai_optimize_formula(formula_info, materials, all_materials, requirements,
+                                                     timeout=job.remaining())
+        return success, notes, {'type': 'optimization', 'notes': notes, 'data': result}
     
-    return redirect(url_for('ai_assistant'))
+    return submit_ai_job('optimization', work)
 
 
 @app.route('/ai-assistant/chat', methods=['POST'])
@@ -1006,18 +1591,19 @@ def ai_chat():
         'recent_materials': [m['material_name'] for m in materials[:20]]
     }
     
-    # 调用AI
-    success, response = ai_chat_assistant(message, context)
-    
-    if success:
-        chat_history.append({'role': 'assistant', 'content': response})
-    else:
-        chat_history.append({'role': 'assistant', 'content': f'抱歉，出错了: {response}'})
-    
-    # 保存对话历史（只保留最近20条）
+    # 保存对话历史（只保留最近20条），回复由后台任务流式生成
     session['chat_history'] = chat_history[-20:]
     
-    return redirect(url_for('ai_assistant'))
+    def work(job):
+        for kind, data in ai_chat_assistant_stream(message, context, timeout=job.remaining()):
+            job.check_deadline()
+            if kind == 'token':
+                job.emit('token', {'text': data})
+            else:
+                success, response = data
+        return success, '' if success else response, {'type': 'chat', 'content': response}
+    
+    return submit_ai_job('chat', work)
 
 
 @app.route('/ai-assistant/apply-suggestion', methods=['POST'])
@@ -1034,6 +1620,7 @@ def apply_ai_suggestion():
     success, message = add_substitution(source_code, target_code, conversion_factor, 1.0, 'AI建议')
     
     if success:
+        rules_changed([source_code])
         flash(f'已采纳: {message}', 'success')
     else:
         flash(message, 'warning')
@@ -1053,5 +1640,14 @@ def clear_chat_history():
 if __name__ == '__main__':
     init_database()
     init_optimizer_tables()  # 初始化优化器表
+    init_data_version_table()  # 数据版本号（导出缓存失效）
+    init_formula_hash_column()  # 配方内容哈希列（首次运行时回填）
+    cost_snapshot.init_snapshot_tables()  # 初始化成本快照表
+    init_pagination_indexes()  # 配方分页排序索引
+    init_search_index()  # 全文检索索引（原料/产品/配方）
+    init_price_intervals()  # 原料价格区间（首次运行时由历史价格生成）
+    price_impact.init_price_impact_tables()  # 价格变动影响报告
+    init_jobs_table()  # 初始化导入任务表
+    init_llm_cache()  # AI响应缓存
     app.run(host='0.0.0.0', port=8080, debug=True)
 
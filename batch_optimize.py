@@ -0,0 +1,304 @@
+"""
+批量优化全部报价配方
+主进程一次性读取报价配方、原料用量、目标日期的时点价格和替换规则，作为共享快照
+在进程池启动时传给每个工作进程；工作进程只做计算，不访问数据库。
+有节省的结果由主进程在一个事务中写入本模块的 batch_optimization_runs / batch_optimization_results 表
+（保留 LP 结果的用量、替换明细和求解状态，不转换为贪心优化的结果格式），并输出按节省金额排序的报告。
+
+用法:
+    python3 batch_optimize.py [--date 2025-01-01] [--mode greedy|lp|milp] [--workers 4] [--top 50] [--no-save]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from db_pool import pooled_connection
+import price_index
+import formula_lp
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+# 每个任务包含的配方数
+BATCH_SIZE = 200
+DEFAULT_TOP_N = 50
+MODES = formula_lp.SOLVE_MODES
+
+# 工作进程内的共享快照
+_snapshot = None
+
+
+def load_snapshot(target_date):
+    """
+    读取批量优化所需的全部数据
+    返回 (formulas, prices, rules)，formulas 为 [(配方行, [(原料编码, 原料名称, 用量比例), ...]), ...]
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, product_code, product_name, formula_type, quotation_no
+            FROM formulas
+            WHERE formula_type = '报价配方'
+            ORDER BY id
+        ''')
+        formulas = {row[0]: (tuple(row), []) for row in cursor.fetchall()}
+        cursor.execute('''
+            SELECT fm.formula_id, fm.material_code, fm.material_name, fm.usage_ratio
+            FROM formula_materials fm
+            JOIN formulas f ON f.id = fm.formula_id
+            WHERE f.formula_type = '报价配方'
+            ORDER BY fm.formula_id, fm.id
+        ''')
+        for formula_id, material_code, material_name, usage_ratio in cursor.fetchall():
+            formulas[formula_id][1].append((material_code, material_name, usage_ratio))
+
+    rules = formula_lp.load_rule_snapshot()
+    codes = {code for _, materials in formulas.values() for code, _, _ in materials}
+    codes |= {target for source in codes for target, _, _ in rules.get(source, [])}
+    prices = price_index.get_prices_as_of(target_date, codes)
+    return list(formulas.values()), prices, rules
+
+
+def init_batch_tables():
+    """初始化批量优化结果表"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_optimization_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                target_date TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                formula_count INTEGER NOT NULL,
+                total_saving REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS batch_optimization_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER NOT NULL,
+                formula_id INTEGER NOT NULL,
+                solver TEXT,
+                status TEXT,
+                mip_gap REAL,
+                original_cost REAL NOT NULL,
+                optimized_cost REAL NOT NULL,
+                saving REAL NOT NULL,
+                materials TEXT NOT NULL,
+                substitutions TEXT NOT NULL,
+                UNIQUE (run_id, formula_id)
+            )
+        ''')
+        conn.commit()
+
+
+def _init_worker(prices, rules, target_date, mode):
+    global _snapshot
+    _snapshot = (prices, rules, target_date, mode)
+
+
+def _optimize_batch(batch):
+    """在工作进程中优化一批配方，返回 [(formula_id, 结果或None, 消息), ...]"""
+    prices, rules, target_date, mode = _snapshot
+    results = []
+    for formula, materials in batch:
+        try:
+            result, message = formula_lp.solve_formula(formula, materials, prices, rules,
+                                                       target_date, mode)
+        except Exception as e:
+            result, message = None, f'优化失败: {str(e)}'
+        results.append((formula[0], result, message))
+    return results
+
+
+def save_results(target_date, mode, formula_count, results, progress=None):
+    """
+    在一个事务中保存本次批量优化和全部结果（formula_lp.solve_formula 的结果字典）
+    返回 (批次ID, {formula_id: 结果记录ID})；写入失败时整批回滚并抛出异常
+    """
+    saved = {}
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            INSERT INTO batch_optimization_runs (target_date, mode, formula_count, total_saving)
+            VALUES (?, ?, ?, ?)
+        ''', (target_date, mode, formula_count, round(sum(r['saving'] for r in results), 4)))
+        run_id = cursor.lastrowid
+        for i, result in enumerate(results, 1):
+            cursor.execute('''
+                INSERT INTO batch_optimization_results
+                (run_id, formula_id, solver, status, mip_gap, original_cost, optimized_cost, saving,
+                 materials, substitutions)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (run_id, result['formula_id'], result['solver'], result['status'], result['mip_gap'],
+                  result['original_cost'], result['optimized_cost'], result['saving'],
+                  json.dumps(result['materials'], ensure_ascii=False),
+                  json.dumps(result['substitutions'], ensure_ascii=False)))
+            saved[result['formula_id']] = cursor.lastrowid
+            if progress:
+                progress(i)
+        conn.commit()
+    return run_id, saved
+
+
+def get_run_results(run_id):
+    """读取一次批量优化保存的结果，按节省金额从大到小排列"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, formula_id, solver, status, mip_gap, original_cost, optimized_cost, saving,
+                   materials, substitutions
+            FROM batch_optimization_results
+            WHERE run_id = ?
+            ORDER BY saving DESC, formula_id
+        ''', (run_id,))
+        rows = cursor.fetchall()
+    return [{
+        'id': row[0],
+        'formula_id': row[1],
+        'solver': row[2],
+        'status': row[3],
+        'mip_gap': row[4],
+        'original_cost': row[5],
+        'optimized_cost': row[6],
+        'saving': row[7],
+        'materials': json.loads(row[8]),
+        'substitutions': json.loads(row[9])
+    } for row in rows]
+
+
+def batch_optimize(target_date=None, mode='greedy', workers=DEFAULT_WORKERS,
+                   top_n=DEFAULT_TOP_N, save=True, progress=None):
+    """
+    在进程池中优化全部报价配方
+    save 为 True 时保存有节省的结果；progress 为可选回调 progress(phase, stats)
+    返回汇总和按节省金额排序的前 top_n 个配方
+    """
+    if mode not in MODES:
+        return {'success': False, 'message': f'不支持的优化模式: {mode}'}
+    target_date = target_date or datetime.now().strftime('%Y-%m-%d')
+    started = time.perf_counter()
+    stats = {'rows': 0, 'formulas_total': 0, 'saved': 0}
+
+    def report(phase):
+        if progress:
+            progress(phase, dict(stats))
+
+    report('loading')
+    if save:
+        init_batch_tables()
+    formulas, prices, rules = load_snapshot(target_date)
+    stats['formulas_total'] = len(formulas)
+    load_seconds = time.perf_counter() - started
+
+    # 优化阶段：快照随进程池初始化传给每个工作进程一次，任务只携带配方本身
+    report('optimizing')
+    results = []
+    failed = []
+    batches = [formulas[i:i + BATCH_SIZE] for i in range(0, len(formulas), BATCH_SIZE)]
+    with ProcessPoolExecutor(max_workers=max(1, workers),
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(prices, rules, target_date, mode)) as executor:
+        futures = [executor.submit(_optimize_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            for formula_id, result, message in future.result():
+                if result is None:
+                    failed.append({'formula_id': formula_id, 'message': message})
+                else:
+                    results.append(result)
+            stats['rows'] = len(results) + len(failed)
+            report('optimizing')
+    optimize_seconds = time.perf_counter() - started - load_seconds
+
+    improved = sorted((r for r in results if r['saving'] > 1e-9),
+                      key=lambda r: (-r['saving'], r['formula_id']))
+
+    # 保存阶段：单一写入者，一个事务
+    run_id = None
+    saved = {}
+    if save and improved:
+        def saving_progress(count):
+            stats['saved'] = count
+            report('saving')
+        try:
+            run_id, saved = save_results(target_date, mode, len(formulas), improved, saving_progress)
+        except Exception as e:
+            failed.append({'formula_id': None, 'message': f'保存失败: {str(e)}'})
+
+    top_savings = [{
+        'rank': rank,
+        'formula_id': r['formula_id'],
+        'product_code': r['product_code'],
+        'product_name': r['product_name'],
+        'quotation_no': r['quotation_no'],
+        'original_cost': r['original_cost'],
+        'optimized_cost': r['optimized_cost'],
+        'saving': r['saving'],
+        'saving_pct': round(r['saving'] / r['original_cost'] * 100, 2) if r['original_cost'] else None,
+        'substitution_count': len(r['substitutions']),
+        'result_id': saved.get(r['formula_id'])
+    } for rank, r in enumerate(improved[:top_n], 1)]
+
+    elapsed = time.perf_counter() - started
+    total_saving = sum(r['saving'] for r in improved)
+    message = (f'批量优化完成：{len(formulas)} 个报价配方，{len(improved)} 个可降低成本，'
+               f'合计节省 {total_saving:.4f}，耗时 {elapsed:.1f} 秒')
+    if save:
+        message += f'，已保存 {len(saved)} 个优化结果'
+    if failed:
+        message += f'，{len(failed)} 个失败'
+
+    return {
+        'success': True,
+        'message': message,
+        'target_date': target_date,
+        'mode': mode,
+        'rows': len(formulas),
+        'formula_count': len(formulas),
+        'improved_count': len(improved),
+        'saved_count': len(saved),
+        'run_id': run_id,
+        'total_saving': round(total_saving, 4),
+        'load_seconds': round(load_seconds, 3),
+        'optimize_seconds': round(optimize_seconds, 3),
+        'elapsed': round(elapsed, 3),
+        'failed': failed,
+        'top_savings': top_savings
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量优化全部报价配方')
+    parser.add_argument('--date', default=None, help='价格日期（默认今天）')
+    parser.add_argument('--mode', choices=MODES, default='greedy', help='优化模式')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='计算进程数')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP_N, help='报告列出的配方数')
+    parser.add_argument('--no-save', action='store_true', help='只输出报告，不保存优化结果')
+    args = parser.parse_args(argv)
+
+    result = batch_optimize(args.date, args.mode, args.workers, args.top, not args.no_save,
+                            progress=lambda phase, s: print(
+                                f"\r{phase}: {s['rows']}/{s['formulas_total']}", end='', flush=True))
+    print()
+    if not result['success']:
+        print(result['message'])
+        return 1
+
+    print(f"{'排名':>4} {'配方ID':>8} {'产品编码':<18} {'原成本':>12} {'优化后':>12} {'节省':>12} {'节省%':>8}")
+    for item in result['top_savings']:
+        pct = f"{item['saving_pct']:.2f}" if item['saving_pct'] is not None else '-'
+        print(f"{item['rank']:>4} {item['formula_id']:>8} {item['product_code'] or '':<18} "
+              f"{item['original_cost']:>12.4f} {item['optimized_cost']:>12.4f} "
+              f"{item['saving']:>12.4f} {pct:>8}")
+    for entry in result['failed']:
+        print(f"配方 {entry['formula_id'] or '-'}: {entry['message']}")
+    print(result['message'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+批量导入历史工作簿
+多个工作簿在进程池中并行解析，解析结果由单一写入者按日期顺序逐个提交，
+用于新站点一次性补录大量每日价格工作簿。
+
+用法:
+    python3 bulk_import.py 文件或目录 [文件或目录 ...] [--workers 4] [--import-date 2025-01-01]
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from db_pool import pooled_connection
+from formula_hash import init_formula_hash_column
+from data_version import init_data_version_table, bump_data_version
+import price_intervals
+from import_stream import read_workbook_records, write_records, latest_price_date, CHUNK_SIZE
+
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+_FILENAME_DATE = re.compile(r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})')
+
+
+def _date_from_filename(filepath):
+    match = _FILENAME_DATE.search(os.path.basename(filepath))
+    if not match:
+        return None
+    try:
+        return datetime(*map(int, match.groups())).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _parse_file(filepath):
+    """在解析进程中读取一个工作簿"""
+    started = time.perf_counter()
+    try:
+        formula_records, price_records = read_workbook_records(filepath)
+        error = None
+    except Exception as e:
+        formula_records, price_records = [], []
+        error = str(e)
+    return {
+        'filepath': filepath,
+        'formula_records': formula_records,
+        'price_records': price_records,
+        'parse_seconds': time.perf_counter() - started,
+        'error': error
+    }
+
+
+def expand_paths(paths):
+    """展开目录为其中的 xlsx 文件"""
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths.extend(sorted(glob.glob(os.path.join(path, '*.xlsx'))))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+
+def bulk_import(filepaths, import_date=None, workers=DEFAULT_WORKERS,
+                chunk_size=CHUNK_SIZE, progress=None):
+    """
+    并行解析、按日期顺序写入多个工作簿
+    import_date 为空时，每个文件的导入日期取其价格表中最晚的单据日期，
+    其次取文件名中的日期，都没有则取今天
+    progress 为可选回调 progress(phase, stats)
+    """
+    started = time.perf_counter()
+    total = len(filepaths)
+    stats = {'rows': 0, 'files_done': 0, 'files_total': total}
+
+    def report(phase):
+        if progress:
+            progress(phase, dict(stats))
+
+    # 解析阶段：进程池并行
+    parsed = []
+    report('parsing')
+    with ProcessPoolExecutor(max_workers=max(1, workers),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(_parse_file, path) for path in filepaths]
+        for future in as_completed(futures):
+            item = future.result()
+            item['import_date'] = (import_date
+                                   or latest_price_date(item['price_records'])
+                                   or _date_from_filename(item['filepath'])
+                                   or datetime.now().strftime('%Y-%m-%d'))
+            parsed.append(item)
+            stats['files_done'] += 1
+            report('parsing')
+
+    # 写入阶段：单一连接，按日期顺序每个文件一个事务
+    parsed.sort(key=lambda item: (item['import_date'], item['filepath']))
+    stats['files_done'] = 0
+    summary = []
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        for item in parsed:
+            entry = {
+                'file': os.path.basename(item['filepath']),
+                'import_date': item['import_date'],
+                'parse_seconds': round(item['parse_seconds'], 3),
+                'write_seconds': 0.0,
+                'rows': len(item['formula_records']) + len(item['price_records']),
+                'success': item['error'] is None,
+                'message': item['error'] or ''
+            }
+            if item['error'] is None:
+                write_started = time.perf_counter()
+                try:
+                    cursor.execute('BEGIN IMMEDIATE')
+                    file_stats = write_records(cursor, item['formula_records'], item['price_records'],
+                                               item['import_date'], chunk_size)
+                    price_intervals.refresh_dirty(cursor)
+                    bump_data_version(cursor)
+                    conn.commit()
+                    entry.update({k: file_stats[k] for k in
+                                  ('formulas', 'duplicate_formulas', 'material_rows', 'price_rows')})
+                    stats['rows'] += file_stats['rows']
+                except Exception as e:
+                    conn.rollback()
+                    entry['success'] = False
+                    entry['message'] = f'导入失败: {str(e)}'
+                entry['write_seconds'] = round(time.perf_counter() - write_started, 3)
+
+            # 释放已写入文件的记录
+            item['formula_records'] = item['price_records'] = None
+            summary.append(entry)
+            stats['files_done'] += 1
+            report('writing')
+
+    elapsed = time.perf_counter() - started
+    failed = [entry for entry in summary if not entry['success']]
+    message = (f'批量导入完成：{total - len(failed)}/{total} 个文件成功，'
+               f"共 {stats['rows']} 行，耗时 {elapsed:.1f} 秒")
+    if failed:
+        message += '；失败文件: ' + ', '.join(entry['file'] for entry in failed)
+
+    return {
+        'success': not failed,
+        'message': message,
+        'elapsed': round(elapsed, 3),
+        'rows': stats['rows'],
+        'files': summary
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量导入配方/价格工作簿')
+    parser.add_argument('paths', nargs='+', help='xlsx 文件或包含 xlsx 文件的目录')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='解析进程数')
+    parser.add_argument('--import-date', default=None, help='统一的导入日期（默认按文件内容推断）')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='每批写入行数')
+    args = parser.parse_args(argv)
+
+    filepaths = expand_paths(args.paths)
+    if not filepaths:
+        print('没有找到要导入的文件')
+        return 1
+
+    init_data_version_table()
+    price_intervals.init_price_intervals()
+    init_formula_hash_column()
+
+    result = bulk_import(filepaths, args.import_date, args.workers, args.chunk_size,
+                         progress=lambda phase, s: print(
+                             f"\r{phase}: {s['files_done']}/{s['files_total']}", end='', flush=True))
+    print()
+
+    print(f"{'文件':<40} {'日期':<12} {'行数':>8} {'解析(秒)':>9} {'写入(秒)':>9}  状态")
+    for entry in result['files']:
+        status = '成功' if entry['success'] else entry['message']
+        print(f"{entry['file']:<40} {entry['import_date']:<12} {entry['rows']:>8} "
+              f"{entry['parse_seconds']:>9.2f} {entry['write_seconds']:>9.2f}  {status}")
+    print(result['message'])
+    return 0 if result['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
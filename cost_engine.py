@@ -0,0 +1,225 @@
+"""
+批量成本计算引擎
+把 formula_materials 的用量比例一次性加载为 配方×原料 的稀疏矩阵（CSR），
+某一日期所有配方的总成本和缺失价格数各用一次矩阵-向量乘法得到。
+"""
+import threading
+import numpy as np
+from db_pool import pooled_connection
+import price_index
+
+_lock = threading.RLock()
+_matrix = None
+
+
+class FormulaMatrix:
+    """配方×原料 用量比例稀疏矩阵（CSR格式）"""
+
+    def __init__(self, formula_ids, formula_info, material_codes, indptr, indices, data):
+        self.formula_ids = formula_ids          # 行号 -> 配方ID
+        self.formula_info = formula_info        # 行号 -> 配方基本信息
+        self.material_codes = material_codes    # 列号 -> 原料编码
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        # 每个非零元素所在行，用于 bincount 求行和
+        self.row_of_nnz = np.repeat(np.arange(len(formula_ids)), np.diff(indptr))
+        self.row_by_formula = {fid: i for i, fid in enumerate(formula_ids)}
+        self.col_by_material = {code: j for j, code in enumerate(material_codes)}
+        self._column_order = None
+        self._column_ptr = None
+
+    @property
+    def shape(self):
+        return len(self.formula_ids), len(self.material_codes)
+
+    def matvec(self, vector):
+        """计算 矩阵 × 向量，返回每个配方的行和"""
+        return np.bincount(self.row_of_nnz,
+                           weights=self.data * vector[self.indices],
+                           minlength=len(self.formula_ids))
+
+    def count_nonzero(self, mask):
+        """统计每个配方中命中 mask 的原料行数（缺失价格数等）"""
+        return np.bincount(self.row_of_nnz,
+                           weights=mask[self.indices].astype(np.float64),
+                           minlength=len(self.formula_ids)).astype(np.int64)
+
+    def column_entries(self, col):
+        """使用某原料的 (行号数组, 用量比例数组)，按列的索引首次使用时构建"""
+        if self._column_order is None:
+            self._column_order = np.argsort(self.indices, kind='stable')
+            self._column_ptr = np.zeros(len(self.material_codes) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=len(self.material_codes)),
+                      out=self._column_ptr[1:])
+        positions = self._column_order[self._column_ptr[col]:self._column_ptr[col + 1]]
+        return self.row_of_nnz[positions], self.data[positions]
+
+    def price_vector(self, prices):
+        """把 {material_code: unit_price} 转为价格向量和缺失掩码"""
+        vector = np.zeros(len(self.material_codes), dtype=np.float64)
+        missing = np.ones(len(self.material_codes), dtype=bool)
+        for code, price in prices.items():
+            col = self.col_by_material.get(code)
+            if col is not None:
+                vector[col] = price
+                missing[col] = False
+        return vector, missing
+
+
+def _build_matrix():
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, product_code, product_name, customer_product_name,
+                   formula_type, quotation_no
+            FROM formulas
+            ORDER BY id
+        ''')
+        formula_rows = cursor.fetchall()
+
+        cursor.execute('''
+            SELECT formula_id, material_code, usage_ratio
+            FROM formula_materials
+            WHERE material_code IS NOT NULL AND material_code != ''
+            ORDER BY formula_id, id
+        ''')
+        material_rows = cursor.fetchall()
+
+    formula_ids = [row[0] for row in formula_rows]
+    formula_info = [{
+        'formula_id': row[0],
+        'product_code': row[1],
+        'product_name': row[2],
+        'customer_product_name': row[3],
+        'formula_type': row[4],
+        'quotation_no': row[5]
+    } for row in formula_rows]
+    row_by_formula = {fid: i for i, fid in enumerate(formula_ids)}
+
+    col_by_material = {}
+    counts = np.zeros(len(formula_ids), dtype=np.int64)
+    indices = []
+    data = []
+    for formula_id, material_code, usage_ratio in material_rows:
+        row = row_by_formula.get(formula_id)
+        if row is None:
+            continue
+        col = col_by_material.setdefault(material_code, len(col_by_material))
+        counts[row] += 1
+        indices.append(col)
+        data.append(float(usage_ratio or 0))
+
+    indptr = np.zeros(len(formula_ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    return FormulaMatrix(
+        formula_ids,
+        formula_info,
+        list(col_by_material),
+        indptr,
+        np.asarray(indices, dtype=np.int64),
+        np.asarray(data, dtype=np.float64)
+    )
+
+
+def get_formula_matrix():
+    """获取（必要时构建）配方×原料稀疏矩阵"""
+    global _matrix
+    with _lock:
+        if _matrix is None:
+            _matrix = _build_matrix()
+        return _matrix
+
+
+def invalidate():
+    """配方或配方原料变更后调用，下次计算时重建矩阵"""
+    global _matrix
+    with _lock:
+        _matrix = None
+
+
+def compute_costs(target_date, prices=None):
+    """
+    计算指定日期所有配方的成本
+    prices 可传入 {material_code: unit_price} 覆盖价格（默认取该日期的时点价格）
+    返回 (matrix, total_costs, missing_counts)，后两者按矩阵行号排列
+    """
+    matrix = get_formula_matrix()
+    if prices is None:
+        prices = price_index.get_prices_as_of(target_date, matrix.material_codes)
+    vector, missing = matrix.price_vector(prices)
+    total_costs = matrix.matvec(vector)
+    missing_counts = matrix.count_nonzero(missing)
+    return matrix, total_costs, missing_counts
+
+
+def get_formula_costs(target_date, formula_ids=None):
+    """
+    返回 {formula_id: {'total_cost': ..., 'missing_count': ...}}
+    formula_ids 为空时返回全部配方
+    """
+    matrix, total_costs, missing_counts = compute_costs(target_date)
+    if formula_ids is None:
+        rows = range(len(matrix.formula_ids))
+    else:
+        rows = [matrix.row_by_formula[fid] for fid in formula_ids if fid in matrix.row_by_formula]
+
+    return {
+        matrix.formula_ids[row]: {
+            'total_cost': round(float(total_costs[row]), 4),
+            'missing_count': int(missing_counts[row])
+        }
+        for row in rows
+    }
+
+
+def cost_rank(total_costs, missing_counts, row):
+    """
+    配方排序键 (是否缺失价格, 总成本)
+    缺失价格的原料按 0 计入总成本，不能与价格齐全的配方直接比较，只在全部缺价时才参与比较
+    """
+    return bool(missing_counts[row] > 0), float(total_costs[row])
+
+
+def lowest_cost_by_product(matrix, total_costs, missing_counts):
+    """
+    按 (产品编码, 配方类型) 取成本最低的配方，价格齐全的配方优先，成本相同取行号靠前的
+    返回 {(product_code, formula_type): 配方信息 + total_cost + missing_count}
+    """
+    best_rows = {}
+    for row, info in enumerate(matrix.formula_info):
+        key = (info['product_code'], info['formula_type'])
+        best = best_rows.get(key)
+        if best is None or cost_rank(total_costs, missing_counts, row) < \
+                cost_rank(total_costs, missing_counts, best):
+            best_rows[key] = row
+
+    lowest = {}
+    for key, row in best_rows.items():
+        item = dict(matrix.formula_info[row])
+        item['total_cost'] = round(float(total_costs[row]), 4)
+        item['missing_count'] = int(missing_counts[row])
+        lowest[key] = item
+    return lowest
+
+
+def get_lowest_cost_by_product(target_date):
+    """指定日期每个产品的最低成本生产配方和报价配方"""
+    return lowest_cost_by_product(*compute_costs(target_date))
+
+
+def get_lowest_cost_list(target_date):
+    """
+    最低成本配方列表（页面和导出共用），按产品编码排序，同一产品生产配方在前
+    每项含 id（= formula_id）
+    """
+    lowest = get_lowest_cost_by_product(target_date)
+    type_order = {'生产配方': 0, '报价配方': 1}
+    results = []
+    for key in sorted(lowest, key=lambda k: (k[0] or '', type_order.get(k[1], 2))):
+        item = lowest[key]
+        item['id'] = item['formula_id']
+        results.append(item)
+    return results
@@ -0,0 +1,243 @@
+"""
+配方成本快照
+按 (formula_id, snapshot_date) 物化配方总成本和缺失价格数，
+价格或配方变更时只增量刷新受影响的配方。
+"""
+from datetime import datetime
+from db_pool import pooled_connection
+import price_index
+import cost_engine
+
+# IN (...) 查询每批的配方数量
+_CHUNK_SIZE = 500
+
+
+def init_snapshot_tables():
+    """初始化成本快照表和原料→配方反向索引"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS formula_cost_snapshot (
+                formula_id INTEGER NOT NULL,
+                snapshot_date TEXT NOT NULL,
+                total_cost REAL NOT NULL,
+                missing_count INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (formula_id, snapshot_date)
+            )
+        ''')
+        # 按日期取快照并按成本排序（分页），取代原来的单列索引
+        cursor.execute('DROP INDEX IF EXISTS idx_snapshot_date')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_snapshot_date_cost
+            ON formula_cost_snapshot(snapshot_date, total_cost, formula_id)
+        ''')
+
+        # 已物化的日期
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS formula_cost_snapshot_dates (
+                snapshot_date TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # 原料→配方反向索引，包含用量比例（覆盖索引，价格变动影响分析不需回表）
+        cursor.execute('DROP INDEX IF EXISTS idx_formula_materials_material')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_formula_materials_reverse
+            ON formula_materials(material_code, formula_id, usage_ratio)
+        ''')
+
+        conn.commit()
+
+
+def _compute_formula_costs(cursor, formula_ids, target_date):
+    """只计算指定配方在某日期的成本，返回 {formula_id: (total_cost, missing_count)}"""
+    formula_ids = list(formula_ids)
+    results = {fid: (0.0, 0) for fid in formula_ids}
+
+    rows = []
+    for start in range(0, len(formula_ids), _CHUNK_SIZE):
+        chunk = formula_ids[start:start + _CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT formula_id, material_code, usage_ratio
+            FROM formula_materials
+            WHERE formula_id IN ({placeholders})
+        ''', chunk)
+        rows.extend(cursor.fetchall())
+
+    prices = price_index.get_prices_as_of(target_date, {row[1] for row in rows})
+    for formula_id, material_code, usage_ratio in rows:
+        total_cost, missing_count = results[formula_id]
+        price = prices.get(material_code)
+        if price is None:
+            missing_count += 1
+        else:
+            total_cost += (usage_ratio or 0) * price
+        results[formula_id] = (total_cost, missing_count)
+    return results
+
+
+def _existing_formula_ids(cursor, formula_ids):
+    existing = set()
+    for start in range(0, len(formula_ids), _CHUNK_SIZE):
+        chunk = formula_ids[start:start + _CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT id FROM formulas WHERE id IN ({placeholders})', chunk)
+        existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+
+def _write_snapshots(cursor, target_date, costs):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cursor.executemany('''
+        INSERT OR REPLACE INTO formula_cost_snapshot
+        (formula_id, snapshot_date, total_cost, missing_count, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(fid, target_date, round(cost, 4), missing, now)
+          for fid, (cost, missing) in costs.items()])
+
+
+def _materialized_dates(cursor, from_date=None):
+    if from_date:
+        cursor.execute('''
+            SELECT snapshot_date FROM formula_cost_snapshot_dates
+            WHERE snapshot_date >= ? ORDER BY snapshot_date
+        ''', (from_date,))
+    else:
+        cursor.execute('SELECT snapshot_date FROM formula_cost_snapshot_dates ORDER BY snapshot_date')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def materialize_date(target_date):
+    """全量计算并写入某日期的成本快照"""
+    matrix, total_costs, missing_counts = cost_engine.compute_costs(target_date)
+    costs = {fid: (float(total_costs[row]), int(missing_counts[row]))
+             for row, fid in enumerate(matrix.formula_ids)}
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM formula_cost_snapshot WHERE snapshot_date = ?', (target_date,))
+        _write_snapshots(cursor, target_date, costs)
+        cursor.execute('''
+            INSERT OR REPLACE INTO formula_cost_snapshot_dates (snapshot_date) VALUES (?)
+        ''', (target_date,))
+        conn.commit()
+    return costs
+
+
+def is_materialized(cursor, target_date):
+    cursor.execute('''
+        SELECT 1 FROM formula_cost_snapshot_dates WHERE snapshot_date = ?
+    ''', (target_date,))
+    return cursor.fetchone() is not None
+
+
+def ensure_materialized(target_date):
+    """确保某日期的快照已物化（供分页查询直接关联快照表）"""
+    with pooled_connection() as conn:
+        materialized = is_materialized(conn.cursor(), target_date)
+    if not materialized:
+        materialize_date(target_date)
+
+
+def get_snapshot_costs(target_date):
+    """
+    读取某日期的成本快照，日期尚未物化时先全量计算一次
+    返回 {formula_id: {'total_cost': ..., 'missing_count': ...}}
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        costs = None
+        if is_materialized(cursor, target_date):
+            cursor.execute('''
+                SELECT formula_id, total_cost, missing_count
+                FROM formula_cost_snapshot
+                WHERE snapshot_date = ?
+            ''', (target_date,))
+            costs = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    if costs is None:
+        costs = materialize_date(target_date)
+
+    return {fid: {'total_cost': round(cost, 4), 'missing_count': missing}
+            for fid, (cost, missing) in costs.items()}
+
+
+def refresh_formulas(formula_ids):
+    """配方新增/修改/删除后，只刷新这些配方在所有已物化日期的快照"""
+    formula_ids = list(formula_ids)
+    if not formula_ids:
+        return
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        existing = _existing_formula_ids(cursor, formula_ids)
+        removed = [fid for fid in formula_ids if fid not in existing]
+        if removed:
+            cursor.executemany('DELETE FROM formula_cost_snapshot WHERE formula_id = ?',
+                               [(fid,) for fid in removed])
+
+        for snapshot_date in _materialized_dates(cursor):
+            _write_snapshots(cursor, snapshot_date,
+                             _compute_formula_costs(cursor, list(existing), snapshot_date))
+
+        conn.commit()
+
+
+def refresh_formula(formula_id):
+    refresh_formulas([formula_id])
+
+
+def refresh_material(material_code, price_date):
+    """
+    原料价格变更后，通过反向索引找到使用该原料的配方，
+    只刷新 price_date 及之后已物化日期的快照
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT DISTINCT formula_id FROM formula_materials WHERE material_code = ?
+        ''', (material_code,))
+        formula_ids = [row[0] for row in cursor.fetchall()]
+
+        if formula_ids:
+            for snapshot_date in _materialized_dates(cursor, price_date):
+                _write_snapshots(cursor, snapshot_date,
+                                 _compute_formula_costs(cursor, formula_ids, snapshot_date))
+
+        conn.commit()
+    return len(formula_ids)
+
+
+def sync_new_formulas():
+    """为已物化日期中尚无快照的配方补齐快照（如应用优化结果新建配方后）"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        for snapshot_date in _materialized_dates(cursor):
+            cursor.execute('''
+                SELECT f.id FROM formulas f
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM formula_cost_snapshot s
+                    WHERE s.formula_id = f.id AND s.snapshot_date = ?
+                )
+            ''', (snapshot_date,))
+            missing_ids = [row[0] for row in cursor.fetchall()]
+            if missing_ids:
+                _write_snapshots(cursor, snapshot_date,
+                                 _compute_formula_costs(cursor, missing_ids, snapshot_date))
+
+        conn.commit()
+
+
+def clear_snapshots():
+    """清空全部快照（Excel批量导入后），之后按需重新物化"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM formula_cost_snapshot')
+        cursor.execute('DELETE FROM formula_cost_snapshot_dates')
+        conn.commit()
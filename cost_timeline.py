@@ -0,0 +1,232 @@
+"""
+日期区间成本计算
+起始日按时点价格算出全部配方成本，之后逐日只应用当天发生的价格变化事件，
+增量更新受影响配方的成本，计算量与区间内价格变化次数成正比，而不是 天数×配方数。
+用于区间最低成本配方和单个配方/产品的成本走势。
+"""
+from datetime import date, timedelta
+import numpy as np
+import price_index
+import cost_engine
+
+# 区间查询允许的最大天数
+MAX_RANGE_DAYS = 731
+
+
+def parse_date_range(start_date, end_date):
+    """校验日期区间，返回 (start, end) date 对象；不合法时抛出 ValueError"""
+    try:
+        start = date.fromisoformat(str(start_date)[:10])
+        end = date.fromisoformat(str(end_date)[:10])
+    except ValueError:
+        raise ValueError('日期格式应为 YYYY-MM-DD')
+    if start > end:
+        raise ValueError('开始日期不能晚于结束日期')
+    if (end - start).days + 1 > MAX_RANGE_DAYS:
+        raise ValueError(f'日期区间不能超过 {MAX_RANGE_DAYS} 天')
+    return start, end
+
+
+def iter_days(start, end):
+    current = start
+    while current <= end:
+        yield current.isoformat()
+        current += timedelta(days=1)
+
+
+def price_change_events(material_codes, start_date, end_date):
+    """
+    区间内 (start_date, end_date] 的价格变化事件
+    返回 {日期: [(material_code, unit_price), ...]}
+    """
+    events = {}
+    for code, (dates, prices) in price_index.get_price_series_many(material_codes).items():
+        for day, price in zip(dates, prices):
+            if start_date < day <= end_date:
+                events.setdefault(day, []).append((code, price))
+    return events
+
+
+class _GroupMinimum:
+    """按 (产品编码, 配方类型) 分组维护当前最低成本配方"""
+
+    def __init__(self, matrix):
+        group_ids = {}
+        self.keys = []
+        group_of_row = np.empty(len(matrix.formula_ids), dtype=np.int64)
+        for row, info in enumerate(matrix.formula_info):
+            key = (info['product_code'], info['formula_type'])
+            gid = group_ids.get(key)
+            if gid is None:
+                gid = group_ids[key] = len(self.keys)
+                self.keys.append(key)
+            group_of_row[row] = gid
+        self.group_of_row = group_of_row
+        order = np.argsort(group_of_row, kind='stable')
+        bounds = np.searchsorted(group_of_row[order], np.arange(len(self.keys) + 1))
+        self.rows = [order[bounds[g]:bounds[g + 1]] for g in range(len(self.keys))]
+
+    def best(self, gid, total_costs, missing_counts):
+        rows = self.rows[gid]
+        # 与 cost_engine.lowest_cost_by_product 相同：价格齐全的配方优先，
+        # argmin 取第一个最小值，并列规则一致
+        complete = rows[missing_counts[rows] == 0]
+        if len(complete):
+            rows = complete
+        return int(rows[np.argmin(total_costs[rows])])
+
+
+def lowest_cost_range(start_date, end_date):
+    """
+    区间内每天每个产品的最低成本生产配方和报价配方
+    返回 {(product_code, formula_type): [区段, ...]}，区段为配方信息 + total_cost + missing_count
+    + start_date/end_date，同一区段内最低配方及其成本不变
+    """
+    start, end = parse_date_range(start_date, end_date)
+    start_date, end_date = start.isoformat(), end.isoformat()
+
+    matrix, total_costs, missing_counts = cost_engine.compute_costs(start_date)
+    total_costs = total_costs.copy()
+    missing_counts = missing_counts.copy()
+    current_prices = price_index.get_prices_as_of(start_date, matrix.material_codes)
+    events = price_change_events(matrix.material_codes, start_date, end_date)
+
+    groups = _GroupMinimum(matrix)
+    segments = {}
+    current = {}
+
+    def open_segment(gid, row, day):
+        item = dict(matrix.formula_info[row])
+        item['total_cost'] = round(float(total_costs[row]), 4)
+        item['missing_count'] = int(missing_counts[row])
+        item['start_date'] = day
+        item['end_date'] = end_date
+        segments.setdefault(groups.keys[gid], []).append(item)
+        current[gid] = item
+
+    for gid in range(len(groups.keys)):
+        open_segment(gid, groups.best(gid, total_costs, missing_counts), start_date)
+
+    previous_day = start_date
+    for day in iter_days(start + timedelta(days=1), end):
+        changes = events.get(day)
+        if changes:
+            touched = []
+            for code, price in changes:
+                col = matrix.col_by_material[code]
+                rows, ratios = matrix.column_entries(col)
+                old_price = current_prices.get(code)
+                if old_price is None:
+                    np.subtract.at(missing_counts, rows, 1)
+                    old_price = 0.0
+                np.add.at(total_costs, rows, ratios * (price - old_price))
+                current_prices[code] = price
+                touched.append(rows)
+
+            for gid in np.unique(groups.group_of_row[np.concatenate(touched)]):
+                gid = int(gid)
+                row = groups.best(gid, total_costs, missing_counts)
+                item = current[gid]
+                if (item['formula_id'] != matrix.formula_ids[row]
+                        or item['total_cost'] != round(float(total_costs[row]), 4)
+                        or item['missing_count'] != int(missing_counts[row])):
+                    item['end_date'] = previous_day
+                    open_segment(gid, row, day)
+        previous_day = day
+
+    return segments
+
+
+def iter_lowest_cost_by_day(segments, formula_type_order=('生产配方', '报价配方')):
+    """把区段展开为 (日期, 配方信息) 行，按日期、产品编码、配方类型排序"""
+    type_rank = {t: i for i, t in enumerate(formula_type_order)}
+    keys = sorted(segments, key=lambda k: (k[0] or '', type_rank.get(k[1], len(type_rank))))
+    by_day = {}
+    for key in keys:
+        for item in segments[key]:
+            for day in iter_days(date.fromisoformat(item['start_date']),
+                                 date.fromisoformat(item['end_date'])):
+                by_day.setdefault(day, []).append(item)
+    for day in sorted(by_day):
+        for item in by_day[day]:
+            yield day, item
+
+
+def formula_ids_for_product(product_code, formula_type=''):
+    """某产品的全部配方ID（可按配方类型过滤）"""
+    matrix = cost_engine.get_formula_matrix()
+    return [info['formula_id'] for info in matrix.formula_info
+            if info['product_code'] == product_code
+            and (not formula_type or info['formula_type'] == formula_type)]
+
+
+def formula_cost_series(formula_ids, start_date, end_date):
+    """
+    配方在日期区间内的成本走势
+    只按所用原料的价格变化事件推进，返回阶梯序列：
+    {formula_id: 配方信息 + 'points': [{'date', 'total_cost', 'missing_count'}, ...]}
+    每个点表示从该日期起的成本，直到下一个点
+    """
+    start, end = parse_date_range(start_date, end_date)
+    start_date, end_date = start.isoformat(), end.isoformat()
+    matrix = cost_engine.get_formula_matrix()
+
+    # 原料 -> [(配方ID, 用量比例)]
+    usage = {}
+    running = {}
+    for formula_id in formula_ids:
+        row = matrix.row_by_formula.get(formula_id)
+        if row is None:
+            continue
+        for pos in range(matrix.indptr[row], matrix.indptr[row + 1]):
+            code = matrix.material_codes[matrix.indices[pos]]
+            usage.setdefault(code, []).append((formula_id, float(matrix.data[pos])))
+        running[formula_id] = [0.0, 0]
+
+    current_prices = price_index.get_prices_as_of(start_date, usage)
+    for code, users in usage.items():
+        price = current_prices.get(code)
+        for formula_id, ratio in users:
+            if price is None:
+                running[formula_id][1] += 1
+            else:
+                running[formula_id][0] += ratio * price
+
+    series = {}
+    for formula_id in running:
+        info = dict(matrix.formula_info[matrix.row_by_formula[formula_id]])
+        info['points'] = [{'date': start_date,
+                           'total_cost': round(running[formula_id][0], 4),
+                           'missing_count': running[formula_id][1]}]
+        series[formula_id] = info
+
+    events = price_change_events(usage, start_date, end_date)
+    for day in sorted(events):
+        changed = set()
+        for code, price in events[day]:
+            old_price = current_prices.get(code)
+            for formula_id, ratio in usage[code]:
+                if old_price is None:
+                    running[formula_id][1] -= 1
+                running[formula_id][0] += ratio * (price - (old_price or 0.0))
+                changed.add(formula_id)
+            current_prices[code] = price
+
+        for formula_id in changed:
+            points = series[formula_id]['points']
+            total_cost = round(running[formula_id][0], 4)
+            missing_count = running[formula_id][1]
+            if points[-1]['total_cost'] != total_cost or points[-1]['missing_count'] != missing_count:
+                points.append({'date': day, 'total_cost': total_cost, 'missing_count': missing_count})
+
+    return series
+
+
+def expand_daily(points, end_date):
+    """把阶梯序列展开为逐日 (日期, 成本, 缺失价格数)"""
+    end = date.fromisoformat(end_date[:10])
+    for i, point in enumerate(points):
+        last = (date.fromisoformat(points[i + 1]['date']) - timedelta(days=1)
+                if i + 1 < len(points) else end)
+        for day in iter_days(date.fromisoformat(point['date']), last):
+            yield day, point['total_cost'], point['missing_count']
@@ -0,0 +1,75 @@
+"""
+数据版本号
+每次写入配方或原料价格后递增，缓存（导出文件等）以版本号作为键的一部分，
+版本变化即自动失效。版本号存放在数据库中，后台导入进程的写入也能被 Web 进程看到。
+替换规则和分组另有规则版本号（rule_version），规则修改后递增，供优化结果缓存和替换关系图跨进程判断。
+"""
+import time
+from db_pool import pooled_connection
+
+
+def init_data_version_table():
+    """初始化数据版本表"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                rule_version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('PRAGMA table_info(data_version)')
+        if 'rule_version' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute('ALTER TABLE data_version ADD COLUMN rule_version INTEGER NOT NULL DEFAULT 0')
+        cursor.execute('''
+            INSERT OR IGNORE INTO data_version (id, version, updated_at) VALUES (1, 1, ?)
+        ''', (time.time(),))
+        conn.commit()
+
+
+def get_data_version():
+    """返回 (版本号, 最后修改时间戳)"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT version, updated_at FROM data_version WHERE id = 1')
+        row = cursor.fetchone()
+    if row is None:
+        return 0, 0.0
+    return row[0], row[1]
+
+
+def bump_data_version(cursor=None):
+    """数据变更后递增版本号；传入 cursor 时在调用方的事务中执行"""
+    sql = 'UPDATE data_version SET version = version + 1, updated_at = ? WHERE id = 1'
+    if cursor is not None:
+        cursor.execute(sql, (time.time(),))
+        return
+
+    with pooled_connection() as conn:
+        conn.execute(sql, (time.time(),))
+        conn.commit()
+
+
+def get_versions():
+    """返回 (数据版本号, 规则版本号)"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT version, rule_version FROM data_version WHERE id = 1')
+        row = cursor.fetchone()
+    if row is None:
+        return 0, 0
+    return row[0], row[1]
+
+
+def bump_rule_version(cursor=None):
+    """替换规则或分组修改后递增规则版本号；传入 cursor 时在调用方的事务中执行"""
+    sql = 'UPDATE data_version SET rule_version = rule_version + 1 WHERE id = 1'
+    if cursor is not None:
+        cursor.execute(sql)
+        return
+
+    with pooled_connection() as conn:
+        conn.execute(sql)
+        conn.commit()
@@ -0,0 +1,133 @@
+"""
+SQLite 连接池
+每个请求通过 get_db() 从池中借用一个连接并绑定到 Flask 的 g，请求结束时自动归还；
+连接启用 WAL 日志和调优后的 PRAGMA，长时间导入时读请求不再报 "database is locked"。
+请求之外用 with pooled_connection() as conn: 借用，出现异常也会归还；同时借出的连接数不超过
+MAX_CONNECTIONS，超出时等待 ACQUIRE_TIMEOUT 秒后报错。
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+from flask import g
+from database import get_connection
+
+POOL_SIZE = 8
+# 同时借出的连接数上限（空闲连接最多保留 POOL_SIZE 个）
+MAX_CONNECTIONS = 32
+ACQUIRE_TIMEOUT = 30.0
+# 每个连接缓存的预编译语句数量；连接复用后语句缓存跨请求保留
+CACHED_STATEMENTS = 256
+
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -65536',       # 64MB 页缓存
+    'PRAGMA mmap_size = 268435456',     # 256MB 内存映射
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 30000',
+    'PRAGMA foreign_keys = ON',
+)
+
+_pool = LifoQueue(maxsize=POOL_SIZE)
+_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+_lock = threading.Lock()
+_db_path = None
+_row_factory = None
+
+
+def _resolve_database():
+    """通过 database.get_connection() 获取数据库文件路径和行工厂，并启用WAL"""
+    global _db_path, _row_factory
+    with _lock:
+        if _db_path is not None:
+            return
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA database_list')
+        path = next(row[2] for row in cursor.fetchall() if row[1] == 'main')
+        # WAL 模式写入数据库文件，对所有连接（包括其他模块自行打开的连接）持久生效
+        cursor.execute('PRAGMA journal_mode = WAL')
+        _row_factory = conn.row_factory
+        conn.close()
+        _db_path = path
+
+
+def _create_connection():
+    _resolve_database()
+    conn = sqlite3.connect(_db_path,
+                           timeout=30,
+                           check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = _row_factory
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def acquire():
+    """
+    从池中借用连接，池空时新建；借出数达到 MAX_CONNECTIONS 时等待，超时抛出 sqlite3.OperationalError
+    必须与 release() 成对调用，优先使用 pooled_connection()
+    """
+    if not _slots.acquire(timeout=ACQUIRE_TIMEOUT):
+        raise sqlite3.OperationalError(f'数据库连接已全部借出（{MAX_CONNECTIONS}），请稍后重试')
+    try:
+        return _pool.get_nowait()
+    except Empty:
+        pass
+    try:
+        return _create_connection()
+    except BaseException:
+        _slots.release()
+        raise
+
+
+def release(conn):
+    """归还连接；未提交的事务回滚，池满时直接关闭"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except Full:
+        conn.close()
+    except sqlite3.Error:
+        conn.close()
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def pooled_connection():
+    """在请求之外借用连接: with pooled_connection() as conn: ..."""
+    conn = acquire()
+    try:
+        yield conn
+    finally:
+        release(conn)
+
+
+def get_db():
+    """获取当前请求的连接（同一请求内多次调用返回同一连接）"""
+    if 'db_conn' not in g:
+        g.db_conn = acquire()
+    return g.db_conn
+
+
+def _teardown(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        release(conn)
+
+
+def init_app(app):
+    """注册请求结束时归还连接"""
+    app.teardown_appcontext(_teardown)
+
+
+def close_all():
+    """关闭池中所有空闲连接"""
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except Empty:
+            break
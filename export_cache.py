@@ -0,0 +1,112 @@
+"""
+导出文件缓存
+按 (报表, 参数..., 数据版本号) 缓存已生成的 xlsx 内容，LRU + 总大小上限淘汰；
+响应带 ETag / Last-Modified，浏览器重复下载时直接返回缓存或 304。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import Response, request, stream_with_context
+from data_version import get_data_version
+from xlsx_stream import stream_xlsx, content_disposition, XLSX_MIMETYPE
+
+MAX_ENTRIES = 64
+MAX_TOTAL_BYTES = 256 * 1024 * 1024
+# 超过该大小的单个导出不缓存
+MAX_ENTRY_BYTES = 64 * 1024 * 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # key -> bytes
+_total_bytes = 0
+_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+
+def _make_etag(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def get(key):
+    with _lock:
+        data = _entries.get(key)
+        if data is not None:
+            _entries.move_to_end(key)
+        return data
+
+
+def put(key, data):
+    global _total_bytes
+    if len(data) > MAX_ENTRY_BYTES:
+        return
+    with _lock:
+        old = _entries.pop(key, None)
+        if old is not None:
+            _total_bytes -= len(old)
+        _entries[key] = data
+        _total_bytes += len(data)
+        while _entries and (len(_entries) > MAX_ENTRIES or _total_bytes > MAX_TOTAL_BYTES):
+            _, evicted = _entries.popitem(last=False)
+            _total_bytes -= len(evicted)
+            _stats['evictions'] += 1
+
+
+def clear():
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries), total_bytes=_total_bytes)
+
+
+def _tee(key, chunks):
+    """边输出边收集字节，完整生成后写入缓存"""
+    collected = []
+    size = 0
+    for chunk in chunks:
+        if collected is not None:
+            size += len(chunk)
+            if size > MAX_ENTRY_BYTES:
+                collected = None
+            else:
+                collected.append(chunk)
+        yield chunk
+    if collected is not None:
+        put(key, b''.join(collected))
+
+
+def cached_xlsx_response(report, params, filename, build_sheets):
+    """
+    带缓存和条件请求的 xlsx 下载响应
+    build_sheets() 返回 xlsx_stream.stream_xlsx 所需的工作表列表，仅在缓存未命中时调用
+    """
+    version, updated_at = get_data_version()
+    key = (report,) + tuple(params) + (version,)
+    etag = _make_etag(key)
+    last_modified = datetime.fromtimestamp(int(updated_at), timezone.utc)
+
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and request.if_modified_since
+            and last_modified <= request.if_modified_since):
+        with _lock:
+            _stats['not_modified'] += 1
+        response = Response(status=304)
+    else:
+        data = get(key)
+        with _lock:
+            _stats['hits' if data is not None else 'misses'] += 1
+        if data is not None:
+            response = Response(data, mimetype=XLSX_MIMETYPE)
+        else:
+            response = Response(stream_with_context(_tee(key, stream_xlsx(build_sheets()))),
+                                mimetype=XLSX_MIMETYPE)
+        response.headers['Content-Disposition'] = content_disposition(filename)
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # 每次都向服务器验证，数据未变时得到 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
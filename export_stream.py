@@ -0,0 +1,217 @@
+"""
+流式报表导出
+报表行由生成器逐行产出，直接写入 xlsx_stream 的下载响应，不经过 EXPORT_FOLDER 中的临时文件。
+每个 *_sheet 函数返回 (工作表名, 表头, 行生成器, 列宽)，交给 xlsx_stream.xlsx_response 输出。
+"""
+from db_pool import pooled_connection
+import price_index
+import cost_engine
+import cost_timeline
+from formula_pagination import formula_filter, max_material_count
+from search_index import material_match_condition
+
+# 原料库导出每批查询最新价格的原料数
+_MATERIAL_BATCH = 500
+
+
+def _where(search_keyword, formula_type):
+    conditions, params = formula_filter(search_keyword, formula_type)
+    return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+
+def _cost_lookup(target_date):
+    """返回 formula_id -> (total_cost, missing_count) 的查找函数"""
+    matrix, total_costs, missing_counts = cost_engine.compute_costs(target_date)
+
+    def lookup(formula_id):
+        row = matrix.row_by_formula.get(formula_id)
+        if row is None:
+            return 0.0, 0
+        return round(float(total_costs[row]), 4), int(missing_counts[row])
+
+    return lookup
+
+
+def _iter_formula_list_rows(target_date, search_keyword, formula_type):
+    cost_of = _cost_lookup(target_date)
+    where, params = _where(search_keyword, formula_type)
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT f.id, f.product_code, f.product_name, f.customer_product_name,
+                   f.formula_type, f.quotation_no, f.document_date,
+                   (SELECT COUNT(*) FROM formula_materials fm WHERE fm.formula_id = f.id)
+            FROM formulas f
+            {where}
+            ORDER BY f.type_rank, f.sort_code, f.id
+        ''', params)
+        for row in cursor:
+            total_cost, missing_count = cost_of(row[0])
+            yield [row[0], row[1], row[2], row[3], row[4], row[5], row[6],
+                   total_cost, row[7], missing_count]
+
+
+def formula_list_sheet(target_date, search_keyword='', formula_type=''):
+    headers = ['配方ID', '产品编码', '产品名称', '客户产品名称', '配方类型',
+               '报价单号', '单据日期', '总成本', '原料行数', '缺失价格数']
+    widths = [10, 18, 30, 30, 12, 18, 12, 12, 10, 12]
+    return ('配方列表', headers,
+            _iter_formula_list_rows(target_date, search_keyword, formula_type), widths)
+
+
+def _iter_lowest_cost_rows(target_date):
+    for item in cost_engine.get_lowest_cost_list(target_date):
+        yield [item['product_code'], item['product_name'], item['customer_product_name'],
+               item['formula_type'], item['formula_id'], item['quotation_no'],
+               item['total_cost'], item['missing_count']]
+
+
+def lowest_cost_sheet(target_date):
+    headers = ['产品编码', '产品名称', '客户产品名称', '配方类型', '配方ID',
+               '报价单号', '最低成本', '缺失价格数']
+    widths = [18, 30, 30, 12, 10, 18, 12, 12]
+    return ('最低成本配方', headers, _iter_lowest_cost_rows(target_date), widths)
+
+
+def _iter_lowest_cost_range_rows(start_date, end_date):
+    segments = cost_timeline.lowest_cost_range(start_date, end_date)
+    for day, item in cost_timeline.iter_lowest_cost_by_day(segments):
+        yield [day, item['product_code'], item['product_name'], item['customer_product_name'],
+               item['formula_type'], item['formula_id'], item['quotation_no'],
+               item['total_cost'], item['missing_count']]
+
+
+def lowest_cost_range_sheet(start_date, end_date):
+    headers = ['日期', '产品编码', '产品名称', '客户产品名称', '配方类型', '配方ID',
+               '报价单号', '最低成本', '缺失价格数']
+    widths = [12, 18, 30, 30, 12, 10, 18, 12, 12]
+    return ('每日最低成本配方', headers,
+            _iter_lowest_cost_range_rows(start_date, end_date), widths)
+
+
+def format_material_cell(material_name, unit_price, usage_ratio):
+    """横向明细单元格: 原料名称(单价)×用量比例"""
+    price_text = f'{unit_price:g}' if unit_price is not None else '缺失'
+    return f'{material_name}({price_text})×{usage_ratio:g}'
+
+
+def _iter_materials_detail_rows(target_date, search_keyword, formula_type):
+    cost_of = _cost_lookup(target_date)
+    # 全部原料的时点价格一次取出，逐行只查字典
+    prices = price_index.get_prices_as_of(target_date)
+    where, params = _where(search_keyword, formula_type)
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT f.id, f.product_code, f.product_name, f.customer_product_name,
+                   f.formula_type, fm.material_code, fm.material_name, fm.usage_ratio
+            FROM formulas f
+            JOIN formula_materials fm ON fm.formula_id = f.id
+            {where}
+            ORDER BY f.type_rank, f.sort_code, f.id, fm.id
+        ''', params)
+
+        current = None
+        for row in cursor:
+            if current is None or current[0] != row[0]:
+                if current is not None:
+                    yield current
+                total_cost, _ = cost_of(row[0])
+                current = [row[0], row[1], row[2], row[3], row[4], total_cost]
+            unit_price = prices.get(row[5])
+            current.append(format_material_cell(row[6] or row[5], unit_price, row[7] or 0))
+        if current is not None:
+            yield current
+
+
+def materials_detail_sheet(target_date, search_keyword='', formula_type=''):
+    count = max_material_count(search_keyword, formula_type)
+    headers = ['配方ID', '产品编码', '产品名称', '客户产品名称', '配方类型', '总成本']
+    headers += [f'原料{i}' for i in range(1, count + 1)]
+    widths = [10, 18, 30, 30, 12, 12] + [32] * count
+    return ('配方原料明细', headers,
+            _iter_materials_detail_rows(target_date, search_keyword, formula_type), widths)
+
+
+def _iter_price_history_rows(material_code, start_date, end_date):
+    conditions = ['material_code = ?']
+    params = [material_code]
+    if start_date:
+        conditions.append('price_date >= ?')
+        params.append(start_date)
+    if end_date:
+        conditions.append('price_date <= ?')
+        params.append(end_date)
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT price_date, material_code, material_name, material_model,
+                   unit_price, import_date
+            FROM daily_material_prices
+            WHERE {' AND '.join(conditions)}
+            ORDER BY price_date DESC
+        ''', params)
+        for row in cursor:
+            yield list(row)
+
+
+def price_history_sheet(material_code, start_date='', end_date=''):
+    headers = ['价格日期', '原料编码', '原料名称', '原料型号', '单价', '导入日期']
+    widths = [12, 18, 30, 20, 12, 12]
+    return ('原料价格历史', headers,
+            _iter_price_history_rows(material_code, start_date, end_date), widths)
+
+
+def _iter_materials_library_rows(search_keyword):
+    where, params = '', []
+    if (search_keyword or '').strip():
+        condition, params = material_match_condition(search_keyword)
+        where = 'WHERE ' + condition
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT m.material_code, m.material_name, m.material_model
+            FROM material_search m
+            {where}
+            ORDER BY m.material_code
+        ''', params)
+        while True:
+            rows = cursor.fetchmany(_MATERIAL_BATCH)
+            if not rows:
+                break
+            series = price_index.get_price_series_many([row[0] for row in rows])
+            for material_code, material_name, material_model in rows:
+                dates, prices = series[material_code]
+                yield [material_code, material_name, material_model,
+                       prices[-1] if prices else None, dates[-1] if dates else None]
+
+
+def materials_library_sheet(search_keyword=''):
+    headers = ['原料编码', '原料名称', '原料型号', '最新单价', '最新价格日期']
+    widths = [18, 30, 20, 12, 14]
+    return ('原料库', headers, _iter_materials_library_rows(search_keyword), widths)
+
+
+def _iter_customer_demand_rows(date):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT f.document_date, f.quotation_no, p.customer_code, p.customer_name,
+                   f.product_code, f.product_name, p.customer_product_code,
+                   COALESCE(f.customer_product_name, p.customer_product_name), f.formula_type,
+                   (SELECT COUNT(*) FROM formula_materials fm WHERE fm.formula_id = f.id)
+            FROM formulas f
+            LEFT JOIN products p ON p.product_code = f.product_code
+            WHERE f.document_date = ?
+            ORDER BY p.customer_code, f.quotation_no, f.product_code, f.id
+        ''', (date,))
+        for row in cursor:
+            yield list(row)
+
+
+def customer_demands_sheet(date):
+    headers = ['单据日期', '报价单号', '客户编号', '客户名称', '产品编码', '产品名称',
+               '客户产品编码', '客户产品名称', '配方类型', '原料数']
+    widths = [12, 18, 14, 30, 18, 30, 18, 30, 12, 8]
+    return ('客户需求', headers, _iter_customer_demand_rows(date), widths)
@@ -0,0 +1,108 @@
+"""
+配方内容哈希
+按 产品编码、配方类型、报价单号 和排序后的 (原料编码, 用量比例) 列表计算哈希，
+存入 formulas.content_hash（带索引），导入时一次集合查找即可判断是否重复配方。
+
+一次性回填已有配方: python3 formula_hash.py
+"""
+import hashlib
+from db_pool import pooled_connection
+
+# 用量比例参与哈希前保留的小数位，避免浮点误差导致同一配方哈希不同
+RATIO_DIGITS = 6
+
+BACKFILL_BATCH_SIZE = 2000
+
+
+def compute_formula_hash(product_code, formula_type, quotation_no, materials):
+    """materials 为 (material_code, usage_ratio) 序列"""
+    items = sorted(
+        (str(code or ''), round(float(ratio or 0), RATIO_DIGITS))
+        for code, ratio in materials
+    )
+    parts = [str(product_code or ''), str(formula_type or ''), str(quotation_no or '')]
+    parts.extend(f'{code}:{ratio!r}' for code, ratio in items)
+    return hashlib.sha1('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def init_formula_hash_column():
+    """添加 content_hash 列和索引；首次添加时回填已有配方"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA table_info(formulas)')
+        columns = {row[1] for row in cursor.fetchall()}
+
+        added = 'content_hash' not in columns
+        if added:
+            cursor.execute('ALTER TABLE formulas ADD COLUMN content_hash TEXT')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_formulas_content_hash ON formulas(content_hash)
+        ''')
+        conn.commit()
+
+    if added:
+        backfill_formula_hashes()
+
+
+def _formula_hashes(cursor, formula_ids):
+    placeholders = ','.join('?' * len(formula_ids))
+    cursor.execute(f'''
+        SELECT id, product_code, formula_type, quotation_no
+        FROM formulas WHERE id IN ({placeholders})
+    ''', formula_ids)
+    headers = cursor.fetchall()
+
+    cursor.execute(f'''
+        SELECT formula_id, material_code, usage_ratio
+        FROM formula_materials WHERE formula_id IN ({placeholders})
+    ''', formula_ids)
+    materials = {}
+    for formula_id, material_code, usage_ratio in cursor.fetchall():
+        materials.setdefault(formula_id, []).append((material_code, usage_ratio))
+
+    return [(compute_formula_hash(row[1], row[2], row[3], materials.get(row[0], [])), row[0])
+            for row in headers]
+
+
+def backfill_formula_hashes(batch_size=BACKFILL_BATCH_SIZE):
+    """为 content_hash 为空的配方计算哈希，返回处理的配方数"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        total = 0
+        while True:
+            cursor.execute('''
+                SELECT id FROM formulas WHERE content_hash IS NULL ORDER BY id LIMIT ?
+            ''', (batch_size,))
+            formula_ids = [row[0] for row in cursor.fetchall()]
+            if not formula_ids:
+                break
+            cursor.executemany('UPDATE formulas SET content_hash = ? WHERE id = ?',
+                               _formula_hashes(cursor, formula_ids))
+            conn.commit()
+            total += len(formula_ids)
+    return total
+
+
+def update_formula_hash(cursor, formula_id):
+    """在调用方的事务中重新计算单个配方的哈希"""
+    cursor.executemany('UPDATE formulas SET content_hash = ? WHERE id = ?',
+                       _formula_hashes(cursor, [formula_id]))
+
+
+def refresh_formula_hash(formula_id):
+    """配方修改后重新计算其哈希"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        update_formula_hash(cursor, formula_id)
+        conn.commit()
+
+
+def load_formula_hashes(cursor):
+    """已有配方的哈希集合"""
+    cursor.execute('SELECT content_hash FROM formulas WHERE content_hash IS NOT NULL')
+    return {row[0] for row in cursor.fetchall()}
+
+
+if __name__ == '__main__':
+    init_formula_hash_column()
+    print(f'已回填配方哈希: {backfill_formula_hashes()} 个')
@@ -0,0 +1,310 @@
+"""
+配方优化：线性规划 / 混合整数规划模式
+贪心优化逐个原料挑一个替代品，规则多、有 max_ratio 上限和换算系数时会漏掉更便宜的组合。
+这里把整张配方的替换建成一个模型一次求解：
+- 变量 x[i→j]：原料 i 的用量中改用 j 替代的部分（按 i 的用量计），j 的用量为 x × 换算系数
+- 约束：每个原料被替代的总量不超过其用量；单条规则不超过 max_ratio × 用量；
+  替换后配方总用量与原总用量的偏差不超过 usage_tolerance（默认 TOTAL_USAGE_TOLERANCE，None 为不限制）
+- MILP 模式另外限制替换规则条数不超过 MAX_SUBSTITUTIONS
+- 目标：总成本最小
+求解器使用本地安装的 scipy（HiGHS），达到时间上限时状态为 time_limit、gap 取求解器报告值（LP 为未知）；
+未安装 scipy 时退回逐原料分配（LP 模式且不限制总用量时即为最优解，否则为近似解）。
+"""
+import time
+from db_pool import pooled_connection
+import price_index
+
+try:
+    import numpy as np
+    from scipy.optimize import milp, LinearConstraint, Bounds
+except ImportError:  # scipy 为可选依赖
+    milp = None
+
+# 替换后总用量允许偏离原总用量的比例，None 表示不限制（换算系数不为1时总用量会变化）
+# 不限制时各原料的替换互不影响，LP 与逐原料分配结果相同
+TOTAL_USAGE_TOLERANCE = 0.05
+# MILP 模式下一个配方最多启用的替换规则条数
+MAX_SUBSTITUTIONS = 3
+# 求解时间上限（秒）
+TIME_LIMIT = 10.0
+
+MODES = ('lp', 'milp')
+# greedy 只计算贪心基准，供批量优化使用
+SOLVE_MODES = ('greedy',) + MODES
+
+
+def load_rule_snapshot():
+    """
+    读取替换规则，返回 {源原料编码: [(目标原料编码, 换算系数, max_ratio), ...]}
+    显式替换规则优先；同一分组内的原料按各自换算系数互相替代，max_ratio 为 1
+    """
+    from formula_optimizer import get_all_substitutions, get_all_material_groups, get_group_with_members
+
+    rules = {}
+    for group in get_all_material_groups():
+        members = (get_group_with_members(group['id']) or {}).get('members', [])
+        for source in members:
+            for target in members:
+                if source['material_code'] == target['material_code']:
+                    continue
+                factor = (target['conversion_factor'] or 1.0) / (source['conversion_factor'] or 1.0)
+                rules.setdefault(source['material_code'], {})[target['material_code']] = (factor, 1.0)
+
+    for rule in get_all_substitutions():
+        rules.setdefault(rule['source_code'], {})[rule['target_code']] = (
+            rule['conversion_factor'] or 1.0,
+            rule['max_ratio'] if rule['max_ratio'] is not None else 1.0)
+
+    return {source: [(target, factor, max_ratio) for target, (factor, max_ratio) in targets.items()]
+            for source, targets in rules.items()}
+
+
+def parse_usage_tolerance(value):
+    """
+    解析请求参数中的总用量偏差比例：空值为默认值，'none' 为不限制
+    返回 (比例或None, 优化结果缓存使用的模式后缀)，非法值抛出 ValueError
+    """
+    if value is None or str(value).strip() == '':
+        return TOTAL_USAGE_TOLERANCE, ''
+    value = str(value).strip().lower()
+    if value == 'none':
+        return None, '@none'
+    tolerance = float(value)
+    if not 0 <= tolerance < 1:
+        raise ValueError('总用量偏差比例应在 0 到 1 之间')
+    if tolerance == TOTAL_USAGE_TOLERANCE:
+        return tolerance, ''
+    return tolerance, f'@{tolerance:g}'
+
+
+def _load_formula(formula_id):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, product_code, product_name, formula_type, quotation_no
+            FROM formulas WHERE id = ?
+        ''', (formula_id,))
+        formula = cursor.fetchone()
+        cursor.execute('''
+            SELECT material_code, material_name, usage_ratio
+            FROM formula_materials
+            WHERE formula_id = ?
+            ORDER BY id
+        ''', (formula_id,))
+        materials = cursor.fetchall()
+    return formula, materials
+
+
+def _build_edges(usage, prices, rules):
+    """可用的替换边 [(源, 目标, 换算系数, 上限用量, 单位成本变化)]，只保留两端都有价格的"""
+    edges = []
+    for source, amount in usage.items():
+        if source not in prices or amount <= 0:
+            continue
+        for target, factor, max_ratio in rules.get(source, []):
+            if target == source or target not in prices or factor <= 0 or max_ratio <= 0:
+                continue
+            delta = prices[target] * factor - prices[source]
+            edges.append((source, target, factor, min(max_ratio, 1.0) * amount, delta))
+    return edges
+
+
+def _greedy(usage, edges):
+    """逐原料只选一个最便宜的替代品并用满上限（与现有贪心优化同口径的基准）"""
+    best = {}
+    for edge in edges:
+        if edge[4] < 0 and (edge[0] not in best or edge[4] < best[edge[0]][4]):
+            best[edge[0]] = edge
+    return {(e[0], e[1]): e[3] for e in best.values()}
+
+
+def _separable(usage, edges):
+    """不含耦合约束时的精确解：每个原料按单位节省从大到小填满各规则上限"""
+    amounts = {}
+    remaining = dict(usage)
+    for edge in sorted(edges, key=lambda e: e[4]):
+        source, target, _, cap, delta = edge
+        if delta >= 0:
+            break
+        amount = min(cap, remaining[source])
+        if amount > 0:
+            amounts[(source, target)] = amount
+            remaining[source] -= amount
+    return amounts
+
+
+def _solve_scipy(usage, edges, mode, usage_tolerance):
+    n = len(edges)
+    total_usage = sum(usage.values())
+    sources = sorted({e[0] for e in edges})
+    row_of_source = {s: r for r, s in enumerate(sources)}
+
+    cost = np.array([e[4] for e in edges], dtype=np.float64)
+    caps = np.array([e[3] for e in edges], dtype=np.float64)
+    constraints = []
+
+    per_source = np.zeros((len(sources), n))
+    for k, edge in enumerate(edges):
+        per_source[row_of_source[edge[0]], k] = 1.0
+    constraints.append(LinearConstraint(per_source, -np.inf,
+                                        np.array([usage[s] for s in sources])))
+
+    if usage_tolerance is not None:
+        # 总用量变化 = Σ (换算系数 - 1) × x
+        usage_change = np.array([[e[2] - 1.0 for e in edges]])
+        tolerance = usage_tolerance * total_usage
+        constraints.append(LinearConstraint(usage_change, -tolerance, tolerance))
+
+    if mode == 'milp':
+        # 追加 0/1 变量 y：x ≤ 上限 × y，Σy ≤ MAX_SUBSTITUTIONS
+        cost = np.concatenate([cost, np.zeros(n)])
+        constraints = [LinearConstraint(np.hstack([c.A, np.zeros((c.A.shape[0], n))]), c.lb, c.ub)
+                       for c in constraints]
+        link = np.hstack([np.eye(n), -np.diag(caps)])
+        constraints.append(LinearConstraint(link, -np.inf, 0.0))
+        constraints.append(LinearConstraint(np.concatenate([np.zeros(n), np.ones(n)])[None, :],
+                                            -np.inf, MAX_SUBSTITUTIONS))
+        bounds = Bounds(np.zeros(2 * n), np.concatenate([caps, np.ones(n)]))
+        integrality = np.concatenate([np.zeros(n), np.ones(n)])
+    else:
+        bounds = Bounds(np.zeros(n), caps)
+        integrality = np.zeros(n)
+
+    result = milp(cost, constraints=constraints, bounds=bounds, integrality=integrality,
+                  options={'time_limit': TIME_LIMIT})
+    if result.x is None:
+        return None, result.message, None
+    amounts = {(e[0], e[1]): float(result.x[k]) for k, e in enumerate(edges) if result.x[k] > 1e-9}
+    status, gap = _solver_status(result, mode)
+    return amounts, status, gap
+
+
+def _solver_status(result, mode):
+    """
+    由 scipy milp 的 status 得到 (状态, gap)
+    0 为最优（LP 的 gap 为0）；1 为达到时间/迭代上限，返回的是可行解而非最优解，LP 的 gap 未知
+    """
+    mip_gap = getattr(result, 'mip_gap', None) if mode == 'milp' else None
+    if result.status == 0:
+        return 'optimal', mip_gap if mode == 'milp' else 0.0
+    if result.status == 1:
+        return 'time_limit', mip_gap
+    return result.message, None
+
+
+def _evaluate(usage, prices, edges, amounts):
+    """按替换量计算新用量和成本"""
+    new_usage = dict(usage)
+    factor_of = {(e[0], e[1]): e[2] for e in edges}
+    for (source, target), amount in amounts.items():
+        new_usage[source] -= amount
+        new_usage[target] = new_usage.get(target, 0.0) + amount * factor_of[(source, target)]
+    cost = sum(ratio * prices.get(code, 0.0) for code, ratio in new_usage.items())
+    return new_usage, cost
+
+
+def optimize_formula_lp(formula_id, target_date, mode='lp', rules=None,
+                        usage_tolerance=TOTAL_USAGE_TOLERANCE):
+    """
+    用线性规划 / 混合整数规划优化配方
+    rules 为 load_rule_snapshot() 格式的规则（批量优化时共用一份），默认取常驻内存的替换关系图
+    返回 (结果字典, 消息)，失败时结果为None
+    """
+    if mode not in MODES:
+        return None, f'不支持的优化模式: {mode}'
+    formula, materials = _load_formula(formula_id)
+    if formula is None:
+        return None, '配方不存在'
+    if rules is None:
+        import substitution_graph
+        rules = substitution_graph.get_graph().direct_rules()
+
+    codes = {row[0] for row in materials}
+    candidates = codes | {t for s in codes for t, _, _ in rules.get(s, [])}
+    prices = price_index.get_prices_as_of(target_date, candidates)
+    return solve_formula(formula, materials, prices, rules, target_date, mode, usage_tolerance)
+
+
+def solve_formula(formula, materials, prices, rules, target_date, mode='lp',
+                  usage_tolerance=TOTAL_USAGE_TOLERANCE):
+    """
+    在给定的价格和规则快照上优化一个配方（不访问数据库）
+    formula 为 (id, product_code, product_name, formula_type, quotation_no)，
+    materials 为 [(material_code, material_name, usage_ratio), ...]，prices 为 {material_code: 单价}
+    """
+    if mode not in SOLVE_MODES:
+        return None, f'不支持的优化模式: {mode}'
+    usage = {}
+    names = {}
+    for code, name, ratio in materials:
+        usage[code] = usage.get(code, 0.0) + float(ratio or 0)
+        names[code] = name
+    edges = _build_edges(usage, prices, rules)
+
+    _, original_cost = _evaluate(usage, prices, edges, {})
+    greedy_amounts = _greedy(usage, edges)
+    greedy_usage, greedy_cost = _evaluate(usage, prices, edges, greedy_amounts)
+    total_usage = sum(usage.values())
+    greedy_within_tolerance = (usage_tolerance is None or
+                               abs(sum(greedy_usage.values()) - total_usage) <= usage_tolerance * total_usage + 1e-9)
+
+    started = time.perf_counter()
+    if not edges:
+        amounts, status, gap, solver = {}, 'optimal', 0.0, 'none'
+    elif mode == 'greedy':
+        amounts, status, gap, solver = greedy_amounts, 'heuristic', None, 'greedy'
+    elif milp is not None:
+        amounts, status, gap = _solve_scipy(usage, edges, mode, usage_tolerance)
+        solver = 'scipy-highs'
+    else:
+        exact = mode == 'lp' and usage_tolerance is None
+        amounts, solver = _separable(usage, edges), 'separable'
+        status, gap = ('optimal', 0.0) if exact else ('approximate', None)
+    solve_seconds = time.perf_counter() - started
+    if amounts is None:
+        return None, f'求解失败: {status}'
+
+    new_usage, optimized_cost = _evaluate(usage, prices, edges, amounts)
+    factor_of = {(e[0], e[1]): e[2] for e in edges}
+    new_total_usage = sum(new_usage.values())
+
+    result = {
+        'formula_id': formula[0],
+        'product_code': formula[1],
+        'product_name': formula[2],
+        'formula_type': formula[3],
+        'quotation_no': formula[4],
+        'target_date': target_date,
+        'mode': mode,
+        'solver': solver,
+        'status': status,
+        'solve_seconds': round(solve_seconds, 4),
+        'mip_gap': gap,
+        'original_cost': round(original_cost, 4),
+        'greedy_cost': round(greedy_cost, 4),
+        'usage_tolerance': usage_tolerance,
+        'original_total_usage': round(total_usage, 6),
+        'new_total_usage': round(new_total_usage, 6),
+        'within_tolerance': (usage_tolerance is None or
+                             abs(new_total_usage - total_usage) <= usage_tolerance * total_usage + 1e-9),
+        'greedy_within_tolerance': greedy_within_tolerance,
+        'optimized_cost': round(optimized_cost, 4),
+        'saving': round(original_cost - optimized_cost, 4),
+        'saving_vs_greedy': round(greedy_cost - optimized_cost, 4),
+        'missing_prices': sorted(code for code in usage if code not in prices),
+        'materials': [{
+            'material_code': code,
+            'material_name': names.get(code),
+            'original_usage': round(usage.get(code, 0.0), 6),
+            'new_usage': round(ratio, 6),
+            'unit_price': prices.get(code)
+        } for code, ratio in new_usage.items() if ratio > 1e-9 or code in usage],
+        'substitutions': [{
+            'source_code': source,
+            'target_code': target,
+            'replaced_usage': round(amount, 6),
+            'target_usage': round(amount * factor_of[(source, target)], 6),
+            'conversion_factor': factor_of[(source, target)]
+        } for (source, target), amount in sorted(amounts.items())]
+    }
+    return result, '优化完成'
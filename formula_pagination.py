@@ -0,0 +1,232 @@
+"""
+配方列表分页
+基于游标（keyset）分页：按排序键记住上一页最后一条记录，下一页用 (排序键, id) > (...) 继续，
+不使用 OFFSET，页面耗时只与每页条数有关，与配方总数无关。
+排序键都是带索引的原始列，逐页读取时沿索引顺序扫描，不需要临时 B 树排序：
+成本排序从 formula_cost_snapshot 快照表的 (snapshot_date, total_cost, formula_id) 索引出发；
+类型和产品编码排序使用 formulas 的生成列 type_rank、sort_code（产品编码，空值为''）。
+"""
+import base64
+import json
+from db_pool import pooled_connection
+import price_index
+import cost_snapshot
+from search_index import formula_match_condition
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# 生产配方排在报价配方前面
+FORMULA_TYPE_ORDER = "CASE formula_type WHEN '生产配方' THEN 0 WHEN '报价配方' THEN 1 ELSE 2 END"
+
+# 排序用的生成列（VIRTUAL，不占表空间，值只存在索引中）
+SORT_COLUMNS = {
+    'type_rank': FORMULA_TYPE_ORDER,
+    'sort_code': "COALESCE(product_code, '')",
+}
+
+# 排序键 -> 排序列列表，最后一项必须唯一
+SORT_KEYS = {
+    'cost': ['s.total_cost', 's.formula_id'],
+    'product_code': ['f.sort_code', 'f.id'],
+    'type': ['f.type_rank', 'f.sort_code', 'f.id'],
+}
+
+# 成本排序以快照表为驱动表（CROSS JOIN 固定连接顺序）；快照维护保证已物化日期每个配方都有快照行
+_COST_FROM = '''
+    FROM formula_cost_snapshot s CROSS JOIN formulas f ON f.id = s.formula_id
+'''
+_FORMULA_FROM = '''
+    FROM formulas f
+    LEFT JOIN formula_cost_snapshot s ON s.formula_id = f.id AND s.snapshot_date = ?
+'''
+
+
+def init_pagination_indexes():
+    """分页排序用到的生成列和索引"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA table_xinfo(formulas)')
+        columns = {row[1] for row in cursor.fetchall()}
+        for column, expr in SORT_COLUMNS.items():
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE formulas ADD COLUMN {column} GENERATED ALWAYS AS ({expr}) VIRTUAL')
+        cursor.execute('DROP INDEX IF EXISTS idx_formulas_product_code')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_formulas_sort_code ON formulas(sort_code, id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_formulas_type_rank ON formulas(type_rank, sort_code, id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_formula_materials_formula ON formula_materials(formula_id, id)
+        ''')
+        conn.commit()
+
+
+def formula_filter(search_keyword='', formula_type=''):
+    """配方查询条件，返回 (WHERE条件列表, 参数)"""
+    conditions = []
+    params = []
+    if search_keyword:
+        condition, keyword_params = formula_match_condition(search_keyword)
+        conditions.append(condition)
+        params.extend(keyword_params)
+    if formula_type:
+        conditions.append('f.formula_type = ?')
+        params.append(formula_type)
+    return conditions, params
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor_token):
+    """解析游标，无效时返回None（从第一页开始）"""
+    if not cursor_token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor_token.encode('ascii')))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def normalize_page_size(page_size):
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def get_formulas_page(target_date, search_keyword='', formula_type='',
+                      sort='type', cursor_token=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    获取一页带成本的配方
+    返回 (配方列表, 下一页游标)，没有下一页时游标为None
+    """
+    if sort not in SORT_KEYS:
+        sort = 'type'
+    order_exprs = SORT_KEYS[sort]
+    page_size = normalize_page_size(page_size)
+
+    cost_snapshot.ensure_materialized(target_date)
+
+    conditions, params = formula_filter(search_keyword, formula_type)
+    if sort == 'cost':
+        from_clause = _COST_FROM
+        conditions.insert(0, 's.snapshot_date = ?')
+    else:
+        from_clause = _FORMULA_FROM
+    params.insert(0, target_date)
+    last_values = decode_cursor(cursor_token)
+    if last_values and len(last_values) == len(order_exprs):
+        conditions.append(f"({', '.join(order_exprs)}) > ({', '.join('?' * len(order_exprs))})")
+        params.extend(last_values)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT f.id, f.product_code, f.product_name, f.customer_product_name,
+                   f.formula_type, f.quotation_no, f.document_date,
+                   s.total_cost, s.missing_count, {', '.join(order_exprs)}
+            {from_clause}
+            {where}
+            ORDER BY {', '.join(order_exprs)}
+            LIMIT ?
+        ''', params + [page_size + 1])
+        rows = cursor.fetchall()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        # 原料行数只统计本页配方
+        material_counts = {}
+        if rows:
+            page_ids = [row[0] for row in rows]
+            cursor.execute(f'''
+                SELECT formula_id, COUNT(*) FROM formula_materials
+                WHERE formula_id IN ({','.join('?' * len(page_ids))})
+                GROUP BY formula_id
+            ''', page_ids)
+            material_counts = dict(cursor.fetchall())
+
+    formulas = [{
+        'id': row[0],
+        'formula_id': row[0],
+        'product_code': row[1],
+        'product_name': row[2],
+        'customer_product_name': row[3],
+        'formula_type': row[4],
+        'quotation_no': row[5],
+        'document_date': row[6],
+        'total_cost': round(row[7] or 0, 4),
+        'missing_count': row[8] or 0,
+        'material_count': material_counts.get(row[0], 0)
+    } for row in rows]
+
+    next_cursor = encode_cursor(list(rows[-1][9:])) if has_more and rows else None
+    return formulas, next_cursor
+
+
+def get_formula_materials(formula_ids, target_date):
+    """一次查询多个配方的原料及其时点价格，返回 {formula_id: [原料...]}"""
+    materials = {fid: [] for fid in formula_ids}
+    if not formula_ids:
+        return materials
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(formula_ids))
+        cursor.execute(f'''
+            SELECT formula_id, material_code, material_name, material_model, usage_ratio
+            FROM formula_materials
+            WHERE formula_id IN ({placeholders})
+            ORDER BY formula_id, id
+        ''', list(formula_ids))
+        rows = cursor.fetchall()
+
+    prices = price_index.get_prices_as_of(target_date, {row[1] for row in rows})
+    for formula_id, material_code, material_name, material_model, usage_ratio in rows:
+        unit_price = prices.get(material_code)
+        materials[formula_id].append({
+            'material_code': material_code,
+            'material_name': material_name,
+            'material_model': material_model,
+            'usage_ratio': usage_ratio,
+            'unit_price': unit_price,
+            'cost': round((usage_ratio or 0) * unit_price, 4) if unit_price is not None else None
+        })
+    return materials
+
+
+def get_materials_detail_page(target_date, search_keyword='', formula_type='',
+                              sort='type', cursor_token=None, page_size=DEFAULT_PAGE_SIZE):
+    """配方原料横向明细的一页，返回 (结果列表, 下一页游标)"""
+    formulas, next_cursor = get_formulas_page(target_date, search_keyword, formula_type,
+                                              sort, cursor_token, page_size)
+    materials = get_formula_materials([f['id'] for f in formulas], target_date)
+    for formula in formulas:
+        formula['materials'] = materials[formula['id']]
+    return formulas, next_cursor
+
+
+def max_material_count(search_keyword='', formula_type=''):
+    """匹配配方中原料行数的最大值（聚合查询，用于横向明细的列数）"""
+    conditions, params = formula_filter(search_keyword, formula_type)
+    where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT COALESCE(MAX(cnt), 0) FROM (
+                SELECT COUNT(fm.id) AS cnt
+                FROM formulas f
+                JOIN formula_materials fm ON fm.formula_id = f.id
+                {where}
+                GROUP BY f.id
+            )
+        ''', params)
+        count = cursor.fetchone()[0]
+    return count
@@ -0,0 +1,228 @@
+"""
+后台导入任务
+/upload 把导入提交到本地进程池后立即返回任务编号，任务进度写入单独的任务库，
+页面刷新后仍可通过 /jobs/<id> 查询阶段、已处理行数、错误和最终结果。
+报价配方批量优化也作为任务记录在同一张表中。
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# 任务状态单独存放：导入过程中主库处于写事务中，进度更新不能与其争用写锁
+JOBS_DB_PATH = 'import_jobs.db'
+MAX_WORKERS = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _jobs_connection():
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_jobs_table():
+    """初始化任务表"""
+    conn = _jobs_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id TEXT PRIMARY KEY,
+            filename TEXT,
+            import_date TEXT,
+            phase TEXT NOT NULL,
+            rows_processed INTEGER DEFAULT 0,
+            errors TEXT DEFAULT '[]',
+            message TEXT,
+            result TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _update_job(job_id, **fields):
+    fields['updated_at'] = _now()
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn = _jobs_connection()
+    conn.execute(f'UPDATE import_jobs SET {assignments} WHERE id = ?',
+                 list(fields.values()) + [job_id])
+    conn.commit()
+    conn.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn 避免在多线程的 Web 进程中 fork
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def _run_import_job(job_id, filepath, import_date, streaming):
+    """在工作进程中执行导入，并把进度写回任务表"""
+    def progress(phase, stats):
+        _update_job(job_id, phase=phase, rows_processed=stats['rows'])
+
+    _update_job(job_id, phase='started')
+    try:
+        if streaming:
+            from import_stream import import_excel_streaming
+            result = import_excel_streaming(filepath, import_date, progress=progress)
+        else:
+            from import_data import import_excel_to_database
+            result = import_excel_to_database(filepath, import_date)
+    except Exception as e:
+        result = {'success': False, 'message': f'导入失败: {str(e)}'}
+
+    _finish_job(job_id, result)
+    return result
+
+
+def _create_job(filename, import_date):
+    job_id = uuid.uuid4().hex
+    now = _now()
+    conn = _jobs_connection()
+    conn.execute('''
+        INSERT INTO import_jobs (id, filename, import_date, phase, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (job_id, filename, import_date, 'queued', now, now))
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def _finish_job(job_id, result):
+    errors = [] if result.get('success') else [result.get('message', '')]
+    errors += [f"{entry['file']}: {entry['message']}"
+               for entry in result.get('files', []) if not entry['success']]
+    _update_job(job_id,
+                phase='done' if result.get('success') else 'failed',
+                rows_processed=result.get('rows', 0),
+                errors=json.dumps(errors, ensure_ascii=False),
+                message=result.get('message', ''),
+                result=json.dumps(result, ensure_ascii=False, default=str))
+
+
+def submit_import_job(filepath, import_date, streaming=True, on_complete=None):
+    """
+    提交导入任务，立即返回任务编号
+    on_complete(result) 在 Web 进程中于任务结束后调用（用于刷新缓存）
+    """
+    job_id = _create_job(os.path.basename(filepath), import_date)
+
+    future = _get_executor().submit(_run_import_job, job_id, filepath, import_date, streaming)
+
+    def _done(fut):
+        try:
+            result = fut.result()
+        except Exception as e:
+            result = {'success': False, 'message': f'导入失败: {str(e)}'}
+            _update_job(job_id, phase='failed',
+                        errors=json.dumps([str(e)], ensure_ascii=False),
+                        message=result['message'])
+        if on_complete:
+            on_complete(result)
+
+    future.add_done_callback(_done)
+    return job_id
+
+
+def submit_bulk_import_job(filepaths, import_date=None, on_complete=None):
+    """
+    提交多文件批量导入任务，立即返回任务编号
+    协调线程在 Web 进程中运行，解析由 bulk_import 的进程池并行完成
+    """
+    job_id = _create_job(f'{len(filepaths)} 个文件', import_date)
+
+    def run():
+        from bulk_import import bulk_import
+
+        def progress(phase, stats):
+            _update_job(job_id, phase=phase, rows_processed=stats['rows'],
+                        message=f"已处理文件 {stats['files_done']}/{stats['files_total']}")
+
+        try:
+            result = bulk_import(filepaths, import_date, progress=progress)
+        except Exception as e:
+            result = {'success': False, 'message': f'批量导入失败: {str(e)}'}
+        _finish_job(job_id, result)
+        if on_complete:
+            on_complete(result)
+
+    threading.Thread(target=run, name=f'bulk-import-{job_id}', daemon=True).start()
+    return job_id
+
+
+def submit_batch_optimize_job(target_date, mode='greedy', on_complete=None):
+    """
+    提交报价配方批量优化任务，立即返回任务编号
+    协调线程在 Web 进程中运行，计算由 batch_optimize 的进程池并行完成
+    """
+    job_id = _create_job(f'批量优化({mode})', target_date)
+
+    def run():
+        from batch_optimize import batch_optimize
+
+        def progress(phase, stats):
+            _update_job(job_id, phase=phase, rows_processed=stats['rows'],
+                        message=f"已优化配方 {stats['rows']}/{stats['formulas_total']}，"
+                                f"已保存 {stats['saved']}")
+
+        try:
+            result = batch_optimize(target_date, mode, progress=progress)
+        except Exception as e:
+            result = {'success': False, 'message': f'批量优化失败: {str(e)}'}
+        _finish_job(job_id, result)
+        if on_complete:
+            on_complete(result)
+
+    threading.Thread(target=run, name=f'batch-optimize-{job_id}', daemon=True).start()
+    return job_id
+
+
+def _row_to_job(row):
+    return {
+        'id': row['id'],
+        'filename': row['filename'],
+        'import_date': row['import_date'],
+        'phase': row['phase'],
+        'finished': row['phase'] in ('done', 'failed'),
+        'rows_processed': row['rows_processed'],
+        'errors': json.loads(row['errors'] or '[]'),
+        'message': row['message'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at']
+    }
+
+
+def get_job(job_id):
+    """获取任务状态，不存在返回None"""
+    conn = _jobs_connection()
+    row = conn.execute('SELECT * FROM import_jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    return _row_to_job(row) if row else None
+
+
+def get_recent_jobs(limit=20):
+    """最近的导入任务"""
+    conn = _jobs_connection()
+    rows = conn.execute('''
+        SELECT * FROM import_jobs ORDER BY created_at DESC LIMIT ?
+    ''', (limit,)).fetchall()
+    conn.close()
+    return [_row_to_job(row) for row in rows]
@@ -0,0 +1,374 @@
+"""
+流式Excel导入
+用 openpyxl 只读模式逐行读取"配方明细"和"单价"工作表，内存占用与文件大小无关；
+数据按固定大小分块 executemany 写入，整个导入在一个事务内完成。
+重复配方按内容哈希（formula_hash）判断。
+"""
+import time
+from datetime import datetime, date
+from openpyxl import load_workbook
+from db_pool import pooled_connection
+from formula_hash import compute_formula_hash, load_formula_hashes
+from data_version import bump_data_version
+import price_intervals
+import price_impact
+
+# 每批写入的行数
+CHUNK_SIZE = 5000
+
+FORMULA_SHEET = '配方明细'
+PRICE_SHEET = '单价'
+
+FORMULA_COLUMNS = {
+    'quotation_no': '报价单号',
+    'document_date': '单据日期',
+    'customer_code': '客户编号',
+    'customer_name': '客户名称',
+    'product_code': '产品编码',
+    'product_name': '产品名称',
+    'product_model': '产品型号',
+    'customer_product_code': '客户产品编码',
+    'customer_product_name': '客户产品名称',
+    'formula_type': '配方类型',
+    'material_code': '子件编码',
+    'material_name': '子件名称',
+    'material_model': '子件型号',
+    'usage_ratio': '用量比例',
+    'unit_price': '单价',
+}
+
+PRICE_COLUMNS = {
+    'price_date': '单据日期',
+    'material_code': '存货编码',
+    'material_name': '存货名称',
+    'material_model': '规格型号',
+    'unit_price': '原币含税单价',
+}
+
+
+def _format_date(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value).strip()[:10]
+
+
+def _to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _to_float(value):
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_sheet_records(sheet, columns):
+    """逐行产出 {字段: 值}，第一行为表头；缺少必需列时抛出 ValueError"""
+    rows = sheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    positions = {_to_text(name): i for i, name in enumerate(header) if name is not None}
+    missing = [title for title in columns.values() if title not in positions]
+    if missing:
+        raise ValueError(f'工作表"{sheet.title}"缺少列: {", ".join(missing)}')
+
+    index = {field: positions[title] for field, title in columns.items()}
+    for row in rows:
+        if row is None or all(cell is None for cell in row):
+            continue
+        yield {field: (row[i] if i < len(row) else None) for field, i in index.items()}
+
+
+def _formula_key(record):
+    """连续行中配方的识别键"""
+    return (
+        _to_text(record['quotation_no']),
+        _format_date(record['document_date']),
+        _to_text(record['product_code']),
+        _to_text(record['formula_type']),
+        _to_text(record['customer_product_name']),
+    )
+
+
+class _ChunkWriter:
+    """缓冲待写入的行，达到 CHUNK_SIZE 时批量写入"""
+
+    def __init__(self, cursor, chunk_size, on_flush=None):
+        self.cursor = cursor
+        self.chunk_size = chunk_size
+        self.on_flush = on_flush
+        self.products = []
+        self.formulas = []
+        self.materials = []
+        self.prices = []
+
+    def pending(self):
+        return len(self.products) + len(self.formulas) + len(self.materials) + len(self.prices)
+
+    def maybe_flush(self):
+        if self.pending() >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.products:
+            self.cursor.executemany('''
+                INSERT OR IGNORE INTO products
+                (product_code, product_name, product_model, customer_product_code,
+                 customer_product_name, customer_code, customer_name)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', self.products)
+            self.products = []
+        if self.formulas:
+            self.cursor.executemany('''
+                INSERT INTO formulas
+                (id, import_date, quotation_no, document_date, product_code,
+                 product_name, customer_product_name, formula_type, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', self.formulas)
+            self.formulas = []
+        if self.materials:
+            self.cursor.executemany('''
+                INSERT INTO formula_materials
+                (formula_id, material_code, material_name, material_model,
+                 usage_ratio, unit_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', self.materials)
+            self.materials = []
+        if self.prices:
+            self.cursor.executemany('''
+                INSERT OR REPLACE INTO daily_material_prices
+                (price_date, material_code, material_name, material_model,
+                 unit_price, import_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', self.prices)
+            self.prices = []
+        if self.on_flush:
+            self.on_flush()
+
+
+def _import_formulas(records, import_date, cursor, writer, stats):
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM formulas')
+    next_formula_id = cursor.fetchone()[0] + 1
+    existing_hashes = load_formula_hashes(cursor)
+    seen_products = set()
+
+    # 当前配方的表头和原料行，配方结束（识别键变化）时再判断是否重复
+    current_key = None
+    current_header = None
+    current_materials = []
+
+    def finish_formula():
+        nonlocal next_formula_id
+        if current_header is None:
+            return
+        quotation_no, document_date, product_code, formula_type, customer_product_name, product_name = current_header
+        content_hash = compute_formula_hash(
+            product_code, formula_type, quotation_no,
+            [(m[0], m[3]) for m in current_materials]
+        )
+        if content_hash in existing_hashes:
+            stats['duplicate_formulas'] += 1
+            return
+        existing_hashes.add(content_hash)
+
+        formula_id = next_formula_id
+        next_formula_id += 1
+        writer.formulas.append((
+            formula_id, import_date, quotation_no, document_date, product_code,
+            product_name, customer_product_name, formula_type, content_hash
+        ))
+        writer.materials.extend((formula_id,) + m for m in current_materials)
+        stats['formulas'] += 1
+        stats['material_rows'] += len(current_materials)
+        writer.maybe_flush()
+
+    for record in records:
+        stats['rows'] += 1
+        product_code = _to_text(record['product_code'])
+        if not product_code:
+            continue
+
+        if product_code not in seen_products:
+            seen_products.add(product_code)
+            writer.products.append((
+                product_code,
+                _to_text(record['product_name']),
+                _to_text(record['product_model']),
+                _to_text(record['customer_product_code']),
+                _to_text(record['customer_product_name']),
+                _to_text(record['customer_code']),
+                _to_text(record['customer_name']),
+            ))
+
+        key = _formula_key(record)
+        if key != current_key:
+            finish_formula()
+            current_key = key
+            current_header = key + (_to_text(record['product_name']),)
+            current_materials = []
+
+        material_code = _to_text(record['material_code'])
+        if not material_code:
+            continue
+
+        current_materials.append((
+            material_code,
+            _to_text(record['material_name']),
+            _to_text(record['material_model']),
+            _to_float(record['usage_ratio']) or 0.0,
+            _to_float(record['unit_price']),
+        ))
+
+    finish_formula()
+
+
+def _import_prices(records, import_date, writer, stats):
+    for record in records:
+        stats['rows'] += 1
+        material_code = _to_text(record['material_code'])
+        unit_price = _to_float(record['unit_price'])
+        if not material_code or unit_price is None:
+            continue
+
+        price_date = _format_date(record['price_date']) or import_date
+        if stats['latest_price_date'] is None or price_date > stats['latest_price_date']:
+            stats['latest_price_date'] = price_date
+        writer.prices.append((
+            price_date,
+            material_code,
+            _to_text(record['material_name']),
+            _to_text(record['material_model']),
+            unit_price,
+            import_date,
+        ))
+        stats['price_rows'] += 1
+        writer.maybe_flush()
+
+
+def new_import_stats():
+    return {
+        'rows': 0,
+        'formulas': 0,
+        'duplicate_formulas': 0,
+        'material_rows': 0,
+        'price_rows': 0,
+        'latest_price_date': None,
+    }
+
+
+def read_workbook_records(filepath):
+    """
+    一次性读出工作簿中两张工作表的记录（供批量导入的解析进程使用）
+    返回 (formula_records, price_records)
+    """
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        for sheet_name in (FORMULA_SHEET, PRICE_SHEET):
+            if sheet_name not in workbook.sheetnames:
+                raise ValueError(f'缺少工作表: {sheet_name}')
+        formula_records = list(iter_sheet_records(workbook[FORMULA_SHEET], FORMULA_COLUMNS))
+        price_records = list(iter_sheet_records(workbook[PRICE_SHEET], PRICE_COLUMNS))
+    finally:
+        workbook.close()
+    return formula_records, price_records
+
+
+def write_records(cursor, formula_records, price_records, import_date, chunk_size=CHUNK_SIZE):
+    """在调用方的事务中写入已解析的记录，返回统计信息"""
+    stats = new_import_stats()
+    writer = _ChunkWriter(cursor, chunk_size)
+    _import_formulas(formula_records, import_date, cursor, writer, stats)
+    writer.flush()
+    _import_prices(price_records, import_date, writer, stats)
+    writer.flush()
+    return stats
+
+
+def latest_price_date(price_records):
+    """价格记录中最晚的单据日期，没有则返回None"""
+    dates = [_format_date(r['price_date']) for r in price_records if r['price_date'] not in (None, '')]
+    return max(dates) if dates else None
+
+
+def import_excel_streaming(filepath, import_date, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    流式导入Excel（仅支持 xlsx）
+    progress 为可选回调 progress(phase, stats)，每写入一批数据调用一次
+    返回与 import_excel_to_database 相同结构的结果字典，另含行数和每秒处理行数
+    """
+    started = time.perf_counter()
+    stats = new_import_stats()
+
+    try:
+        workbook = load_workbook(filepath, read_only=True, data_only=True)
+    except Exception as e:
+        return {'success': False, 'message': f'无法读取Excel文件: {str(e)}'}
+
+    try:
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            for sheet_name in (FORMULA_SHEET, PRICE_SHEET):
+                if sheet_name not in workbook.sheetnames:
+                    raise ValueError(f'缺少工作表: {sheet_name}')
+
+            phase = ['formulas']
+
+            def report():
+                if progress:
+                    progress(phase[0], dict(stats))
+
+            cursor.execute('BEGIN IMMEDIATE')
+            writer = _ChunkWriter(cursor, chunk_size, on_flush=report)
+            _import_formulas(iter_sheet_records(workbook[FORMULA_SHEET], FORMULA_COLUMNS),
+                             import_date, cursor, writer, stats)
+            writer.flush()
+            phase[0] = 'prices'
+            _import_prices(iter_sheet_records(workbook[PRICE_SHEET], PRICE_COLUMNS),
+                           import_date, writer, stats)
+            writer.flush()
+            phase[0] = 'committing'
+            report()
+            # 最新价格日期的价格变化，用于生成价格变动影响报告
+            price_date = stats['latest_price_date']
+            old_prices = price_impact.capture_pending_prices(cursor, price_date) if price_date else {}
+            price_intervals.refresh_dirty(cursor)
+            changes = price_impact.collect_changes(cursor, old_prices, price_date) if price_date else {}
+            bump_data_version(cursor)
+            conn.commit()
+    except Exception as e:
+        # 归还连接时回滚未提交的事务
+        return {'success': False, 'message': f'导入失败: {str(e)}', **stats}
+    finally:
+        workbook.close()
+
+    impact_report_id = price_impact.create_report(changes, price_date, '导入')
+
+    elapsed = time.perf_counter() - started
+    rows_per_second = stats['rows'] / elapsed if elapsed > 0 else 0.0
+
+    message = (f"导入成功！新增配方 {stats['formulas']} 个"
+               f"（跳过重复配方 {stats['duplicate_formulas']} 个），"
+               f"配方原料 {stats['material_rows']} 行，原料价格 {stats['price_rows']} 行，"
+               f"耗时 {elapsed:.1f} 秒（{rows_per_second:.0f} 行/秒）")
+    if changes:
+        message += f"；{price_date} 有 {len(changes)} 个原料价格变动，已生成影响报告"
+
+    return {
+        'success': True,
+        'message': message,
+        'elapsed': round(elapsed, 3),
+        'rows_per_second': round(rows_per_second, 1),
+        'impact_report_id': impact_report_id,
+        **stats
+    }
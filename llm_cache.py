@@ -0,0 +1,450 @@
+"""
+大模型调用缓存
+AI助手的三个调用（替换规则建议、配方优化、对话）在输入不变时结果可以复用：
+- 响应按 (provider, model, 规范化后的提示内容哈希) 存入磁盘上的 llm_cache.db，带有效期，
+  总大小超过上限时按最近访问时间淘汰，并统计命中/未命中
+- 所有实际发出的调用（含模拟提供方）共用一个信号量，同时最多 LLM_MAX_CONCURRENCY 个，
+  后台任务内部再并发（如分组分析）也不会超过
+- 另提供本地确定性模拟提供方 'local-stub'（通过 set_provider 选择，与远程提供方一样保存在
+  llm_service 配置中），不访问网络，相同输入总是返回相同结果，用于离线测试和压测缓存路径
+
+app 通过这里的同名函数调用 llm_service，参数与返回值与 llm_service 一致；另可传入 timeout（秒）
+作为单次调用超时：llm_service 的对应函数接受 timeout 参数时原样传入，同时调用在本模块的线程池中执行，
+超过 timeout 即向调用方抛出 TimeoutError。接口不支持 timeout 时调用仍在后台继续，直到返回才归还调用名额
+（计入统计中的 abandoned）。
+"""
+import hashlib
+import inspect
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import llm_service
+
+CACHE_DB_PATH = 'llm_cache.db'
+# 缓存有效期（秒）
+DEFAULT_TTL = 7 * 24 * 3600
+# 缓存总大小上限（字节）
+MAX_TOTAL_BYTES = 50 * 1024 * 1024
+
+STUB_PROVIDER = 'local-stub'
+# 模拟提供方每次调用的延迟（秒），压测时可模拟远程耗时
+STUB_LATENCY = float(os.environ.get('LLM_STUB_LATENCY', '0'))
+# 本进程同时进行的大模型调用数上限（与 ai_jobs 线程池大小相同）
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '4'))
+
+_call_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+# 执行带超时的调用；每个运行中的调用都占着一个名额，线程数与名额数相同即不会排队
+_call_pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix='llm-call')
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'abandoned': 0}
+_initialized = False
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _connection():
+    conn = sqlite3.connect(CACHE_DB_PATH, timeout=30)
+    return conn
+
+
+def init_llm_cache():
+    """初始化缓存表"""
+    global _initialized
+    conn = _connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            provider TEXT NOT NULL,
+            model TEXT,
+            task TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            hit_count INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)')
+    conn.commit()
+    conn.close()
+    _initialized = True
+
+
+def _ensure_initialized():
+    if not _initialized:
+        init_llm_cache()
+
+
+# ==================== 提供方 ====================
+
+def set_provider(provider):
+    """
+    切换提供方，选择保存在 llm_service 的配置中（与远程提供方相同，重启和多进程间一致）
+    'local-stub' 为本地模拟，调用时不经过 llm_service
+    """
+    llm_service.set_provider(provider)
+
+
+def current_provider():
+    return llm_service.LLM_CONFIG['provider']
+
+
+def _current_model(provider):
+    if provider == STUB_PROVIDER:
+        return 'stub-1'
+    config = llm_service.get_api_config()
+    return config.get('model') or llm_service.LLM_CONFIG.get('model') or ''
+
+
+# ==================== 缓存 ====================
+
+def _normalize(value):
+    """规范化提示内容：字符串折叠空白，字典按键排序"""
+    if isinstance(value, str):
+        return _WHITESPACE.sub(' ', value).strip()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(provider, model, task, payload):
+    text = json.dumps(_normalize(payload), ensure_ascii=False, sort_keys=True, default=str)
+    digest = hashlib.sha256(f'{provider}\0{model}\0{task}\0{text}'.encode('utf-8')).hexdigest()
+    return digest
+
+
+def _get(cache_key, ttl):
+    _ensure_initialized()
+    now = time.time()
+    conn = _connection()
+    row = conn.execute('SELECT response, created_at FROM llm_cache WHERE cache_key = ?',
+                       (cache_key,)).fetchone()
+    if row is not None and now - row[1] > ttl:
+        conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (cache_key,))
+        conn.commit()
+        with _lock:
+            _stats['expired'] += 1
+        row = None
+    if row is not None:
+        conn.execute('UPDATE llm_cache SET last_access = ?, hit_count = hit_count + 1 WHERE cache_key = ?',
+                     (now, cache_key))
+        conn.commit()
+    conn.close()
+    with _lock:
+        _stats['hits' if row is not None else 'misses'] += 1
+    return json.loads(row[0]) if row is not None else None
+
+
+def _put(cache_key, provider, model, task, response):
+    _ensure_initialized()
+    data = json.dumps(response, ensure_ascii=False, default=str)
+    size = len(data.encode('utf-8'))
+    if size > MAX_TOTAL_BYTES:
+        return
+    now = time.time()
+    conn = _connection()
+    conn.execute('''
+        INSERT OR REPLACE INTO llm_cache
+        (cache_key, provider, model, task, response, size, created_at, last_access)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (cache_key, provider, model, task, data, size, now, now))
+
+    # 超出总大小时按最近访问时间淘汰
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+    evicted = 0
+    if total > MAX_TOTAL_BYTES:
+        for key, entry_size in conn.execute('''
+            SELECT cache_key, size FROM llm_cache WHERE cache_key != ? ORDER BY last_access
+        ''', (cache_key,)).fetchall():
+            conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (key,))
+            evicted += 1
+            total -= entry_size
+            if total <= MAX_TOTAL_BYTES:
+                break
+    conn.commit()
+    conn.close()
+    with _lock:
+        _stats['stores'] += 1
+        _stats['evictions'] += evicted
+
+
+def _accepts_timeout(func):
+    try:
+        return 'timeout' in inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _acquire_slot(timeout=None):
+    """占用一个调用名额，timeout 内等不到时抛出超时（调用本身尚未开始）"""
+    if not _call_slots.acquire(timeout=timeout):
+        raise TimeoutError('AI调用排队超时')
+
+
+def _remote(func, *args, timeout=None):
+    """调用 llm_service 的函数，指定了 timeout 且该函数支持时作为单次调用超时传入"""
+    if timeout is not None and _accepts_timeout(func):
+        return func(*args, timeout=timeout)
+    return func(*args)
+
+
+def _run_in_slot(call, timeout=None):
+    """
+    执行 call() 并在其返回后归还已占用的调用名额（调用方先 _acquire_slot）
+    指定 timeout 时在线程池中执行，超时抛出 TimeoutError；调用本身继续运行，返回后才归还名额
+    """
+    if timeout is None:
+        try:
+            return call()
+        finally:
+            _call_slots.release()
+
+    def run():
+        try:
+            return call()
+        finally:
+            _call_slots.release()
+
+    try:
+        future = _call_pool.submit(run)
+    except BaseException:
+        _call_slots.release()
+        raise
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        with _lock:
+            _stats['abandoned'] += 1
+        raise TimeoutError('AI调用超时：接口未在截止时间内返回') from None
+
+
+def cached_call(task, payload, call, stub, ttl=DEFAULT_TTL, use_cache=True, timeout=None):
+    """
+    按 (提供方, 模型, 任务, 规范化参数) 查缓存，未命中时调用 call()（模拟提供方调用 stub()）
+    call/stub 返回 llm_service 格式的元组，首项为是否成功；只缓存成功的结果
+    timeout 内等不到调用名额或调用未返回时抛出 TimeoutError
+    """
+    provider = current_provider()
+    model = _current_model(provider)
+    cache_key = make_key(provider, model, task, payload)
+    if use_cache:
+        cached = _get(cache_key, ttl)
+        if cached is not None:
+            return tuple(cached)
+
+    started = time.monotonic()
+    _acquire_slot(timeout)
+    if timeout is not None:
+        # 排队等待名额的时间也计入超时
+        timeout = max(timeout - (time.monotonic() - started), 0.0)
+    response = _run_in_slot(lambda: stub(cache_key) if provider == STUB_PROVIDER else call(), timeout)
+    if use_cache and response and response[0]:
+        _put(cache_key, provider, model, task, list(response))
+    return response
+
+
+def purge_expired(ttl=DEFAULT_TTL):
+    """删除过期记录，返回删除条数"""
+    _ensure_initialized()
+    conn = _connection()
+    count = conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (time.time() - ttl,)).rowcount
+    conn.commit()
+    conn.close()
+    with _lock:
+        _stats['expired'] += count
+    return count
+
+
+def clear():
+    _ensure_initialized()
+    conn = _connection()
+    conn.execute('DELETE FROM llm_cache')
+    conn.commit()
+    conn.close()
+
+
+def get_stats():
+    """命中统计（本进程）及磁盘缓存条数、大小"""
+    _ensure_initialized()
+    conn = _connection()
+    entries, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+    by_task = dict(conn.execute('SELECT task, COUNT(*) FROM llm_cache GROUP BY task').fetchall())
+    conn.close()
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats.update({
+        'hit_rate': round(stats['hits'] / lookups, 4) if lookups else None,
+        'entries': entries,
+        'total_bytes': total_bytes,
+        'max_bytes': MAX_TOTAL_BYTES,
+        'by_task': by_task,
+        'provider': current_provider()
+    })
+    return stats
+
+
+# ==================== 本地模拟提供方 ====================
+
+def _stub_seed(cache_key):
+    return int(cache_key[:8], 16)
+
+
+def _stub_delay(timeout=None):
+    """模拟远程耗时；超过单次调用超时时与远程接口一样抛出超时"""
+    if STUB_LATENCY <= 0:
+        return
+    if timeout is not None and STUB_LATENCY > timeout:
+        time.sleep(timeout)
+        raise TimeoutError(f'本地模拟调用超时（{timeout:.1f}秒）')
+    time.sleep(STUB_LATENCY)
+
+
+def _name_key(material):
+    return re.sub(r'[\s\-_()（）]+', '', str(material.get('material_name') or ''))[:2]
+
+
+def _stub_suggest(materials, cache_key, timeout=None):
+    """名称前两个字相同的原料两两建议为替代关系"""
+    _stub_delay(timeout)
+    buckets = {}
+    for material in materials:
+        buckets.setdefault(_name_key(material), []).append(material)
+    suggestions = []
+    for key in sorted(buckets):
+        members = sorted(buckets[key], key=lambda m: str(m.get('material_code')))
+        for source, target in zip(members, members[1:]):
+            suggestions.append({
+                'source_code': source.get('material_code'),
+                'source_name': source.get('material_name'),
+                'target_code': target.get('material_code'),
+                'target_name': target.get('material_name'),
+                'conversion_factor': 1.0,
+                'confidence': round(0.5 + (_stub_seed(cache_key) % 50) / 100, 2),
+                'reason': '名称相近（本地模拟）'
+            })
+    return True, f'本地模拟：分析 {len(materials)} 个原料，建议 {len(suggestions)} 条替换规则', suggestions
+
+
+def _stub_optimize(formula_info, materials, cache_key, timeout=None):
+    _stub_delay(timeout)
+    notes = (f"本地模拟：配方 {formula_info.get('product_code')} 共 {len(materials)} 个原料，"
+             f"建议编号 {_stub_seed(cache_key) % 1000:03d}")
+    return True, notes, {'suggestions': [], 'notes': notes}
+
+
+def _stub_chat_reply(message, cache_key):
+    return f'（本地模拟 #{_stub_seed(cache_key) % 1000:03d}）收到: {message}'
+
+
+def _stub_chat(message, cache_key, timeout=None):
+    _stub_delay(timeout)
+    return True, _stub_chat_reply(message, cache_key)
+
+
+def _split_tokens(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)] or ['']
+
+
+# ==================== 与 llm_service 同名的调用 ====================
+
+def _material_payload(materials):
+    return sorted((dict(m) for m in materials), key=lambda m: str(m.get('material_code')))
+
+
+def ai_suggest_substitutions(materials, use_cache=True, timeout=None):
+    """返回 (是否成功, 摘要, 建议列表)"""
+    return cached_call('suggest_substitutions',
+                       {'materials': _material_payload(materials)},
+                       lambda: _remote(llm_service.ai_suggest_substitutions, materials, timeout=timeout),
+                       lambda key: _stub_suggest(materials, key, timeout),
+                       use_cache=use_cache, timeout=timeout)
+
+
+def ai_optimize_formula(formula_info, materials, all_materials, requirements, use_cache=True,
+                        timeout=None):
+    """返回 (是否成功, 说明, 结果)"""
+    return cached_call('optimize_formula',
+                       {'formula': formula_info, 'materials': materials,
+                        'all_materials': _material_payload(all_materials), 'requirements': requirements},
+                       lambda: _remote(llm_service.ai_optimize_formula, formula_info, materials,
+                                       all_materials, requirements, timeout=timeout),
+                       lambda key: _stub_optimize(formula_info, materials, key, timeout),
+                       use_cache=use_cache, timeout=timeout)
+
+
+def ai_chat_assistant(message, context, use_cache=True, timeout=None):
+    """返回 (是否成功, 回复)"""
+    return cached_call('chat',
+                       {'message': message, 'context': context},
+                       lambda: _remote(llm_service.ai_chat_assistant, message, context, timeout=timeout),
+                       lambda key: _stub_chat(message, key, timeout),
+                       use_cache=use_cache, timeout=timeout)
+
+
+def ai_chat_assistant_stream(message, context, use_cache=True, timeout=None):
+    """
+    流式对话：逐段产出 ('token', 文本)，最后产出 ('done', (是否成功, 完整回复))
+    缓存命中时按段回放缓存内容；模拟提供方逐段生成；远程提供方在 llm_service 提供
+    ai_chat_assistant_stream(message, context)（逐段产出文本）时使用它，否则整段返回
+    timeout 为整个回复的超时，传给远程接口；流式接口不接受 timeout 时改为整段调用，由本模块限制时间
+    """
+    provider = current_provider()
+    model = _current_model(provider)
+    cache_key = make_key(provider, model, 'chat', {'message': message, 'context': context})
+    cached = _get(cache_key, DEFAULT_TTL) if use_cache else None
+    if cached is not None:
+        for token in _split_tokens(cached[1]):
+            yield 'token', token
+        yield 'done', tuple(cached)
+        return
+
+    remote_stream = getattr(llm_service, 'ai_chat_assistant_stream', None)
+    if remote_stream is not None and timeout is not None and not _accepts_timeout(remote_stream):
+        remote_stream = None
+    started = time.monotonic()
+    _acquire_slot(timeout)
+    if provider != STUB_PROVIDER and remote_stream is None:
+        if timeout is not None:
+            timeout = max(timeout - (time.monotonic() - started), 0.0)
+        response = _run_in_slot(
+            lambda: _remote(llm_service.ai_chat_assistant, message, context, timeout=timeout), timeout)
+        if response[0]:
+            yield 'token', response[1]
+        if use_cache and response[0]:
+            _put(cache_key, provider, model, 'chat', list(response))
+        yield 'done', response
+        return
+
+    # 逐段生成期间一直占用调用名额
+    try:
+        if provider == STUB_PROVIDER:
+            tokens = _split_tokens(_stub_chat_reply(message, cache_key))
+            pieces = []
+            for token in tokens:
+                if STUB_LATENCY > 0:
+                    time.sleep(STUB_LATENCY / len(tokens))
+                pieces.append(token)
+                yield 'token', token
+            response = (True, ''.join(pieces))
+        else:
+            pieces = []
+            try:
+                for token in _remote(remote_stream, message, context, timeout=timeout):
+                    pieces.append(token)
+                    yield 'token', token
+                response = (True, ''.join(pieces))
+            except Exception as e:
+                response = (False, str(e))
+    finally:
+        _call_slots.release()
+
+    if use_cache and response[0]:
+        _put(cache_key, provider, model, 'chat', list(response))
+    yield 'done', response
@@ -0,0 +1,178 @@
+"""
+配方优化结果缓存
+按 (formula_id, 目标日期, 优化模式) 缓存优化结果，每条记录带计算时的价格版本（数据版本号）
+和替换规则版本（data_version 表中的 rule_version，其他进程修改规则也能看到），
+两者与数据库中的当前版本一致才算命中；LRU 淘汰。
+价格、规则或配方修改后只删除受影响的记录，其余记录随即标记为当前版本继续有效；
+未经这里登记的数据变化（如其他进程的导入）使版本不一致，全部记录自然失效。
+"""
+import threading
+from collections import OrderedDict
+from db_pool import pooled_connection
+from data_version import get_versions
+
+MAX_ENTRIES = 512
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # (formula_id, target_date, mode) -> _Entry
+# 缓存记录已确认有效的最新价格版本和规则版本
+_synced_price_version = 0
+_synced_rule_version = 0
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+class _Entry:
+    __slots__ = ('result', 'message', 'material_codes', 'price_version', 'rule_version')
+
+    def __init__(self, result, message, material_codes, price_version, rule_version):
+        self.result = result
+        self.message = message
+        self.material_codes = material_codes
+        self.price_version = price_version
+        self.rule_version = rule_version
+
+
+def _versions():
+    """数据库中当前的 (价格版本, 规则版本)"""
+    return get_versions()
+
+
+def _formula_material_codes(formula_id):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT DISTINCT material_code FROM formula_materials WHERE formula_id = ?',
+                       (formula_id,))
+        codes = frozenset(row[0] for row in cursor.fetchall())
+    return codes
+
+
+def get(formula_id, target_date, mode='greedy'):
+    """返回缓存的 (结果, 消息)，未命中或已过期返回None"""
+    price_version, rule_version = _versions()
+    key = (formula_id, str(target_date)[:10], mode)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None or entry.price_version != price_version or entry.rule_version != rule_version:
+            if entry is not None:
+                del _entries[key]
+            _stats['misses'] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats['hits'] += 1
+        return entry.result, entry.message
+
+
+def put(formula_id, target_date, mode, result, message, price_version=None, rule_version=None):
+    """保存优化结果；price_version/rule_version 为计算开始时的版本，默认取当前版本"""
+    global _synced_price_version, _synced_rule_version
+    if price_version is None or rule_version is None:
+        current_price_version, current_rule_version = _versions()
+        price_version = current_price_version if price_version is None else price_version
+        rule_version = current_rule_version if rule_version is None else rule_version
+    material_codes = _formula_material_codes(formula_id)
+    key = (formula_id, str(target_date)[:10], mode)
+    with _lock:
+        _synced_price_version = max(_synced_price_version, price_version)
+        _synced_rule_version = max(_synced_rule_version, rule_version)
+        _entries[key] = _Entry(result, message, material_codes, price_version, rule_version)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def get_or_compute(formula_id, target_date, mode, compute):
+    """
+    命中缓存直接返回 (结果, 消息)，否则调用 compute() 计算并缓存
+    只缓存成功的结果
+    """
+    cached = get(formula_id, target_date, mode)
+    if cached is not None:
+        return cached
+    price_version, rule_version = _versions()
+    result, message = compute()
+    if result:
+        put(formula_id, target_date, mode, result, message, price_version, rule_version)
+    return result, message
+
+
+def _drop(predicate):
+    """
+    删除满足条件的记录，其余记录标记为当前版本
+    每次登记的修改只递增一次数据版本或规则版本；跳得更多说明有未登记的写入（如其他进程），此时不续期
+    """
+    global _synced_price_version, _synced_rule_version
+    price_version, rule_version = _versions()
+    with _lock:
+        stale = [key for key, entry in _entries.items() if predicate(key, entry)]
+        for key in stale:
+            del _entries[key]
+        _stats['invalidations'] += len(stale)
+
+        previous_price_version = _synced_price_version
+        previous_rule_version = _synced_rule_version
+        if (price_version - previous_price_version, rule_version - previous_rule_version) in \
+                ((0, 0), (1, 0), (0, 1)):
+            for entry in _entries.values():
+                # 已经过期的记录保持原版本，不能借此复活
+                if (entry.rule_version == previous_rule_version
+                        and entry.price_version == previous_price_version):
+                    entry.rule_version = rule_version
+                    entry.price_version = price_version
+        _synced_price_version = max(_synced_price_version, price_version)
+        _synced_rule_version = max(_synced_rule_version, rule_version)
+        return len(stale)
+
+
+def _sources_affected_by(material_codes):
+    """价格变化影响的源原料：原料本身及以其为替代品的源原料"""
+    import substitution_graph
+    graph = substitution_graph.get_graph()
+    affected = set(material_codes)
+    for code in material_codes:
+        affected |= graph.predecessors(code)
+    return affected
+
+
+def invalidate_formula(formula_id):
+    """配方新增、修改或删除后调用（在递增数据版本之后）"""
+    return _drop(lambda key, entry: key[0] == formula_id)
+
+
+def invalidate_prices(material_codes, from_date=None):
+    """
+    原料价格修改后调用（在递增数据版本之后）
+    只删除用到这些原料或其替代源原料、且目标日期不早于 from_date 的记录
+    """
+    with _lock:
+        if not _entries:
+            return _drop(lambda key, entry: False)
+    affected = _sources_affected_by(material_codes)
+    from_date = str(from_date)[:10] if from_date else ''
+    return _drop(lambda key, entry: key[1] >= from_date and not affected.isdisjoint(entry.material_codes))
+
+
+def invalidate_rules(material_codes=None):
+    """
+    替换规则或分组修改后调用（在 bump_rule_version 之后），material_codes 为规则涉及的源原料
+    （分组为全部成员），为None时删除全部记录
+    """
+    if material_codes is None:
+        return _drop(lambda key, entry: True)
+    codes = set(material_codes)
+    return _drop(lambda key, entry: not codes.isdisjoint(entry.material_codes))
+
+
+def sync_version():
+    """数据版本因与已缓存结果无关的写入（如生成新的生产配方）递增后调用"""
+    return _drop(lambda key, entry: False)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries), rule_version=_synced_rule_version)
@@ -0,0 +1,245 @@
+"""
+价格变动影响报告
+原料价格导入或修改后，通过 原料→配方 反向索引（formula_materials 上的
+(material_code, formula_id, usage_ratio) 覆盖索引）只找出用到变动原料的配方，
+计算新旧成本和变化幅度，保存为报告，可在页面查看或下载Excel。
+"""
+from datetime import datetime
+from db_pool import pooled_connection
+import price_intervals
+
+# 页面和导出默认只显示变化幅度超过该百分比的配方
+DEFAULT_THRESHOLD_PCT = 1.0
+# IN (...) 查询每批的数量
+_CHUNK_SIZE = 500
+
+
+def init_price_impact_tables():
+    """初始化影响报告表"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_impact_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                price_date TEXT NOT NULL,
+                material_count INTEGER NOT NULL,
+                formula_count INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_impact_materials (
+                report_id INTEGER NOT NULL,
+                material_code TEXT NOT NULL,
+                old_price REAL,
+                new_price REAL,
+                PRIMARY KEY (report_id, material_code)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_impact_formulas (
+                report_id INTEGER NOT NULL,
+                formula_id INTEGER NOT NULL,
+                old_cost REAL NOT NULL,
+                new_cost REAL NOT NULL,
+                delta REAL NOT NULL,
+                delta_pct REAL,
+                changed_materials TEXT,
+                PRIMARY KEY (report_id, formula_id)
+            )
+        ''')
+        conn.commit()
+
+
+def capture_pending_prices(cursor, price_date):
+    """
+    在重算价格区间之前调用：记录本次写入涉及的原料在 price_date 的原价格
+    返回 {material_code: 原单价或None}
+    """
+    codes = price_intervals.get_dirty_material_codes(cursor)
+    old_prices = price_intervals.get_prices_as_of(cursor, codes, price_date)
+    return {code: old_prices.get(code) for code in codes}
+
+
+def collect_changes(cursor, old_prices, price_date):
+    """在重算价格区间之后调用：返回价格确有变化的 {material_code: (原单价, 新单价)}"""
+    new_prices = price_intervals.get_prices_as_of(cursor, old_prices, price_date)
+    return {code: (old, new_prices.get(code)) for code, old in old_prices.items()
+            if new_prices.get(code) != old}
+
+
+def _affected_usage(cursor, material_codes):
+    """反向索引：{formula_id: [(material_code, usage_ratio), ...]}"""
+    usage = {}
+    codes = list(material_codes)
+    for start in range(0, len(codes), _CHUNK_SIZE):
+        chunk = codes[start:start + _CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT formula_id, material_code, usage_ratio
+            FROM formula_materials
+            WHERE material_code IN ({placeholders})
+        ''', chunk)
+        for formula_id, material_code, usage_ratio in cursor.fetchall():
+            usage.setdefault(formula_id, []).append((material_code, usage_ratio or 0))
+    return usage
+
+
+def _current_costs(cursor, formula_ids, price_date):
+    """只计算指定配方在 price_date 的成本（按价格区间取时点价格）"""
+    costs = {}
+    for start in range(0, len(formula_ids), _CHUNK_SIZE):
+        chunk = formula_ids[start:start + _CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT fm.formula_id,
+                   COALESCE(SUM(fm.usage_ratio * (
+                       SELECT i.unit_price FROM material_price_intervals i
+                       WHERE i.material_code = fm.material_code AND i.valid_from <= ?
+                       ORDER BY i.valid_from DESC LIMIT 1)), 0)
+            FROM formula_materials fm
+            WHERE fm.formula_id IN ({placeholders})
+            GROUP BY fm.formula_id
+        ''', [price_date] + chunk)
+        costs.update(cursor.fetchall())
+    return costs
+
+
+def create_report(changes, price_date, source):
+    """
+    根据价格变化生成影响报告
+    changes 为 {material_code: (原单价, 新单价)}，没有变化时不生成报告并返回None
+    """
+    if not changes:
+        return None
+    price_date = str(price_date)[:10]
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        usage = _affected_usage(cursor, changes)
+        formula_ids = list(usage)
+        new_costs = _current_costs(cursor, formula_ids, price_date)
+
+        rows = []
+        for formula_id in formula_ids:
+            new_cost = new_costs.get(formula_id, 0.0)
+            # 原成本 = 新成本 - Σ 用量 × 价格变化（原来没有价格的原料按0计）
+            delta = sum(ratio * ((changes[code][1] or 0.0) - (changes[code][0] or 0.0))
+                        for code, ratio in usage[formula_id])
+            if abs(delta) < 1e-9:
+                continue
+            old_cost = new_cost - delta
+            delta_pct = round(delta / old_cost * 100, 4) if abs(old_cost) > 1e-9 else None
+            rows.append((formula_id, round(old_cost, 4), round(new_cost, 4), round(delta, 4), delta_pct,
+                         ','.join(sorted({code for code, _ in usage[formula_id]}))))
+
+        cursor.execute('''
+            INSERT INTO price_impact_reports (source, price_date, material_count, formula_count, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (source, price_date, len(changes), len(rows), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        report_id = cursor.lastrowid
+        cursor.executemany('''
+            INSERT INTO price_impact_materials (report_id, material_code, old_price, new_price)
+            VALUES (?, ?, ?, ?)
+        ''', [(report_id, code, old, new) for code, (old, new) in changes.items()])
+        cursor.executemany('''
+            INSERT INTO price_impact_formulas
+            (report_id, formula_id, old_cost, new_cost, delta, delta_pct, changed_materials)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(report_id,) + row for row in rows])
+        conn.commit()
+    return report_id
+
+
+def get_recent_reports(limit=50):
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, source, price_date, material_count, formula_count, created_at
+            FROM price_impact_reports
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (limit,))
+        rows = cursor.fetchall()
+    return [{
+        'id': row[0],
+        'source': row[1],
+        'price_date': row[2],
+        'material_count': row[3],
+        'formula_count': row[4],
+        'created_at': row[5]
+    } for row in rows]
+
+
+def get_report(report_id, threshold_pct=DEFAULT_THRESHOLD_PCT):
+    """
+    读取报告，只返回变化幅度绝对值不小于 threshold_pct 的配方（原成本为0的配方总是返回）
+    不存在时返回None
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, source, price_date, material_count, formula_count, created_at
+            FROM price_impact_reports WHERE id = ?
+        ''', (report_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        report = {
+            'id': row[0],
+            'source': row[1],
+            'price_date': row[2],
+            'material_count': row[3],
+            'formula_count': row[4],
+            'created_at': row[5],
+            'threshold_pct': threshold_pct
+        }
+
+        cursor.execute('''
+            SELECT material_code, old_price, new_price
+            FROM price_impact_materials WHERE report_id = ?
+            ORDER BY material_code
+        ''', (report_id,))
+        report['materials'] = [{
+            'material_code': r[0],
+            'old_price': r[1],
+            'new_price': r[2]
+        } for r in cursor.fetchall()]
+
+        cursor.execute('''
+            SELECT p.formula_id, f.product_code, f.product_name, f.customer_product_name,
+                   f.formula_type, p.old_cost, p.new_cost, p.delta, p.delta_pct, p.changed_materials
+            FROM price_impact_formulas p
+            LEFT JOIN formulas f ON f.id = p.formula_id
+            WHERE p.report_id = ? AND (p.delta_pct IS NULL OR ABS(p.delta_pct) >= ?)
+            ORDER BY ABS(COALESCE(p.delta_pct, 1e18)) DESC, p.formula_id
+        ''', (report_id, threshold_pct))
+        report['formulas'] = [{
+            'formula_id': r[0],
+            'product_code': r[1],
+            'product_name': r[2],
+            'customer_product_name': r[3],
+            'formula_type': r[4],
+            'old_cost': r[5],
+            'new_cost': r[6],
+            'delta': r[7],
+            'delta_pct': r[8],
+            'changed_materials': r[9]
+        } for r in cursor.fetchall()]
+    return report
+
+
+def report_sheets(report):
+    """报告的 xlsx_stream 工作表：受影响配方 + 价格变动原料"""
+    formula_rows = ([f['formula_id'], f['product_code'], f['product_name'], f['customer_product_name'],
+                     f['formula_type'], f['old_cost'], f['new_cost'], f['delta'], f['delta_pct'],
+                     f['changed_materials']] for f in report['formulas'])
+    material_rows = ([m['material_code'], m['old_price'], m['new_price']] for m in report['materials'])
+    return [
+        ('受影响配方',
+         ['配方ID', '产品编码', '产品名称', '客户产品名称', '配方类型',
+          '原成本', '新成本', '变化额', '变化幅度(%)', '变动原料'],
+         formula_rows, [10, 18, 30, 30, 12, 12, 12, 12, 14, 30]),
+        ('价格变动原料', ['原料编码', '原单价', '新单价'], material_rows, [18, 12, 12]),
+    ]
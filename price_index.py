@@ -0,0 +1,195 @@
+"""
+原料价格时点索引
+按原料编码缓存有序的 (日期, 单价) 数组，用二分查找实现"当日价格，否则最近历史价格"，
+一次日期的全量成本计算不再需要逐个原料查询 daily_material_prices。
+数据来自压缩后的价格区间表（每个区间的起始日期），加载量远小于逐日价格。
+查询本身只读内存：每个请求（请求之外每 SYNC_INTERVAL 秒）最多读取一次区间重算记录
+（price_interval_changes），其他进程（后台导入、其他 Web 进程）改过的原料在下一个请求重新加载；
+记录已被清理时整体重新加载。本进程的修改通过 invalidate_material() 立即生效。
+"""
+import threading
+import time
+from bisect import bisect_right
+from flask import g, has_app_context
+from db_pool import pooled_connection
+import price_intervals
+
+# 请求之外（批处理、后台任务）两次同步之间的最短间隔（秒）
+SYNC_INTERVAL = 1.0
+
+_lock = threading.RLock()
+
+# material_code -> (有序日期列表, 对应单价列表)
+_index = {}
+_loaded = False
+# 已失效、下次查询时需要重新加载的原料编码
+_stale_codes = set()
+# 已应用的区间重算记录序号
+_seen_seq = 0
+# 上次同步的时间（time.monotonic()）
+_synced_at = None
+
+
+def _normalize_date(value):
+    """统一日期为 YYYY-MM-DD 字符串，便于按字典序比较"""
+    return str(value)[:10]
+
+
+def _build_series(rows):
+    """
+    把 (price_date, unit_price) 行整理成有序数组，同一天多条记录保留最后一条
+    单价与前一个日期相同的点（区间在缺少记录的日期处断开）不影响时点价格，不保留
+    """
+    by_date = {}
+    for price_date, unit_price in rows:
+        if price_date is None or unit_price is None:
+            continue
+        by_date[_normalize_date(price_date)] = float(unit_price)
+    dates = []
+    prices = []
+    for day in sorted(by_date):
+        if prices and prices[-1] == by_date[day]:
+            continue
+        dates.append(day)
+        prices.append(by_date[day])
+    return dates, prices
+
+
+def _load_all():
+    """一次性加载全部原料价格"""
+    global _index, _loaded, _seen_seq, _synced_at
+    price_intervals.refresh_dirty()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        # 先读序号再加载，加载期间的变化留到下次查询重新加载
+        seq = price_intervals.latest_change_seq(cursor)
+        grouped = {}
+        for code, valid_from, unit_price in price_intervals.load_intervals(cursor):
+            grouped.setdefault(code, []).append((valid_from, unit_price))
+
+    _index = {code: _build_series(rows) for code, rows in grouped.items()}
+    _stale_codes.clear()
+    _seen_seq = seq
+    _synced_at = time.monotonic()
+    _loaded = True
+
+
+def _reload_stale():
+    """只重新加载已失效的原料"""
+    codes = list(_stale_codes)
+    price_intervals.refresh_dirty()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        for code in codes:
+            rows = [(valid_from, unit_price)
+                    for _, valid_from, unit_price in price_intervals.load_intervals(cursor, code)]
+            if rows:
+                _index[code] = _build_series(rows)
+            else:
+                _index.pop(code, None)
+    _stale_codes.difference_update(codes)
+
+
+def _sync_due():
+    """本请求尚未同步过（请求之外：距上次同步已超过 SYNC_INTERVAL 秒）"""
+    if has_app_context():
+        if g.get('price_index_synced'):
+            return False
+        g.price_index_synced = True
+        return True
+    return _synced_at is None or time.monotonic() - _synced_at >= SYNC_INTERVAL
+
+
+def _sync_changes():
+    """把上次同步以来重算过区间的原料标记为失效，返回 False 表示需要整体重新加载"""
+    global _seen_seq, _synced_at
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        if price_intervals.refresh_dirty(cursor):
+            conn.commit()
+        seq, codes = price_intervals.get_changes_since(cursor, _seen_seq)
+    _synced_at = time.monotonic()
+    if codes is None:
+        return False
+    _stale_codes.update(codes)
+    _seen_seq = seq
+    return True
+
+
+def _ensure_fresh():
+    if not _loaded or (_sync_due() and not _sync_changes()):
+        _load_all()
+    elif _stale_codes:
+        _reload_stale()
+
+
+def _lookup(material_code, target_date):
+    series = _index.get(material_code)
+    if not series:
+        return None
+    dates, prices = series
+    pos = bisect_right(dates, target_date)
+    if pos == 0:
+        return None
+    return prices[pos - 1]
+
+
+def get_price_as_of(material_code, target_date):
+    """获取原料在指定日期的价格（当日价格，否则最近历史价格），找不到返回None"""
+    with _lock:
+        _ensure_fresh()
+        return _lookup(material_code, _normalize_date(target_date))
+
+
+def get_prices_as_of(target_date, material_codes=None):
+    """
+    批量获取指定日期的原料价格
+    返回 {material_code: unit_price}，没有任何历史价格的原料不出现在结果中
+    """
+    target_date = _normalize_date(target_date)
+    with _lock:
+        _ensure_fresh()
+        codes = _index.keys() if material_codes is None else material_codes
+        prices = {}
+        for code in codes:
+            price = _lookup(code, target_date)
+            if price is not None:
+                prices[code] = price
+        return prices
+
+
+def get_price_series(material_code):
+    """返回原料的 (日期列表, 单价列表) 副本"""
+    return get_price_series_many([material_code])[material_code]
+
+
+def get_price_series_many(material_codes):
+    """批量返回 {material_code: (日期列表, 单价列表)}，没有价格的原料为空列表"""
+    with _lock:
+        _ensure_fresh()
+        series = {}
+        for code in material_codes:
+            dates, prices = _index.get(code, ([], []))
+            series[code] = (list(dates), list(prices))
+        return series
+
+
+def invalidate_material(material_code):
+    """标记单个原料价格已变更"""
+    invalidate_materials([material_code])
+
+
+def invalidate_materials(material_codes):
+    """标记多个原料价格已变更，下次查询时只重新加载这些原料"""
+    with _lock:
+        if _loaded:
+            _stale_codes.update(c for c in material_codes if c)
+
+
+def invalidate_all():
+    """整体失效（如Excel批量导入后），下次查询时重新加载"""
+    global _loaded
+    with _lock:
+        _index.clear()
+        _stale_codes.clear()
+        _loaded = False
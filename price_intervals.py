@@ -0,0 +1,379 @@
+"""
+原料价格区间（游程压缩）
+大多数原料的价格几周不变，daily_material_prices 却每天一行。这里把同一原料按日期连续、
+单价相同的记录合并为 (material_code, valid_from, valid_to, unit_price) 区间：
+- 时点价格查询只需按 (material_code, valid_from) 主键做一次范围探测
+- 区间只覆盖有记录的日期：中间缺少记录的日期会断开区间，时点查询沿用之前区间的价格
+- daily_material_prices 的插入/修改/删除由触发器登记到 price_interval_dirty，
+  下次读取或导入提交前只重算受影响原料从变更日期起的区间
+- 每次重算的原料记入 price_interval_changes（递增序号），各进程的内存价格索引据此只重新加载
+  其他进程改过的原料
+"""
+from datetime import date, timedelta
+from db_pool import pooled_connection
+
+_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS material_price_intervals (
+        material_code TEXT NOT NULL,
+        valid_from TEXT NOT NULL,
+        valid_to TEXT NOT NULL,
+        unit_price REAL NOT NULL,
+        import_date TEXT,
+        PRIMARY KEY (material_code, valid_from)
+    ) WITHOUT ROWID
+    ''',
+    # 待重算的原料及最早变更日期
+    '''
+    CREATE TABLE IF NOT EXISTS price_interval_dirty (
+        material_code TEXT PRIMARY KEY,
+        from_date TEXT NOT NULL
+    )
+    ''',
+    # 区间重算记录，序号递增，只保留最近 CHANGE_LOG_SIZE 条
+    '''
+    CREATE TABLE IF NOT EXISTS price_interval_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        material_code TEXT NOT NULL
+    )
+    ''',
+    # 区间生成规则的版本，规则变化时启动时全量重建
+    '''
+    CREATE TABLE IF NOT EXISTS price_interval_format (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''',
+]
+
+# 2: 日期不连续时断开区间（版本1会把间隔两侧单价相同的记录合并成一个区间）
+FORMAT_VERSION = 2
+
+CHANGE_LOG_SIZE = 10000
+
+_MARK_DIRTY = '''
+    INSERT INTO price_interval_dirty (material_code, from_date)
+    VALUES ({row}.material_code, SUBSTR({row}.price_date, 1, 10))
+    ON CONFLICT(material_code) DO UPDATE SET from_date = MIN(from_date, excluded.from_date);
+'''
+
+_TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS price_intervals_ai AFTER INSERT ON daily_material_prices BEGIN
+        {_MARK_DIRTY.format(row='NEW')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS price_intervals_ad AFTER DELETE ON daily_material_prices BEGIN
+        {_MARK_DIRTY.format(row='OLD')}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS price_intervals_au
+    AFTER UPDATE OF price_date, material_code, unit_price ON daily_material_prices BEGIN
+        {_MARK_DIRTY.format(row='OLD')}
+        {_MARK_DIRTY.format(row='NEW')}
+    END
+    ''',
+]
+
+
+def init_price_intervals():
+    """创建区间表和触发器；首次创建或区间生成规则升级时由全部历史价格生成区间"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        for sql in _SCHEMA + _TRIGGERS:
+            cursor.execute(sql)
+        cursor.execute('SELECT version FROM price_interval_format WHERE id = 1')
+        row = cursor.fetchone()
+        if row is None or row[0] != FORMAT_VERSION:
+            _mark_all_dirty(cursor)
+            refresh_dirty(cursor)
+            cursor.execute('INSERT OR REPLACE INTO price_interval_format (id, version) VALUES (1, ?)',
+                           (FORMAT_VERSION,))
+
+        conn.commit()
+
+
+def _mark_all_dirty(cursor):
+    cursor.execute('DELETE FROM material_price_intervals')
+    cursor.execute('''
+        INSERT OR REPLACE INTO price_interval_dirty (material_code, from_date)
+        SELECT material_code, MIN(SUBSTR(price_date, 1, 10))
+        FROM daily_material_prices
+        WHERE material_code IS NOT NULL AND price_date IS NOT NULL
+        GROUP BY material_code
+    ''')
+
+
+def refresh_dirty(cursor=None):
+    """
+    重算已登记变更的原料区间，返回重算的原料数
+    传入 cursor 时在调用方的事务中执行（如导入提交前）
+    """
+    if cursor is None:
+        with pooled_connection() as conn:
+            dirty_count = refresh_dirty(conn.cursor())
+            conn.commit()
+        return dirty_count
+
+    cursor.execute('SELECT COUNT(*) FROM price_interval_dirty')
+    dirty_count = cursor.fetchone()[0]
+    if dirty_count:
+        # 从最早变更日期之前的最后一个完整区间起重算（以便与新记录合并），更早的区间保持不变
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS interval_refresh (
+                material_code TEXT PRIMARY KEY,
+                start_date TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('DELETE FROM temp.interval_refresh')
+        cursor.execute('''
+            INSERT INTO temp.interval_refresh (material_code, start_date)
+            SELECT d.material_code,
+                   COALESCE((SELECT MAX(i.valid_from) FROM material_price_intervals i
+                             WHERE i.material_code = d.material_code
+                               AND i.valid_to < d.from_date), '')
+            FROM price_interval_dirty d
+        ''')
+        cursor.execute('''
+            DELETE FROM material_price_intervals
+            WHERE EXISTS (SELECT 1 FROM temp.interval_refresh r
+                          WHERE r.material_code = material_price_intervals.material_code
+                            AND material_price_intervals.valid_from >= r.start_date)
+        ''')
+        # 单价与前一条不同、或与前一条日期不连续的记录开启新区间，累加得到区间编号后分组
+        cursor.execute('''
+            WITH changed AS (
+                SELECT p.material_code, SUBSTR(p.price_date, 1, 10) AS day,
+                       p.unit_price, p.import_date, p.id
+                FROM daily_material_prices p
+                JOIN temp.interval_refresh r
+                  ON r.material_code = p.material_code AND SUBSTR(p.price_date, 1, 10) >= r.start_date
+                WHERE p.unit_price IS NOT NULL
+            ),
+            marked AS (
+                SELECT *, CASE WHEN unit_price = LAG(unit_price) OVER w
+                                    AND julianday(day) - julianday(LAG(day) OVER w) <= 1
+                               THEN 0 ELSE 1 END AS is_start
+                FROM changed
+                WINDOW w AS (PARTITION BY material_code ORDER BY day, id)
+            ),
+            runs AS (
+                SELECT *, SUM(is_start) OVER (
+                           PARTITION BY material_code ORDER BY day, id
+                           ROWS UNBOUNDED PRECEDING) AS run
+                FROM marked
+            )
+            INSERT INTO material_price_intervals
+                (material_code, valid_from, valid_to, unit_price, import_date)
+            SELECT material_code, MIN(day), MAX(day), unit_price, MAX(import_date)
+            FROM runs
+            GROUP BY material_code, run
+        ''')
+        cursor.execute('''
+            INSERT INTO price_interval_changes (material_code)
+            SELECT material_code FROM price_interval_dirty
+        ''')
+        cursor.execute('DELETE FROM price_interval_changes WHERE seq <= ?',
+                       (cursor.lastrowid - CHANGE_LOG_SIZE,))
+        cursor.execute('DELETE FROM price_interval_dirty')
+    return dirty_count
+
+
+def rebuild_all():
+    """由 daily_material_prices 全量重建区间"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        _mark_all_dirty(cursor)
+        count = refresh_dirty(cursor)
+        conn.commit()
+    return count
+
+
+def get_price_as_of(material_code, target_date):
+    """原料在指定日期的价格（当日价格，否则最近历史价格），找不到返回None"""
+    refresh_dirty()
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT unit_price FROM material_price_intervals
+            WHERE material_code = ? AND valid_from <= ?
+            ORDER BY valid_from DESC
+            LIMIT 1
+        ''', (material_code, str(target_date)[:10]))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def get_prices_as_of(cursor, material_codes, target_date):
+    """在调用方的连接上批量查询时点价格，返回 {material_code: unit_price}（不先处理待重算记录）"""
+    target_date = str(target_date)[:10]
+    prices = {}
+    for code in material_codes:
+        cursor.execute('''
+            SELECT unit_price FROM material_price_intervals
+            WHERE material_code = ? AND valid_from <= ?
+            ORDER BY valid_from DESC
+            LIMIT 1
+        ''', (code, target_date))
+        row = cursor.fetchone()
+        if row is not None:
+            prices[code] = row[0]
+    return prices
+
+
+def latest_change_seq(cursor):
+    """最近一次区间重算记录的序号，没有记录时为 0"""
+    cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM price_interval_changes')
+    return cursor.fetchone()[0]
+
+
+def get_changes_since(cursor, seq):
+    """
+    序号 seq 之后重算过的原料，返回 (最新序号, 原料编码集合)
+    seq 之后的记录已被清理（无法得知全部变化）时原料编码集合为None
+    """
+    cursor.execute('SELECT seq, material_code FROM price_interval_changes WHERE seq > ? ORDER BY seq',
+                   (seq,))
+    rows = cursor.fetchall()
+    if not rows:
+        return seq, set()
+    # 序号连续分配，开头缺号说明中间的记录已被清理
+    if rows[0][0] != seq + 1:
+        return rows[-1][0], None
+    return rows[-1][0], {row[1] for row in rows}
+
+
+def get_dirty_material_codes(cursor):
+    """已登记变更、尚未重算区间的原料编码"""
+    cursor.execute('SELECT material_code FROM price_interval_dirty')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def load_intervals(cursor, material_code=None):
+    """按原料、起始日期排序的 (material_code, valid_from, unit_price) 行"""
+    if material_code is None:
+        cursor.execute('''
+            SELECT material_code, valid_from, unit_price
+            FROM material_price_intervals
+            ORDER BY material_code, valid_from
+        ''')
+    else:
+        cursor.execute('''
+            SELECT material_code, valid_from, unit_price
+            FROM material_price_intervals
+            WHERE material_code = ?
+            ORDER BY valid_from
+        ''', (material_code,))
+    return cursor.fetchall()
+
+
+def _days(start, end):
+    """从 end 到 start 倒序的日期字符串"""
+    current = date.fromisoformat(end)
+    first = date.fromisoformat(start)
+    while current >= first:
+        yield current.isoformat()
+        current -= timedelta(days=1)
+
+
+def get_material_price_history(material_code, start_date=None, end_date=None, expand_days=False):
+    """
+    原料价格历史（日期倒序）
+    默认返回 daily_material_prices 中实际存在的记录；expand_days=True 时由区间展开为逐日序列，
+    没有记录的日期按时点价格沿用之前的单价，这些行 is_recorded 为 False、import_date 为None
+    """
+    if expand_days:
+        return _expand_price_history(material_code, start_date, end_date)
+
+    conditions = ['material_code = ?']
+    params = [material_code]
+    if start_date:
+        conditions.append('price_date >= ?')
+        params.append(str(start_date)[:10])
+    if end_date:
+        # price_date 可能带时间部分，按日期比较
+        conditions.append('SUBSTR(price_date, 1, 10) <= ?')
+        params.append(str(end_date)[:10])
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT price_date, material_code, material_name, material_model, unit_price, import_date
+            FROM daily_material_prices
+            WHERE {' AND '.join(conditions)}
+            ORDER BY price_date DESC
+        ''', params)
+        rows = cursor.fetchall()
+
+    return [{
+        'price_date': price_date,
+        'material_code': code,
+        'material_name': material_name,
+        'material_model': material_model,
+        'unit_price': unit_price,
+        'import_date': import_date,
+        'is_recorded': True
+    } for price_date, code, material_name, material_model, unit_price, import_date in rows]
+
+
+def _expand_price_history(material_code, start_date, end_date):
+    refresh_dirty()
+    start_date = str(start_date)[:10] if start_date else None
+    end_date = str(end_date)[:10] if end_date else None
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT i.valid_from, i.valid_to, i.unit_price, i.import_date,
+                   m.material_name, m.material_model
+            FROM material_price_intervals i
+            LEFT JOIN material_search m ON m.material_code = i.material_code
+            WHERE i.material_code = ?
+            ORDER BY i.valid_from DESC
+        ''', (material_code,))
+        rows = cursor.fetchall()
+
+    history = []
+    # 每个区间的价格一直沿用到下一个区间开始的前一天，最后一个区间到 valid_to 为止
+    next_from = None
+    for valid_from, valid_to, unit_price, import_date, material_name, material_model in rows:
+        covered_to = valid_to if next_from is None else \
+            (date.fromisoformat(next_from) - timedelta(days=1)).isoformat()
+        next_from = valid_from
+        first = max(valid_from, start_date) if start_date else valid_from
+        last = min(covered_to, end_date) if end_date else covered_to
+        if first > last:
+            continue
+        for day in _days(first, last):
+            recorded = day <= valid_to
+            history.append({
+                'price_date': day,
+                'material_code': material_code,
+                'material_name': material_name,
+                'material_model': material_model,
+                'unit_price': unit_price,
+                'import_date': import_date if recorded else None,
+                'is_recorded': recorded
+            })
+    return history
+
+
+def get_compaction_stats():
+    """返回 (每日价格行数, 区间行数)"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM daily_material_prices')
+        daily_rows = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM material_price_intervals')
+        interval_rows = cursor.fetchone()[0]
+    return daily_rows, interval_rows
+
+
+if __name__ == '__main__':
+    init_price_intervals()
+    print(f'已重建价格区间: {rebuild_all()} 个原料')
+    daily_rows, interval_rows = get_compaction_stats()
+    print(f'每日价格 {daily_rows} 行 -> 价格区间 {interval_rows} 行')
@@ -0,0 +1,180 @@
+"""
+价格假设模拟（what-if）
+在某日期的时点价格上叠加假设的调价（按百分比或指定单价），全部在内存中完成，不写数据库：
+- 用配方×原料稀疏矩阵一次性重算所有配方成本
+- 对比调价前后每个产品的最低成本配方
+- 原料成本敏感度：∂总成本/∂单价 即该原料在全部配方中的总用量
+"""
+import numpy as np
+import price_index
+import cost_engine
+
+DEFAULT_TOP_N = 50
+
+
+def parse_overrides(items):
+    """
+    规范化调价列表
+    每项为 {'material_code': ..., 'change_pct': 8} 或 {'material_code': ..., 'unit_price': 12.5}
+    返回 {material_code: ('pct' | 'price', 数值)}；格式不对时抛出 ValueError
+    """
+    overrides = {}
+    for item in items or []:
+        code = str(item.get('material_code') or '').strip()
+        if not code:
+            raise ValueError('调价项缺少原料编码')
+        try:
+            if item.get('unit_price') not in (None, ''):
+                overrides[code] = ('price', float(item['unit_price']))
+            elif item.get('change_pct') not in (None, ''):
+                overrides[code] = ('pct', float(item['change_pct']))
+            else:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise ValueError(f'原料 {code} 的调价必须为数字（change_pct 或 unit_price）')
+    return overrides
+
+
+def parse_override_text(text):
+    """
+    解析页面文本框，每行 "原料编码,调价"：调价以 % 结尾为百分比（如 8%、-3%），否则为单价
+    """
+    items = []
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        parts = [p.strip() for p in line.replace('，', ',').split(',')]
+        if len(parts) != 2:
+            raise ValueError(f'无法解析: {line}（格式: 原料编码,8% 或 原料编码,12.5）')
+        code, value = parts
+        if value.endswith('%'):
+            items.append({'material_code': code, 'change_pct': value[:-1]})
+        else:
+            items.append({'material_code': code, 'unit_price': value})
+    return parse_overrides(items)
+
+
+def apply_overrides(prices, overrides):
+    """返回叠加调价后的新价格字典和每项调价明细"""
+    scenario = dict(prices)
+    details = []
+    for code, (kind, value) in overrides.items():
+        base = prices.get(code)
+        if kind == 'pct':
+            if base is None:
+                details.append({'material_code': code, 'base_price': None, 'new_price': None,
+                                'note': '该日期没有价格，无法按百分比调价'})
+                continue
+            new_price = base * (1 + value / 100.0)
+        else:
+            new_price = value
+        scenario[code] = new_price
+        details.append({'material_code': code, 'base_price': base,
+                        'new_price': round(new_price, 6), 'note': ''})
+    return scenario, details
+
+
+def material_sensitivity(matrix, rows=None):
+    """
+    每个原料的成本敏感度（总用量），按矩阵列号排列
+    rows 为行号数组时只统计这些配方
+    """
+    if rows is None:
+        weights = matrix.data
+        indices = matrix.indices
+    else:
+        mask = np.zeros(len(matrix.formula_ids), dtype=bool)
+        mask[rows] = True
+        selected = mask[matrix.row_of_nnz]
+        weights = matrix.data[selected]
+        indices = matrix.indices[selected]
+    return np.bincount(indices, weights=weights, minlength=len(matrix.material_codes))
+
+
+def _lowest_rows(matrix, lowest):
+    return np.array([matrix.row_by_formula[item['formula_id']] for item in lowest.values()],
+                    dtype=np.int64)
+
+
+def simulate(target_date, overrides, top_n=DEFAULT_TOP_N):
+    """
+    运行一次调价模拟
+    overrides 为 parse_overrides 的结果；返回汇总、成本变化最大的配方、最低成本配方变化和原料敏感度
+    """
+    matrix = cost_engine.get_formula_matrix()
+    base_prices = price_index.get_prices_as_of(target_date, matrix.material_codes)
+    scenario_prices, details = apply_overrides(base_prices, overrides)
+
+    _, base_costs, base_missing = cost_engine.compute_costs(target_date, base_prices)
+    _, new_costs, new_missing = cost_engine.compute_costs(target_date, scenario_prices)
+    deltas = new_costs - base_costs
+
+    # 成本变化最大的配方
+    changed_rows = np.flatnonzero(np.abs(deltas) > 1e-9)
+    top_rows = changed_rows[np.argsort(-np.abs(deltas[changed_rows]), kind='stable')][:top_n]
+    formula_changes = []
+    for row in top_rows:
+        item = dict(matrix.formula_info[row])
+        base = float(base_costs[row])
+        item['base_cost'] = round(base, 4)
+        item['new_cost'] = round(float(new_costs[row]), 4)
+        item['delta'] = round(float(deltas[row]), 4)
+        item['delta_pct'] = round(float(deltas[row]) / base * 100, 2) if base else None
+        formula_changes.append(item)
+
+    # 最低成本配方对比（价格齐全的配方优先，缺价配方的成本不可比）
+    base_lowest = cost_engine.lowest_cost_by_product(matrix, base_costs, base_missing)
+    new_lowest = cost_engine.lowest_cost_by_product(matrix, new_costs, new_missing)
+    lowest_changes = []
+    for key, new_item in new_lowest.items():
+        base_item = base_lowest[key]
+        if base_item['formula_id'] != new_item['formula_id'] or \
+                base_item['total_cost'] != new_item['total_cost'] or \
+                base_item['missing_count'] != new_item['missing_count']:
+            lowest_changes.append({
+                'product_code': key[0],
+                'formula_type': key[1],
+                'product_name': new_item['product_name'],
+                'base_formula_id': base_item['formula_id'],
+                'base_cost': base_item['total_cost'],
+                'base_missing_count': base_item['missing_count'],
+                'new_formula_id': new_item['formula_id'],
+                'new_cost': new_item['total_cost'],
+                'new_missing_count': new_item['missing_count'],
+                'switched': base_item['formula_id'] != new_item['formula_id']
+            })
+    lowest_changes.sort(key=lambda c: (not c['switched'], c['product_code'] or ''))
+
+    # 原料敏感度：全部配方总用量 / 当前最低成本配方中的用量
+    total_usage = material_sensitivity(matrix)
+    lowest_usage = material_sensitivity(matrix, _lowest_rows(matrix, base_lowest))
+    top_cols = np.argsort(-total_usage, kind='stable')[:top_n]
+    sensitivity = [{
+        'material_code': matrix.material_codes[col],
+        'unit_price': base_prices.get(matrix.material_codes[col]),
+        'total_usage': round(float(total_usage[col]), 6),
+        'lowest_usage': round(float(lowest_usage[col]), 6)
+    } for col in top_cols if total_usage[col] > 0]
+
+    for detail in details:
+        col = matrix.col_by_material.get(detail['material_code'])
+        usage = float(total_usage[col]) if col is not None else 0.0
+        detail['total_usage'] = round(usage, 6)
+        if detail['new_price'] is not None:
+            detail['cost_impact'] = round(usage * (detail['new_price'] - (detail['base_price'] or 0)), 4)
+
+    return {
+        'target_date': target_date,
+        'summary': {
+            'formula_count': len(matrix.formula_ids),
+            'changed_formulas': int(len(changed_rows)),
+            'base_total_cost': round(float(base_costs.sum()), 4),
+            'new_total_cost': round(float(new_costs.sum()), 4),
+            'switched_products': sum(1 for c in lowest_changes if c['switched'])
+        },
+        'overrides': details,
+        'formula_changes': formula_changes,
+        'lowest_changes': lowest_changes,
+        'sensitivity': sensitivity
+    }
@@ -0,0 +1,348 @@
+"""
+全文检索索引
+SQLite FTS5 trigram 分词，支持中文任意子串匹配，结果按 bm25 相关度排序并限制条数。
+- 原料：material_search 字典表（每个原料编码一行），由价格表和配方原料表的触发器维护
+- 产品：products 表的外部内容索引
+- 配方：formulas 表的外部内容索引（产品编码/产品名称/客户产品名称）
+trigram 至少需要 3 个字符，更短的关键词退回到在字典表/主表上做 LIKE 匹配。
+原料字典和产品表的变化另由触发器计入 search_index_version，输入联想据此判断是否需要重建。
+"""
+from db_pool import pooled_connection
+import price_index
+
+DEFAULT_LIMIT = 200
+# trigram 分词能直接使用索引的最短关键词长度
+MIN_FTS_LENGTH = 3
+
+_SCHEMA = [
+    # 原料字典：原料没有单独的主表，编码/名称/型号分散在价格表和配方原料表中
+    '''
+    CREATE TABLE IF NOT EXISTS material_search (
+        id INTEGER PRIMARY KEY,
+        material_code TEXT NOT NULL UNIQUE,
+        material_name TEXT,
+        material_model TEXT
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS material_search_fts USING fts5(
+        material_code, material_name, material_model,
+        content='material_search', content_rowid='id', tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_search_fts USING fts5(
+        product_code, product_name, customer_product_name,
+        content='products', content_rowid='rowid', tokenize='trigram'
+    )
+    ''',
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS formula_search_fts USING fts5(
+        product_code, product_name, customer_product_name,
+        content='formulas', content_rowid='id', tokenize='trigram'
+    )
+    ''',
+    # 联想索引版本：'materials' 随原料字典变化、'products' 随产品表变化递增
+    '''
+    CREATE TABLE IF NOT EXISTS search_index_version (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    ''',
+]
+
+# (版本名, 表, 触发的列)
+_VERSIONED = [
+    ('materials', 'material_search', ['material_code', 'material_name', 'material_model']),
+    ('products', 'products', ['product_code', 'product_name', 'customer_product_name']),
+]
+
+# 外部内容表的同步触发器：(表名, 索引表, rowid列, 索引列)
+_EXTERNAL_CONTENT = [
+    ('material_search', 'material_search_fts', 'id',
+     ['material_code', 'material_name', 'material_model']),
+    ('products', 'product_search_fts', 'rowid',
+     ['product_code', 'product_name', 'customer_product_name']),
+    ('formulas', 'formula_search_fts', 'id',
+     ['product_code', 'product_name', 'customer_product_name']),
+]
+
+# 价格/配方原料写入时更新原料字典（名称型号没变时不改写，避免重建索引）
+_MATERIAL_UPSERT = '''
+    INSERT INTO material_search (material_code, material_name, material_model)
+    VALUES (NEW.material_code, NEW.material_name, NEW.material_model)
+    ON CONFLICT(material_code) DO UPDATE SET
+        material_name = COALESCE(excluded.material_name, material_name),
+        material_model = COALESCE(excluded.material_model, material_model)
+    WHERE (excluded.material_name IS NOT NULL AND excluded.material_name IS NOT material_name)
+       OR (excluded.material_model IS NOT NULL AND excluded.material_model IS NOT material_model);
+'''
+
+
+def _sync_triggers(table, fts_table, rowid, columns):
+    cols = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{c}' for c in columns)
+    old_values = ', '.join(f'OLD.{c}' for c in columns)
+    return [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts_table}(rowid, {cols}) VALUES (NEW.{rowid}, {new_values});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {cols})
+            VALUES ('delete', OLD.{rowid}, {old_values});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {cols})
+            VALUES ('delete', OLD.{rowid}, {old_values});
+            INSERT INTO {fts_table}(rowid, {cols}) VALUES (NEW.{rowid}, {new_values});
+        END
+        ''',
+    ]
+
+
+def _version_triggers(name, table, columns):
+    bump = f"UPDATE search_index_version SET version = version + 1 WHERE name = '{name}';"
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS {table}_version_ai AFTER INSERT ON {table} BEGIN {bump} END',
+        f'CREATE TRIGGER IF NOT EXISTS {table}_version_ad AFTER DELETE ON {table} BEGIN {bump} END',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_version_au AFTER UPDATE OF {', '.join(columns)} ON {table}
+        BEGIN {bump} END
+        ''',
+    ]
+
+
+def init_search_index():
+    """创建全文索引和同步触发器；首次创建时从现有数据回填"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'material_search'")
+        first_run = cursor.fetchone() is None
+
+        for sql in _SCHEMA:
+            cursor.execute(sql)
+        for table, fts_table, rowid, columns in _EXTERNAL_CONTENT:
+            for sql in _sync_triggers(table, fts_table, rowid, columns):
+                cursor.execute(sql)
+        for source in ('daily_material_prices', 'formula_materials'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS material_search_from_{source}
+                AFTER INSERT ON {source} BEGIN {_MATERIAL_UPSERT} END
+            ''')
+        for name, table, columns in _VERSIONED:
+            cursor.execute('INSERT OR IGNORE INTO search_index_version (name, version) VALUES (?, 0)', (name,))
+            for sql in _version_triggers(name, table, columns):
+                cursor.execute(sql)
+
+        if first_run:
+            rebuild_search_index(cursor)
+
+        conn.commit()
+
+
+def rebuild_search_index(cursor=None):
+    """从主表重建全部索引（数据库被外部工具修改后使用）"""
+    if cursor is None:
+        with pooled_connection() as conn:
+            rebuild_search_index(conn.cursor())
+            conn.commit()
+        return
+
+    # 价格表在后，同一原料以最新价格记录的名称型号为准
+    cursor.execute('''
+        INSERT INTO material_search (material_code, material_name, material_model)
+        SELECT material_code, material_name, material_model FROM (
+            SELECT material_code, material_name, material_model, 0 AS src, id FROM formula_materials
+            UNION ALL
+            SELECT material_code, material_name, material_model, 1 AS src, id FROM daily_material_prices
+        )
+        WHERE material_code IS NOT NULL AND material_code != ''
+        ORDER BY src, id
+        ON CONFLICT(material_code) DO UPDATE SET
+            material_name = COALESCE(excluded.material_name, material_name),
+            material_model = COALESCE(excluded.material_model, material_model)
+    ''')
+    for _, fts_table, _, _ in _EXTERNAL_CONTENT:
+        cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+
+def get_index_version(name):
+    """联想索引版本号（'materials' 或 'products'）"""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM search_index_version WHERE name = ?', (name,))
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def _use_fts(keyword):
+    return len(keyword) >= MIN_FTS_LENGTH
+
+
+def fts_phrase(keyword):
+    """把用户输入转为 FTS5 短语查询，避免特殊字符被当作查询语法"""
+    return '"' + keyword.replace('"', '""') + '"'
+
+
+def _like(keyword):
+    escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def search_materials(search_keyword, limit=DEFAULT_LIMIT):
+    """按编码/名称/型号搜索原料，附带最新价格"""
+    keyword = (search_keyword or '').strip()
+    if not keyword:
+        return []
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        if _use_fts(keyword):
+            cursor.execute('''
+                SELECT m.material_code, m.material_name, m.material_model
+                FROM material_search_fts
+                JOIN material_search m ON m.id = material_search_fts.rowid
+                WHERE material_search_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (fts_phrase(keyword), limit))
+        else:
+            pattern = _like(keyword)
+            cursor.execute('''
+                SELECT material_code, material_name, material_model
+                FROM material_search
+                WHERE material_code LIKE ? ESCAPE '\\' OR material_name LIKE ? ESCAPE '\\'
+                   OR material_model LIKE ? ESCAPE '\\'
+                ORDER BY material_code LIKE ? DESC, material_code
+                LIMIT ?
+            ''', (pattern, pattern, pattern, keyword + '%', limit))
+        rows = cursor.fetchall()
+
+    series = price_index.get_price_series_many([row[0] for row in rows])
+    materials = []
+    for material_code, material_name, material_model in rows:
+        dates, prices = series[material_code]
+        materials.append({
+            'material_code': material_code,
+            'material_name': material_name,
+            'material_model': material_model,
+            'latest_price': prices[-1] if prices else None,
+            'latest_price_date': dates[-1] if dates else None
+        })
+    return materials
+
+
+def search_products(search_keyword, limit=DEFAULT_LIMIT):
+    """按产品编码/产品名称/客户产品名称搜索产品"""
+    keyword = (search_keyword or '').strip()
+    if not keyword:
+        return []
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        if _use_fts(keyword):
+            cursor.execute('''
+                SELECT p.product_code, p.product_name, p.customer_product_name
+                FROM product_search_fts
+                JOIN products p ON p.rowid = product_search_fts.rowid
+                WHERE product_search_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ''', (fts_phrase(keyword), limit))
+        else:
+            pattern = _like(keyword)
+            cursor.execute('''
+                SELECT product_code, product_name, customer_product_name
+                FROM products
+                WHERE product_code LIKE ? ESCAPE '\\' OR product_name LIKE ? ESCAPE '\\'
+                   OR customer_product_name LIKE ? ESCAPE '\\'
+                ORDER BY product_code LIKE ? DESC, product_code
+                LIMIT ?
+            ''', (pattern, pattern, pattern, keyword + '%', limit))
+        rows = cursor.fetchall()
+
+    return [{
+        'product_code': row[0],
+        'product_name': row[1],
+        'customer_product_name': row[2]
+    } for row in rows]
+
+
+def formula_match_condition(search_keyword, alias='f'):
+    """配方关键词过滤条件，返回 (SQL条件, 参数)，供其他查询拼接"""
+    keyword = (search_keyword or '').strip()
+    if _use_fts(keyword):
+        return (f'{alias}.id IN (SELECT rowid FROM formula_search_fts WHERE formula_search_fts MATCH ?)',
+                [fts_phrase(keyword)])
+    pattern = _like(keyword)
+    return (f"({alias}.product_code LIKE ? ESCAPE '\\' OR {alias}.product_name LIKE ? ESCAPE '\\' "
+            f"OR {alias}.customer_product_name LIKE ? ESCAPE '\\')",
+            [pattern] * 3)
+
+
+def material_match_condition(search_keyword, alias='m'):
+    """原料关键词过滤条件（别名指向 material_search），返回 (SQL条件, 参数)"""
+    keyword = (search_keyword or '').strip()
+    if _use_fts(keyword):
+        return (f'{alias}.id IN (SELECT rowid FROM material_search_fts WHERE material_search_fts MATCH ?)',
+                [fts_phrase(keyword)])
+    pattern = _like(keyword)
+    return (f"({alias}.material_code LIKE ? ESCAPE '\\' OR {alias}.material_name LIKE ? ESCAPE '\\' "
+            f"OR {alias}.material_model LIKE ? ESCAPE '\\')",
+            [pattern] * 3)
+
+
+def search_formulas(search_keyword, formula_type='', limit=DEFAULT_LIMIT):
+    """按相关度搜索配方"""
+    keyword = (search_keyword or '').strip()
+    if not keyword:
+        return []
+
+    conditions = []
+    params = []
+    if formula_type:
+        conditions.append('f.formula_type = ?')
+        params.append(formula_type)
+
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        if _use_fts(keyword):
+            where = ''.join(f' AND {c}' for c in conditions)
+            cursor.execute(f'''
+                SELECT f.id, f.product_code, f.product_name, f.customer_product_name,
+                       f.formula_type, f.quotation_no, f.document_date
+                FROM formula_search_fts
+                JOIN formulas f ON f.id = formula_search_fts.rowid
+                WHERE formula_search_fts MATCH ?{where}
+                ORDER BY rank
+                LIMIT ?
+            ''', [fts_phrase(keyword)] + params + [limit])
+        else:
+            condition, like_params = formula_match_condition(keyword)
+            conditions.append(condition)
+            cursor.execute(f'''
+                SELECT f.id, f.product_code, f.product_name, f.customer_product_name,
+                       f.formula_type, f.quotation_no, f.document_date
+                FROM formulas f
+                WHERE {' AND '.join(conditions)}
+                ORDER BY f.product_code LIKE ? DESC, f.product_code, f.id
+                LIMIT ?
+            ''', params + like_params + [keyword + '%', limit])
+        rows = cursor.fetchall()
+
+    return [{
+        'id': row[0],
+        'formula_id': row[0],
+        'product_code': row[1],
+        'product_name': row[2],
+        'customer_product_name': row[3],
+        'formula_type': row[4],
+        'quotation_no': row[5],
+        'document_date': row[6]
+    } for row in rows]
@@ -0,0 +1,250 @@
+"""
+原料替换关系图
+把分组成员（按换算系数互相替代）和直接替换规则合并为一张有向图，常驻内存：
+- 节点为原料编码，边 源→目标 带换算系数（替代 1 份源原料需要的目标原料用量）和 max_ratio
+- 预先计算每个原料 MAX_HOPS 步以内可达的全部替代品，多步替代的换算系数为沿途系数之积，
+  max_ratio 取沿途最小值；同一替代品有多条路径时保留换算系数最小的一条
+- 检测替换关系中的环，标出沿环换算系数之积不为 1 的（数据不一致）
+- 规则修改后重新读取规则并与旧图比较，只重算能到达变更原料的那些节点的候选集
+"""
+import math
+import threading
+import time
+import price_index
+
+# 多步替代的最大步数
+MAX_HOPS = 3
+# 沿环换算系数之积与 1 的允许误差（取对数后比较）
+CYCLE_TOLERANCE = 1e-6
+
+_lock = threading.Lock()
+_graph = None
+
+
+class SubstitutionGraph:
+    def __init__(self, edges):
+        # {源: {目标: (换算系数, max_ratio)}}
+        self.edges = edges
+        self.reverse = _reverse_edges(edges)
+        # {源: [(目标, 换算系数, max_ratio, 路径), ...]}，按换算系数升序
+        self.candidates = {source: _closure(edges, source) for source in edges}
+        self.cycles = find_cycles(edges)
+        self.built_at = time.time()
+
+    def direct_rules(self):
+        """与 formula_lp.load_rule_snapshot() 相同格式的直接替换规则"""
+        return {source: [(target, factor, max_ratio) for target, (factor, max_ratio) in targets.items()]
+                for source, targets in self.edges.items()}
+
+    def predecessors(self, material_code):
+        """以该原料为直接替代品的源原料"""
+        return self.reverse.get(material_code, set())
+
+    def update(self, edges):
+        """
+        用新规则增量更新，返回重算候选集的节点数
+        只有出边变化的节点，以及 MAX_HOPS-1 步内能到达它们的节点需要重算
+        """
+        changed = {source for source in set(self.edges) | set(edges)
+                   if self.edges.get(source) != edges.get(source)}
+        if not changed:
+            return 0
+        new_reverse = _reverse_edges(edges)
+        affected = set(changed)
+        frontier = set(changed)
+        for _ in range(MAX_HOPS - 1):
+            reached = set()
+            for node in frontier:
+                reached |= self.reverse.get(node, set()) | new_reverse.get(node, set())
+            frontier = reached - affected
+            affected |= frontier
+            if not frontier:
+                break
+
+        self.edges = edges
+        self.reverse = new_reverse
+        for source in affected:
+            if source in edges:
+                self.candidates[source] = _closure(edges, source)
+            else:
+                self.candidates.pop(source, None)
+        self.cycles = find_cycles(edges)
+        self.built_at = time.time()
+        return len(affected)
+
+    def get_candidates(self, material_code):
+        return self.candidates.get(material_code, [])
+
+    def stats(self):
+        return {
+            'material_count': len(set(self.edges) | set(self.reverse)),
+            'edge_count': sum(len(targets) for targets in self.edges.values()),
+            'candidate_count': sum(len(c) for c in self.candidates.values()),
+            'multi_hop_count': sum(1 for c in self.candidates.values() for item in c if len(item[3]) > 2),
+            'cycle_count': len(self.cycles),
+            'inconsistent_cycle_count': sum(1 for c in self.cycles if not c['consistent']),
+            'max_hops': MAX_HOPS,
+            'built_at': self.built_at
+        }
+
+
+def _reverse_edges(edges):
+    reverse = {}
+    for source, targets in edges.items():
+        for target in targets:
+            reverse.setdefault(target, set()).add(source)
+    return reverse
+
+
+def _closure(edges, source):
+    """
+    MAX_HOPS 步以内可达的替代品：枚举不重复经过节点的全部路径，每个替代品取换算系数最小的一条
+    （系数相同取步数少的）。只保留到中间节点的最优路径会漏掉绕开目标或步数更少的次优路径
+    """
+    best = {}
+    stack = [(1.0, 1.0, (source,))]
+    while stack:
+        factor, max_ratio, path = stack.pop()
+        for target, (edge_factor, edge_ratio) in edges.get(path[-1], {}).items():
+            if target in path:
+                continue
+            item = (factor * edge_factor, min(max_ratio, edge_ratio), path + (target,))
+            current = best.get(target)
+            if current is None or item[0] < current[0] - 1e-12 or \
+                    (abs(item[0] - current[0]) <= 1e-12 and len(item[2]) < len(current[2])):
+                best[target] = item
+            if len(item[2]) <= MAX_HOPS:
+                stack.append(item)
+    return sorted(((target, factor, max_ratio, path) for target, (factor, max_ratio, path) in best.items()),
+                  key=lambda c: (c[1], len(c[3]), c[0]))
+
+
+def find_cycles(edges):
+    """
+    强连通分量即替换环，返回 [{'materials': [...], 'consistent': bool}, ...]
+    consistent 为 False 表示存在沿环换算系数之积不为 1 的环（如 A→B 系数 2，B→A 系数 1）
+    """
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    # 迭代版 Tarjan，避免原料多时递归过深
+    for root in edges:
+        if root in index:
+            continue
+        work = [(root, iter(edges.get(root, {})))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges.get(child, {}))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1:
+                    components.append(component)
+
+    return [{'materials': sorted(component), 'consistent': _is_consistent(edges, set(component))}
+            for component in components]
+
+
+def _is_consistent(edges, members):
+    """给环内每个原料分配对数“单位”，所有边都满足 单位(目标) = 单位(源) + log(系数) 即一致"""
+    start = next(iter(members))
+    potential = {start: 0.0}
+    queue = [start]
+    while queue:
+        node = queue.pop()
+        for target, (factor, _) in edges.get(node, {}).items():
+            if target not in members or factor <= 0:
+                continue
+            value = potential[node] + math.log(factor)
+            if target not in potential:
+                potential[target] = value
+                queue.append(target)
+            elif abs(potential[target] - value) > CYCLE_TOLERANCE:
+                return False
+    return True
+
+
+def _load_edges():
+    import formula_lp
+    return {source: {target: (factor, max_ratio) for target, factor, max_ratio in targets}
+            for source, targets in formula_lp.load_rule_snapshot().items()}
+
+
+def get_graph():
+    """返回当前替换关系图，首次调用时构建"""
+    global _graph
+    with _lock:
+        if _graph is None:
+            _graph = SubstitutionGraph(_load_edges())
+        return _graph
+
+
+def refresh():
+    """替换规则或分组修改后调用：重新读取规则并增量更新，返回重算的节点数"""
+    with _lock:
+        if _graph is None:
+            return 0
+        return _graph.update(_load_edges())
+
+
+def cheapest_substitute(material_code, target_date):
+    """
+    原料在指定日期最便宜的替代品（含多步替代），按 单价×换算系数 比较
+    没有可用替代品返回None
+    """
+    candidates = get_graph().get_candidates(material_code)
+    if not candidates:
+        return None
+    prices = price_index.get_prices_as_of(target_date, [material_code] + [c[0] for c in candidates])
+    best = None
+    for target, factor, max_ratio, path in candidates:
+        price = prices.get(target)
+        if price is None:
+            continue
+        effective = price * factor
+        if best is None or effective < best['effective_price']:
+            best = {
+                'material_code': material_code,
+                'target_code': target,
+                'conversion_factor': factor,
+                'max_ratio': max_ratio,
+                'path': list(path),
+                'hops': len(path) - 1,
+                'unit_price': price,
+                'effective_price': effective
+            }
+    if best is not None:
+        source_price = prices.get(material_code)
+        best['source_price'] = source_price
+        best['saving_per_unit'] = (source_price - best['effective_price']) if source_price is not None else None
+    return best
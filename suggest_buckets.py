@@ -0,0 +1,145 @@
+"""
+分组并发的原料库替换规则分析
+整个原料库一次发给大模型会超出上下文且单次调用很慢。这里先用本地的相似度键
+（规范化名称的主词 + 型号）把原料分桶，每桶（或若干小桶合并后）作为一次提示，
+最多 FAN_OUT 个同时调用，最后合并建议，去重并去掉已有的替换规则。
+每桶的调用经过 llm_cache，原料库只改动少数原料时，未变的桶直接命中缓存；
+实际发出的调用还受 llm_cache 全局并发上限约束，多个分析任务同时进行也不会超过。
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from llm_cache import ai_suggest_substitutions
+
+# 单个分析任务内同时进行的调用数
+FAN_OUT = int(os.environ.get('LLM_FAN_OUT', '4'))
+# 每次提示最多包含的原料数
+MAX_BUCKET_SIZE = 80
+
+# 括号内容、规格数字等不参与名称比较
+_BRACKETS = re.compile(r'[（(\[【].*?[)）\]】]')
+_SEPARATORS = re.compile(r'[\s\-_/,，.。、:：;；+*#]+')
+_DIGITS = re.compile(r'(?<![a-z])\d+(\.\d+)?%?')
+_MODEL_PREFIX = re.compile(r'^[A-Za-z]+')
+
+
+def name_tokens(name):
+    """规范化名称并切分为词：去括号内容、规格数字，统一大小写"""
+    text = _BRACKETS.sub(' ', str(name or '')).lower()
+    text = _DIGITS.sub(' ', text)
+    return [token for token in _SEPARATORS.split(text) if token]
+
+
+def similarity_key(material):
+    """
+    相似度键 (名称主词, 型号系列)
+    主词取名称的第一个词，纯中文连写的名称取前两个字；型号系列取型号开头的字母
+    """
+    tokens = name_tokens(material.get('material_name'))
+    head = tokens[0] if tokens else ''
+    if head and not head.isascii():
+        head = head[:2]
+    model = str(material.get('material_model') or '').strip().upper()
+    match = _MODEL_PREFIX.match(model)
+    return head, match.group(0) if match else ''
+
+
+def build_buckets(materials, max_size=MAX_BUCKET_SIZE):
+    """
+    按名称主词分桶，桶内按型号系列、编码排序；超过 max_size 的桶按序切分，
+    只有一个原料的桶按键顺序合并，凑满 max_size 再发出（单个原料自身无法两两比较）
+    """
+    by_head = {}
+    for material in materials:
+        key = similarity_key(material)
+        by_head.setdefault(key[0], []).append((key[1], str(material.get('material_code')), material))
+
+    buckets = []
+    leftovers = []
+    for head in sorted(by_head):
+        members = [m for _, _, m in sorted(by_head[head], key=lambda item: item[:2])]
+        if len(members) == 1:
+            leftovers.extend(members)
+            continue
+        for start in range(0, len(members), max_size):
+            buckets.append(members[start:start + max_size])
+    for start in range(0, len(leftovers), max_size):
+        chunk = leftovers[start:start + max_size]
+        if len(chunk) > 1:
+            buckets.append(chunk)
+    return buckets
+
+
+def merge_suggestions(results, existing_rules):
+    """合并各桶建议：按 (源, 目标) 去重，去掉自身替换和已有规则，返回 (建议列表, 去掉的已有规则数)"""
+    existing = {(rule['source_code'], rule['target_code']) for rule in existing_rules}
+    merged = {}
+    skipped_existing = 0
+    for suggestions in results:
+        for item in suggestions or []:
+            pair = (item.get('source_code'), item.get('target_code'))
+            if not pair[0] or not pair[1] or pair[0] == pair[1]:
+                continue
+            if pair in existing:
+                skipped_existing += 1
+                continue
+            # 重复建议保留置信度较高的一条
+            current = merged.get(pair)
+            if current is None or (item.get('confidence') or 0) > (current.get('confidence') or 0):
+                merged[pair] = item
+    return list(merged.values()), skipped_existing
+
+
+def suggest_substitutions(materials, existing_rules, fan_out=FAN_OUT, max_size=MAX_BUCKET_SIZE,
+                          progress=None, remaining=None):
+    """
+    分桶并发分析原料库，返回与 ai_suggest_substitutions 相同的 (是否成功, 摘要, 建议列表)
+    existing_rules 为 get_all_substitutions() 的结果；progress(已完成桶数, 总桶数) 为可选回调
+    remaining() 返回距截止时间的秒数、超时时抛出异常（如 ai_jobs 的 job.remaining），
+    每桶提交和等待结果前调用，返回值作为该桶调用的超时；超时后未开始的桶不再调用
+    部分桶失败时返回其余桶的建议，摘要中注明失败数
+    """
+    buckets = build_buckets(materials, max_size)
+    if not buckets:
+        return True, f'共 {len(materials)} 个原料，没有可比较的相似原料', []
+
+    results = []
+    errors = []
+    done = 0
+    queue = list(reversed(buckets))
+    running = set()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(fan_out, len(buckets))),
+                                  thread_name_prefix='ai-suggest')
+    try:
+        while queue or running:
+            # 有空位时才提交下一个桶，提交前检查截止时间
+            while queue and len(running) < fan_out:
+                timeout = remaining() if remaining else None
+                running.add(executor.submit(ai_suggest_substitutions, queue.pop(), timeout=timeout))
+            finished, running = wait(running, timeout=remaining() if remaining else None,
+                                     return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    success, summary, suggestions = future.result()
+                except Exception as e:
+                    success, summary, suggestions = False, str(e), None
+                if success:
+                    results.append(suggestions)
+                else:
+                    errors.append(summary)
+                done += 1
+                if progress:
+                    progress(done, len(buckets))
+    finally:
+        # 超时退出时不等待仍在进行的调用，它们受各自的单次超时约束
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    suggestions, skipped_existing = merge_suggestions(results, existing_rules)
+    if not results:
+        return False, f'全部 {len(buckets)} 组分析失败: {errors[0]}', []
+
+    summary = (f'分 {len(buckets)} 组分析 {len(materials)} 个原料，建议 {len(suggestions)} 条替换规则'
+               f'（已去除 {skipped_existing} 条已有规则）')
+    if errors:
+        summary += f'；{len(errors)} 组分析失败: {errors[0]}'
+    return True, summary, suggestions
@@ -0,0 +1,46 @@
+"""
+测试共用的临时数据库
+db 夹具建立只含基础表的临时 SQLite 文件，并让 db_pool 的连接指向它
+"""
+import sqlite3
+import pytest
+import db_pool
+
+BASE_SCHEMA = '''
+    CREATE TABLE products (
+        product_code TEXT UNIQUE, product_name TEXT, product_model TEXT,
+        customer_product_code TEXT, customer_product_name TEXT,
+        customer_code TEXT, customer_name TEXT
+    );
+    CREATE TABLE formulas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, import_date TEXT, quotation_no TEXT,
+        document_date TEXT, product_code TEXT, product_name TEXT,
+        customer_product_name TEXT, formula_type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, content_hash TEXT
+    );
+    CREATE TABLE formula_materials (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, formula_id INTEGER, material_code TEXT,
+        material_name TEXT, material_model TEXT, usage_ratio REAL, unit_price REAL
+    );
+    CREATE TABLE daily_material_prices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, price_date TEXT, material_code TEXT,
+        material_name TEXT, material_model TEXT, unit_price REAL, import_date TEXT,
+        UNIQUE(price_date, material_code)
+    );
+'''
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """临时数据库文件路径；db_pool.acquire() 返回该数据库的连接"""
+    path = str(tmp_path / 'test.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(BASE_SCHEMA)
+    conn.close()
+
+    db_pool.close_all()
+    monkeypatch.setattr(db_pool, '_db_path', path)
+    monkeypatch.setattr(db_pool, '_row_factory', None)
+    yield path
+    db_pool.close_all()
+
@@ -0,0 +1,50 @@
+"""批量优化结果在一个事务中保存，LP 结果的用量和替换明细原样保留"""
+import pytest
+from db_pool import pooled_connection
+import batch_optimize
+import formula_lp
+
+PRICES = {'A': 10.0, 'B': 4.0, 'X': 6.0, 'Z': 3.0}
+RULES = {'A': [('X', 1.2, 0.5)], 'B': [('Z', 1.0, 0.5)]}
+FORMULAS = [
+    ((1, 'P1', '涂料', '报价配方', 'Q1'), [('A', '甲', 0.6), ('B', '乙', 0.4)]),
+    ((2, 'P2', '涂料', '报价配方', 'Q2'), [('B', '乙', 1.0)]),
+]
+
+
+@pytest.fixture
+def results(db):
+    batch_optimize.init_batch_tables()
+    solved = []
+    for formula, materials in FORMULAS:
+        result, _ = formula_lp.solve_formula(formula, materials, PRICES, RULES, '2025-01-01', 'lp')
+        solved.append(result)
+    return solved
+
+
+def _counts():
+    with pooled_connection() as conn:
+        return (conn.execute('SELECT COUNT(*) FROM batch_optimization_runs').fetchone()[0],
+                conn.execute('SELECT COUNT(*) FROM batch_optimization_results').fetchone()[0])
+
+
+def test_saved_results_round_trip(results):
+    run_id, saved = batch_optimize.save_results('2025-01-01', 'lp', len(FORMULAS), results)
+    assert set(saved) == {1, 2}
+    loaded = {item['formula_id']: item for item in batch_optimize.get_run_results(run_id)}
+    for result in results:
+        item = loaded[result['formula_id']]
+        assert item['id'] == saved[result['formula_id']]
+        assert item['saving'] == result['saving'] > 0
+        assert item['materials'] == result['materials']
+        assert item['substitutions'] == result['substitutions']
+        assert (item['solver'], item['status'], item['mip_gap']) == \
+            (result['solver'], result['status'], result['mip_gap'])
+
+
+def test_failed_save_rolls_back_whole_batch(results):
+    broken = dict(results[1])
+    del broken['substitutions']
+    with pytest.raises(KeyError):
+        batch_optimize.save_results('2025-01-01', 'lp', len(FORMULAS), [results[0], broken])
+    assert _counts() == (0, 0)
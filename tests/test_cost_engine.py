@@ -0,0 +1,108 @@
+"""稀疏矩阵成本计算与最低成本配方：与逐配方直接求和的结果比较"""
+import random
+import pytest
+from db_pool import pooled_connection
+import price_index
+import price_intervals
+import cost_engine
+
+TARGET_DATE = '2025-03-01'
+TYPES = ('生产配方', '报价配方')
+
+
+def _populate(rng, product_count=12, material_count=15):
+    """每个产品每种类型若干配方；部分原料在目标日期前没有价格"""
+    codes = [f'M{i:02d}' for i in range(material_count)]
+    priced = {code: round(rng.uniform(1, 30), 2) for code in codes if rng.random() < 0.8}
+    formulas = {}
+    with pooled_connection() as conn:
+        for code, price in priced.items():
+            conn.execute('''
+                INSERT INTO daily_material_prices (price_date, material_code, unit_price)
+                VALUES (?, ?, ?)
+            ''', ('2025-02-01', code, price))
+        # 目标日期之后的价格不影响当日成本
+        conn.execute('''
+            INSERT INTO daily_material_prices (price_date, material_code, unit_price)
+            VALUES ('2025-04-01', ?, 999)
+        ''', (codes[0],))
+        for p in range(product_count):
+            for formula_type in TYPES:
+                for _ in range(rng.randint(1, 4)):
+                    formula_id = conn.execute('''
+                        INSERT INTO formulas (product_code, product_name, formula_type)
+                        VALUES (?, ?, ?)
+                    ''', (f'P{p:02d}', f'产品{p}', formula_type)).lastrowid
+                    usage = {code: round(rng.uniform(0.01, 0.5), 4)
+                             for code in rng.sample(codes, rng.randint(1, 5))}
+                    for code, ratio in usage.items():
+                        conn.execute('''
+                            INSERT INTO formula_materials (formula_id, material_code, usage_ratio)
+                            VALUES (?, ?, ?)
+                        ''', (formula_id, code, ratio))
+                    formulas[formula_id] = (f'P{p:02d}', formula_type, usage)
+        conn.commit()
+    return priced, formulas
+
+
+@pytest.fixture
+def data(db):
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+    price_intervals.init_price_intervals()
+    priced, formulas = _populate(random.Random(11))
+    yield priced, formulas
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+
+
+def _brute_costs(priced, formulas):
+    return {formula_id: (sum(ratio * priced.get(code, 0.0) for code, ratio in usage.items()),
+                         sum(1 for code in usage if code not in priced))
+            for formula_id, (_, _, usage) in formulas.items()}
+
+
+def test_csr_costs_match_direct_sum(data):
+    priced, formulas = data
+    matrix, total_costs, missing_counts = cost_engine.compute_costs(TARGET_DATE)
+    expected = _brute_costs(priced, formulas)
+    assert sorted(matrix.formula_ids) == sorted(expected)
+    for row, formula_id in enumerate(matrix.formula_ids):
+        assert total_costs[row] == pytest.approx(expected[formula_id][0])
+        assert missing_counts[row] == expected[formula_id][1]
+
+
+def test_column_entries_match_rows(data):
+    _, formulas = data
+    matrix = cost_engine.get_formula_matrix()
+    for col, code in enumerate(matrix.material_codes):
+        rows, ratios = matrix.column_entries(col)
+        actual = {matrix.formula_ids[row]: ratio for row, ratio in zip(rows, ratios)}
+        expected = {fid: usage[code] for fid, (_, _, usage) in formulas.items() if code in usage}
+        assert actual == pytest.approx(expected)
+
+
+def test_lowest_cost_prefers_complete_formulas(data):
+    priced, formulas = data
+    costs = _brute_costs(priced, formulas)
+    expected = {}
+    for formula_id in sorted(formulas):
+        key = formulas[formula_id][:2]
+        rank = (costs[formula_id][1] > 0, costs[formula_id][0])
+        if key not in expected or rank < expected[key][0]:
+            expected[key] = (rank, formula_id)
+
+    lowest = cost_engine.get_lowest_cost_by_product(TARGET_DATE)
+    assert {key: item['formula_id'] for key, item in lowest.items()} == \
+        {key: formula_id for key, (_, formula_id) in expected.items()}
+    # 数据中确实存在缺价配方成本更低、却不应入选的产品
+    assert any(costs[fid][1] > 0 and costs[fid][0] < lowest[formulas[fid][:2]]['total_cost']
+               and lowest[formulas[fid][:2]]['missing_count'] == 0 for fid in formulas)
+
+
+def test_lowest_cost_list_matches_by_product(data):
+    lowest = cost_engine.get_lowest_cost_by_product(TARGET_DATE)
+    results = cost_engine.get_lowest_cost_list(TARGET_DATE)
+    assert sorted(item['id'] for item in results) == sorted(item['formula_id'] for item in lowest.values())
+    codes = [item['product_code'] or '' for item in results]
+    assert codes == sorted(codes)
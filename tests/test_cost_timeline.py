@@ -0,0 +1,122 @@
+"""区间最低成本与成本走势：增量推进的结果与逐日全量计算比较"""
+import random
+from datetime import date, timedelta
+import pytest
+from db_pool import pooled_connection
+import price_index
+import price_intervals
+import cost_engine
+import cost_timeline
+
+START = date(2025, 1, 1)
+DAYS = 40
+TYPES = ('生产配方', '报价配方')
+
+
+def _populate(rng, product_count=8, material_count=10):
+    """价格随机变化；部分原料从区间中途才有价格，部分原料始终没有价格"""
+    codes = [f'M{i:02d}' for i in range(material_count)]
+    daily = {code: [] for code in codes}
+    with pooled_connection() as conn:
+        for code in codes[:-1]:
+            first = rng.choice([0, 0, 0, rng.randrange(1, DAYS)])
+            price = round(rng.uniform(1, 20), 2)
+            for offset in range(first, DAYS):
+                if rng.random() < 0.2:
+                    price = round(rng.uniform(1, 20), 2)
+                if rng.random() < 0.3:
+                    continue
+                day = (START + timedelta(days=offset)).isoformat()
+                conn.execute('''
+                    INSERT INTO daily_material_prices (price_date, material_code, unit_price)
+                    VALUES (?, ?, ?)
+                ''', (day, code, price))
+                daily[code].append((day, price))
+        formulas = {}
+        for p in range(product_count):
+            for formula_type in TYPES:
+                for _ in range(rng.randint(1, 4)):
+                    formula_id = conn.execute('''
+                        INSERT INTO formulas (product_code, product_name, formula_type)
+                        VALUES (?, ?, ?)
+                    ''', (f'P{p}', f'产品{p}', formula_type)).lastrowid
+                    usage = {code: round(rng.uniform(0.05, 0.5), 3)
+                             for code in rng.sample(codes, rng.randint(1, 4))}
+                    for code, ratio in usage.items():
+                        conn.execute('''
+                            INSERT INTO formula_materials (formula_id, material_code, usage_ratio)
+                            VALUES (?, ?, ?)
+                        ''', (formula_id, code, ratio))
+                    formulas[formula_id] = (f'P{p}', formula_type, usage)
+        conn.commit()
+    return daily, formulas
+
+
+@pytest.fixture
+def data(db):
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+    price_intervals.init_price_intervals()
+    yield _populate(random.Random(5))
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+
+
+def _as_of(series, day):
+    price = None
+    for price_date, unit_price in series:
+        if price_date <= day:
+            price = unit_price
+    return price
+
+
+def _brute_costs(daily, formulas, day):
+    """某一天每个配方的 (总成本, 缺失价格数)"""
+    prices = {code: _as_of(series, day) for code, series in daily.items()}
+    return {formula_id: (sum(ratio * (prices[code] or 0.0) for code, ratio in usage.items()),
+                         sum(1 for code in usage if prices[code] is None))
+            for formula_id, (_, _, usage) in formulas.items()}
+
+
+def _days(start_offset, end_offset):
+    return [(START + timedelta(days=d)).isoformat() for d in range(start_offset, end_offset + 1)]
+
+
+def test_lowest_cost_range_matches_daily_scan(data):
+    daily, formulas = data
+    days = _days(2, DAYS + 2)
+    segments = cost_timeline.lowest_cost_range(days[0], days[-1])
+    chosen = {}
+    for day, item in cost_timeline.iter_lowest_cost_by_day(segments):
+        chosen[(day, item['product_code'], item['formula_type'])] = item
+
+    for day in days:
+        costs = _brute_costs(daily, formulas, day)
+        best = {}
+        for formula_id in sorted(formulas):
+            key = formulas[formula_id][:2]
+            rank = (costs[formula_id][1] > 0, costs[formula_id][0])
+            if key not in best or rank < best[key]:
+                best[key] = rank
+        for key, (incomplete, cost) in best.items():
+            item = chosen[(day,) + key]
+            actual = costs[item['formula_id']]
+            # 并列时允许选中成本相同的另一配方
+            assert (actual[1] > 0) == incomplete
+            assert actual[0] == pytest.approx(cost)
+            assert item['total_cost'] == pytest.approx(actual[0], abs=1e-4)
+            assert item['missing_count'] == actual[1]
+
+
+def test_formula_cost_series_matches_daily_scan(data):
+    daily, formulas = data
+    days = _days(0, DAYS - 1)
+    formula_ids = sorted(formulas)
+    series = cost_timeline.formula_cost_series(formula_ids, days[0], days[-1])
+    for formula_id in formula_ids:
+        expanded = list(cost_timeline.expand_daily(series[formula_id]['points'], days[-1]))
+        assert [day for day, _, _ in expanded] == days
+        for day, total_cost, missing_count in expanded:
+            expected = _brute_costs(daily, {formula_id: formulas[formula_id]}, day)[formula_id]
+            assert total_cost == pytest.approx(expected[0], abs=1e-4)
+            assert missing_count == expected[1]
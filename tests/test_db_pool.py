@@ -0,0 +1,33 @@
+"""连接池：异常时归还连接，借出数不超过上限"""
+import sqlite3
+import threading
+import pytest
+import db_pool
+from db_pool import pooled_connection
+
+
+@pytest.fixture
+def small_pool(db, monkeypatch):
+    monkeypatch.setattr(db_pool, '_slots', threading.BoundedSemaphore(2))
+    monkeypatch.setattr(db_pool, 'ACQUIRE_TIMEOUT', 0.05)
+
+
+def test_exception_returns_connection(small_pool):
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            with pooled_connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute("INSERT INTO products (product_code) VALUES ('P1')")
+                raise ValueError('boom')
+
+    # 未提交的事务已回滚，连接都已归还
+    with pooled_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM products').fetchone()[0] == 0
+
+
+def test_checked_out_connections_are_capped(small_pool):
+    with pooled_connection(), pooled_connection():
+        with pytest.raises(sqlite3.OperationalError):
+            db_pool.acquire()
+    with pooled_connection(), pooled_connection():
+        pass
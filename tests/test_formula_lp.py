@@ -0,0 +1,48 @@
+"""线性规划优化：总用量约束生效，求解状态按求解器返回的 status 报告"""
+from types import SimpleNamespace
+import pytest
+import formula_lp
+
+FORMULA = (1, 'P1', '涂料', '报价配方', 'Q1')
+MATERIALS = [('A', '甲', 0.5), ('B', '乙', 0.5)]
+PRICES = {'A': 10.0, 'B': 10.0, 'X': 4.0, 'Y': 9.0}
+# A→X 单位节省大但用量放大 1.5 倍；B→Y 节省小、用量不变
+RULES = {'A': [('X', 1.5, 1.0)], 'B': [('Y', 1.0, 1.0)]}
+
+
+def _solve(tolerance):
+    result, message = formula_lp.solve_formula(FORMULA, MATERIALS, PRICES, RULES, '2025-01-01', 'lp',
+                                               usage_tolerance=tolerance)
+    assert result is not None, message
+    return result
+
+
+@pytest.mark.skipif(formula_lp.milp is None, reason='需要 scipy')
+def test_default_tolerance_limits_total_usage():
+    unlimited = _solve(None)
+    limited = _solve(formula_lp.TOTAL_USAGE_TOLERANCE)
+    assert unlimited['new_total_usage'] - 1.0 > formula_lp.TOTAL_USAGE_TOLERANCE
+    assert limited['within_tolerance'] and limited['status'] == 'optimal'
+    assert limited['usage_tolerance'] == formula_lp.TOTAL_USAGE_TOLERANCE
+    assert abs(limited['new_total_usage'] - 1.0) <= formula_lp.TOTAL_USAGE_TOLERANCE + 1e-9
+    assert limited['optimized_cost'] > unlimited['optimized_cost']
+
+
+@pytest.mark.parametrize('mode, status, mip_gap, expected', [
+    ('lp', 0, None, ('optimal', 0.0)),
+    ('lp', 1, None, ('time_limit', None)),
+    ('milp', 0, 1e-5, ('optimal', 1e-5)),
+    ('milp', 1, 0.2, ('time_limit', 0.2)),
+    ('milp', 2, None, ('infeasible', None)),
+])
+def test_solver_status_follows_result_status(mode, status, mip_gap, expected):
+    result = SimpleNamespace(status=status, message='infeasible', mip_gap=mip_gap)
+    assert formula_lp._solver_status(result, mode) == expected
+
+
+def test_parse_usage_tolerance():
+    assert formula_lp.parse_usage_tolerance('') == (formula_lp.TOTAL_USAGE_TOLERANCE, '')
+    assert formula_lp.parse_usage_tolerance('none') == (None, '@none')
+    assert formula_lp.parse_usage_tolerance('0.1') == (0.1, '@0.1')
+    with pytest.raises(ValueError):
+        formula_lp.parse_usage_tolerance('2')
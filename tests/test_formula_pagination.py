@@ -0,0 +1,113 @@
+"""游标分页：逐页读取的结果与一次性排序的结果比较"""
+import random
+import pytest
+from db_pool import pooled_connection
+import price_index
+import price_intervals
+import cost_engine
+import cost_snapshot
+import search_index
+import formula_pagination
+
+TARGET_DATE = '2025-03-01'
+TYPE_RANK = {'生产配方': 0, '报价配方': 1}
+
+
+@pytest.fixture
+def formulas(db):
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+    price_intervals.init_price_intervals()
+    search_index.init_search_index()
+    cost_snapshot.init_snapshot_tables()
+    formula_pagination.init_pagination_indexes()
+    rng = random.Random(21)
+    with pooled_connection() as conn:
+        conn.executemany('''
+            INSERT INTO daily_material_prices (price_date, material_code, unit_price)
+            VALUES ('2025-01-01', ?, ?)
+        ''', [('M1', 2.0), ('M2', 3.0)])
+        for _ in range(57):
+            # 产品编码、类型和成本都大量重复，检验按 id 的并列处理；含空产品编码和其他类型
+            formula_id = conn.execute('''
+                INSERT INTO formulas (product_code, product_name, formula_type) VALUES (?, ?, ?)
+            ''', (rng.choice(['P1', 'P2', 'P3', None]), '涂料',
+                  rng.choice(['生产配方', '报价配方', '试验配方']))).lastrowid
+            conn.execute('''
+                INSERT INTO formula_materials (formula_id, material_code, usage_ratio) VALUES (?, ?, ?)
+            ''', (formula_id, rng.choice(['M1', 'M2', 'M3']), rng.choice([0.5, 1.0])))
+        conn.commit()
+    yield
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+
+
+def _reference(sort, formula_type=''):
+    with pooled_connection() as conn:
+        rows = conn.execute('''
+            SELECT f.id, f.product_code, f.formula_type, COALESCE(s.total_cost, 0)
+            FROM formulas f
+            LEFT JOIN formula_cost_snapshot s ON s.formula_id = f.id AND s.snapshot_date = ?
+        ''', (TARGET_DATE,)).fetchall()
+    keys = {
+        'cost': lambda r: (r[3], r[0]),
+        'product_code': lambda r: (r[1] or '', r[0]),
+        'type': lambda r: (TYPE_RANK.get(r[2], 2), r[1] or '', r[0]),
+    }
+    return [r[0] for r in sorted(rows, key=keys[sort]) if not formula_type or r[2] == formula_type]
+
+
+def _all_pages(sort, page_size, formula_type=''):
+    ids = []
+    token = None
+    while True:
+        page, token = formula_pagination.get_formulas_page(
+            TARGET_DATE, formula_type=formula_type, sort=sort, cursor_token=token, page_size=page_size)
+        assert len(page) <= page_size
+        ids.extend(item['id'] for item in page)
+        if token is None:
+            return ids
+        assert len(page) == page_size
+
+
+@pytest.mark.parametrize('sort', ['cost', 'product_code', 'type'])
+@pytest.mark.parametrize('page_size', [1, 7, 57, 100])
+def test_pages_concatenate_to_full_order(formulas, sort, page_size):
+    assert _all_pages(sort, page_size) == _reference(sort)
+
+
+def test_costs_have_ties(formulas):
+    formula_pagination.get_formulas_page(TARGET_DATE, sort='cost')
+    with pooled_connection() as conn:
+        costs = [row[0] for row in conn.execute(
+            'SELECT total_cost FROM formula_cost_snapshot WHERE snapshot_date = ?', (TARGET_DATE,))]
+    assert len(costs) == 57 and 1 < len(set(costs)) < len(costs)
+
+
+def test_filtered_pages(formulas):
+    assert _all_pages('cost', 5, '报价配方') == _reference('cost', '报价配方')
+
+
+def test_invalid_cursor_starts_from_first_page(formulas):
+    first, _ = formula_pagination.get_formulas_page(TARGET_DATE, sort='type', page_size=5)
+    again, _ = formula_pagination.get_formulas_page(TARGET_DATE, sort='type', cursor_token='not-a-cursor',
+                                                    page_size=5)
+    assert [f['id'] for f in again] == [f['id'] for f in first]
+
+
+@pytest.mark.parametrize('sort', ['cost', 'product_code', 'type'])
+def test_pages_use_index_order(formulas, sort):
+    """排序沿索引顺序扫描：查询计划中没有临时 B 树，也没有逐行的原料计数子查询"""
+    _, token = formula_pagination.get_formulas_page(TARGET_DATE, sort=sort, page_size=5)
+    statements = []
+    # 池按后进先出借出，分页查询会拿到这里设置了跟踪的连接
+    with pooled_connection() as conn:
+        conn.set_trace_callback(statements.append)
+    formula_pagination.get_formulas_page(TARGET_DATE, sort=sort, cursor_token=token, page_size=5)
+    conn.set_trace_callback(None)
+    page_sql = next(sql for sql in statements if 'ORDER BY' in sql)
+    assert 'SELECT COUNT(*)' not in page_sql
+    with pooled_connection() as conn:
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + page_sql)]
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') and 'USING' not in step for step in plan), plan
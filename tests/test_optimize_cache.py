@@ -0,0 +1,111 @@
+"""优化结果缓存的选择性失效：与按定义逐条判断的结果比较"""
+import random
+import pytest
+from db_pool import pooled_connection
+import data_version
+import optimize_cache
+import substitution_graph
+from substitution_graph import SubstitutionGraph
+
+# 替代关系 A→X、B→Y：X 的价格变化影响用到 A 的配方
+EDGES = {'A': {'X': (1.0, 0.5)}, 'B': {'Y': (1.2, 0.5)}}
+FORMULAS = {1: ['A', 'C'], 2: ['B'], 3: ['C', 'D'], 4: ['X'], 5: ['D']}
+DATES = ['2025-01-01', '2025-02-01', '2025-03-01']
+
+
+@pytest.fixture
+def cache(db, monkeypatch):
+    data_version.init_data_version_table()
+    with pooled_connection() as conn:
+        conn.executemany('INSERT INTO formula_materials (formula_id, material_code) VALUES (?, ?)',
+                         [(fid, code) for fid, codes in FORMULAS.items() for code in codes])
+        conn.commit()
+    monkeypatch.setattr(substitution_graph, '_graph', SubstitutionGraph(EDGES))
+    optimize_cache.clear()
+    monkeypatch.setattr(optimize_cache, '_synced_rule_version', 0)
+    monkeypatch.setattr(optimize_cache, '_synced_price_version', 0)
+    for fid in FORMULAS:
+        for day in DATES:
+            optimize_cache.put(fid, day, 'greedy', {'formula_id': fid, 'date': day}, 'ok')
+    yield
+    optimize_cache.clear()
+
+
+def _cached_keys():
+    return {(fid, day) for fid in FORMULAS for day in DATES
+            if optimize_cache.get(fid, day, 'greedy') is not None}
+
+
+def _affected_by_prices(codes):
+    sources = set(codes) | {source for source, targets in EDGES.items() if set(targets) & set(codes)}
+    return {fid for fid, used in FORMULAS.items() if sources & set(used)}
+
+
+def test_hit_until_unregistered_write(cache):
+    assert optimize_cache.get(1, DATES[0], 'greedy') == ({'formula_id': 1, 'date': DATES[0]}, 'ok')
+    data_version.bump_data_version()
+    assert _cached_keys() == set()
+
+
+def test_price_change_drops_only_affected_entries(cache):
+    data_version.bump_data_version()
+    optimize_cache.invalidate_prices(['X'], from_date=DATES[1])
+    affected = _affected_by_prices(['X'])
+    assert affected == {1, 4}
+    assert _cached_keys() == {(fid, day) for fid in FORMULAS for day in DATES
+                              if fid not in affected or day < DATES[1]}
+
+
+def test_rule_change_drops_only_listed_sources(cache):
+    data_version.bump_rule_version()
+    optimize_cache.invalidate_rules(['B'])
+    assert _cached_keys() == {(fid, day) for fid in FORMULAS for day in DATES if fid != 2}
+    data_version.bump_rule_version()
+    optimize_cache.invalidate_rules()
+    assert _cached_keys() == set()
+
+
+def test_rule_change_in_other_process_drops_everything(cache):
+    # 其他进程修改规则只递增数据库中的规则版本，本进程未登记
+    data_version.bump_rule_version()
+    assert _cached_keys() == set()
+
+
+def test_stale_entry_is_not_revived(cache):
+    # 一次未登记的写入后再登记一次修改：全部记录已过期，不能因续期而复活
+    data_version.bump_data_version()
+    data_version.bump_data_version()
+    optimize_cache.invalidate_formula(3)
+    assert _cached_keys() == set()
+
+
+def test_random_sequence_matches_reference(cache):
+    rng = random.Random(3)
+    valid = {(fid, day) for fid in FORMULAS for day in DATES}
+    for _ in range(30):
+        action = rng.random()
+        if action < 0.4:
+            codes = rng.sample(['A', 'B', 'C', 'D', 'X', 'Y'], rng.randint(1, 2))
+            from_date = rng.choice(DATES)
+            data_version.bump_data_version()
+            optimize_cache.invalidate_prices(codes, from_date)
+            affected = _affected_by_prices(codes)
+            valid = {key for key in valid if key[0] not in affected or key[1] < from_date}
+        elif action < 0.6:
+            fid = rng.choice(list(FORMULAS))
+            data_version.bump_data_version()
+            optimize_cache.invalidate_formula(fid)
+            valid = {key for key in valid if key[0] != fid}
+        elif action < 0.7:
+            data_version.bump_data_version()
+            optimize_cache.sync_version()
+        elif action < 0.8:
+            codes = rng.sample(['A', 'B', 'C', 'D'], rng.randint(1, 2))
+            data_version.bump_rule_version()
+            optimize_cache.invalidate_rules(codes)
+            valid = {key for key in valid if not set(FORMULAS[key[0]]) & set(codes)}
+        else:
+            fid, day = rng.choice(list(FORMULAS)), rng.choice(DATES)
+            optimize_cache.put(fid, day, 'greedy', {'formula_id': fid, 'date': day}, 'ok')
+            valid.add((fid, day))
+        assert _cached_keys() == valid
@@ -0,0 +1,60 @@
+"""内存价格索引跟随其他进程的写入"""
+import sqlite3
+import pytest
+import price_index
+import price_intervals
+
+
+@pytest.fixture
+def index(db, monkeypatch):
+    monkeypatch.setattr(price_index, 'SYNC_INTERVAL', 0)
+    price_index.invalidate_all()
+    price_intervals.init_price_intervals()
+    _write_elsewhere(db, [('2025-01-01', 'A', 10.0), ('2025-01-01', 'B', 5.0)])
+    yield db
+    price_index.invalidate_all()
+
+
+def _write_elsewhere(path, rows):
+    """模拟另一个进程：独立连接写入价格并在同一事务中重算区间，不通知本进程的索引"""
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO daily_material_prices (price_date, material_code, unit_price) VALUES (?, ?, ?)
+    ''', rows)
+    price_intervals.refresh_dirty(cursor)
+    conn.commit()
+    conn.close()
+
+
+def test_sees_prices_written_by_other_process(index):
+    assert price_index.get_price_as_of('A', '2025-01-05') == 10.0
+    _write_elsewhere(index, [('2025-01-03', 'A', 12.0), ('2025-01-02', 'C', 7.0)])
+    assert price_index.get_price_as_of('A', '2025-01-05') == 12.0
+    assert price_index.get_price_as_of('A', '2025-01-02') == 10.0
+    assert price_index.get_prices_as_of('2025-01-05', ['A', 'B', 'C']) == {'A': 12.0, 'B': 5.0, 'C': 7.0}
+
+
+def test_reloads_everything_after_change_log_pruned(index, monkeypatch):
+    assert price_index.get_price_as_of('B', '2025-01-05') == 5.0
+    monkeypatch.setattr(price_intervals, 'CHANGE_LOG_SIZE', 1)
+    _write_elsewhere(index, [('2025-01-02', 'A', 11.0), ('2025-01-02', 'B', 6.0)])
+    _write_elsewhere(index, [('2025-01-03', 'A', 13.0)])
+    assert price_index.get_prices_as_of('2025-01-05', ['A', 'B']) == {'A': 13.0, 'B': 6.0}
+
+
+def test_lookups_between_syncs_stay_in_memory(index, monkeypatch):
+    monkeypatch.setattr(price_index, 'SYNC_INTERVAL', 3600)
+    assert price_index.get_price_as_of('A', '2025-01-05') == 10.0
+    _write_elsewhere(index, [('2025-01-03', 'A', 12.0)])
+
+    def no_connection():
+        raise AssertionError('查询不应访问数据库')
+    pooled_connection = price_index.pooled_connection
+    monkeypatch.setattr(price_index, 'pooled_connection', no_connection)
+    assert price_index.get_price_as_of('A', '2025-01-05') == 10.0
+    assert price_index.get_price_series_many(['A', 'Z']) == {'A': (['2025-01-01'], [10.0]), 'Z': ([], [])}
+
+    monkeypatch.setattr(price_index, 'pooled_connection', pooled_connection)
+    monkeypatch.setattr(price_index, 'SYNC_INTERVAL', 0)
+    assert price_index.get_price_as_of('A', '2025-01-05') == 12.0
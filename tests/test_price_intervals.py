@@ -0,0 +1,170 @@
+"""价格区间与逐日记录的一致性：与直接扫描 daily_material_prices 的结果比较"""
+import random
+from datetime import date, timedelta
+import pytest
+from db_pool import pooled_connection
+import price_intervals
+
+START = date(2025, 1, 1)
+DAYS = 60
+
+
+def _random_prices(rng, codes):
+    """每个原料随机缺若干天，单价在少数几个值之间变化，保证出现间隔两侧单价相同的情况"""
+    rows = []
+    for code in codes:
+        price = rng.choice([10.0, 12.5])
+        for offset in range(DAYS):
+            if rng.random() < 0.25:
+                continue
+            if rng.random() < 0.15:
+                price = rng.choice([10.0, 12.5, 15.0])
+            day = (START + timedelta(days=offset)).isoformat()
+            rows.append((day, code, f'原料{code}', 'M1', price, f'{day} 导入'))
+    return rows
+
+
+def _insert(rows):
+    with pooled_connection() as conn:
+        conn.executemany('''
+            INSERT INTO daily_material_prices
+                (price_date, material_code, material_name, material_model, unit_price, import_date)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+
+
+def _daily(code):
+    with pooled_connection() as conn:
+        return conn.execute('''
+            SELECT price_date, unit_price FROM daily_material_prices
+            WHERE material_code = ? ORDER BY price_date
+        ''', (code,)).fetchall()
+
+
+def _intervals(code):
+    with pooled_connection() as conn:
+        return conn.execute('''
+            SELECT valid_from, valid_to, unit_price FROM material_price_intervals
+            WHERE material_code = ? ORDER BY valid_from
+        ''', (code,)).fetchall()
+
+
+def _brute_as_of(daily, target):
+    price = None
+    for day, unit_price in daily:
+        if day <= target:
+            price = unit_price
+    return price
+
+
+def _covered_days(intervals):
+    days = {}
+    for valid_from, valid_to, unit_price in intervals:
+        current = date.fromisoformat(valid_from)
+        while current <= date.fromisoformat(valid_to):
+            days[current.isoformat()] = unit_price
+            current += timedelta(days=1)
+    return days
+
+
+@pytest.fixture
+def prices(db):
+    rng = random.Random(7)
+    codes = ['A', 'B', 'C']
+    _insert(_random_prices(rng, codes))
+    price_intervals.init_price_intervals()
+    return rng, codes
+
+
+def test_intervals_cover_exactly_recorded_days(prices):
+    _, codes = prices
+    for code in codes:
+        assert _covered_days(_intervals(code)) == dict(_daily(code))
+
+
+def test_as_of_matches_scan(prices):
+    _, codes = prices
+    for code in codes:
+        daily = _daily(code)
+        for offset in range(-2, DAYS + 3):
+            target = (START + timedelta(days=offset)).isoformat()
+            assert price_intervals.get_price_as_of(code, target) == _brute_as_of(daily, target)
+
+
+def test_incremental_refresh_matches_rebuild(prices):
+    rng, codes = prices
+    with pooled_connection() as conn:
+        for _ in range(40):
+            code = rng.choice(codes)
+            day = (START + timedelta(days=rng.randrange(DAYS))).isoformat()
+            action = rng.random()
+            if action < 0.4:
+                conn.execute('DELETE FROM daily_material_prices WHERE material_code = ? AND price_date = ?',
+                             (code, day))
+            elif action < 0.7:
+                conn.execute('UPDATE daily_material_prices SET unit_price = ? WHERE material_code = ? AND price_date = ?',
+                             (rng.choice([10.0, 12.5, 15.0]), code, day))
+            else:
+                conn.execute('''
+                    INSERT OR IGNORE INTO daily_material_prices (price_date, material_code, unit_price)
+                    VALUES (?, ?, ?)
+                ''', (day, code, rng.choice([10.0, 12.5])))
+            if rng.random() < 0.3:
+                price_intervals.refresh_dirty(conn.cursor())
+        conn.commit()
+
+    price_intervals.refresh_dirty()
+    incremental = {code: _intervals(code) for code in codes}
+    price_intervals.rebuild_all()
+    assert incremental == {code: _intervals(code) for code in codes}
+    for code in codes:
+        assert _covered_days(incremental[code]) == dict(_daily(code))
+
+
+def test_history_returns_recorded_rows(prices):
+    _, codes = prices
+    for code in codes:
+        history = price_intervals.get_material_price_history(code)
+        assert [(row['price_date'], row['unit_price']) for row in reversed(history)] == _daily(code)
+        assert all(row['is_recorded'] for row in history)
+
+    start, end = '2025-01-10', '2025-01-20'
+    history = price_intervals.get_material_price_history('A', start, end)
+    assert [(row['price_date'], row['unit_price']) for row in reversed(history)] == \
+        [row for row in _daily('A') if start <= row[0] <= end]
+
+
+def test_expanded_history_fills_gaps_with_as_of_price(prices):
+    import search_index
+    search_index.init_search_index()
+    _, codes = prices
+    start, end = '2025-01-05', '2025-02-20'
+    for code in codes:
+        daily = _daily(code)
+        recorded = dict(daily)
+        history = price_intervals.get_material_price_history(code, start, end, expand_days=True)
+        days = [row['price_date'] for row in history]
+        assert days == sorted(days, reverse=True) and len(days) == len(set(days))
+        for row in history:
+            assert row['unit_price'] == _brute_as_of(daily, row['price_date'])
+            assert row['is_recorded'] == (row['price_date'] in recorded)
+        # 从第一个有价格的日期到最后一条记录（不超过 end），每天一行
+        first = max(start, daily[0][0])
+        last = min(end, daily[-1][0])
+        expected = (date.fromisoformat(last) - date.fromisoformat(first)).days + 1
+        assert len(history) == expected
+
+
+def test_price_index_matches_scan(prices):
+    import price_index
+    price_index.invalidate_all()
+    _, codes = prices
+    for code in codes:
+        daily = _daily(code)
+        for offset in range(-2, DAYS + 3):
+            target = (START + timedelta(days=offset)).isoformat()
+            assert price_index.get_price_as_of(code, target) == _brute_as_of(daily, target)
+        _, series = price_index.get_price_series(code)
+        assert all(a != b for a, b in zip(series, series[1:]))
+    price_index.invalidate_all()
@@ -0,0 +1,52 @@
+"""调价模拟的最低成本配方对比"""
+import pytest
+from db_pool import pooled_connection
+import price_index
+import price_intervals
+import cost_engine
+import price_scenario
+
+TARGET_DATE = '2025-03-01'
+
+
+@pytest.fixture
+def product(db):
+    """产品 P1 两个报价配方：F1 价格齐全成本 10，F2 含一个无价格原料（按 0 计为 3）"""
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+    price_intervals.init_price_intervals()
+    with pooled_connection() as conn:
+        conn.executemany('''
+            INSERT INTO daily_material_prices (price_date, material_code, unit_price)
+            VALUES ('2025-02-01', ?, ?)
+        ''', [('A', 10.0), ('B', 3.0), ('C', 1.0)])
+        conn.executemany('''
+            INSERT INTO formulas (id, product_code, product_name, formula_type)
+            VALUES (?, 'P1', '产品1', '报价配方')
+        ''', [(1,), (2,)])
+        conn.executemany('''
+            INSERT INTO formula_materials (formula_id, material_code, usage_ratio)
+            VALUES (?, ?, ?)
+        ''', [(1, 'A', 1.0), (2, 'B', 1.0), (2, 'X', 1.0)])
+        conn.commit()
+    yield
+    price_index.invalidate_all()
+    cost_engine.invalidate()
+
+
+def test_incomplete_formula_does_not_win_or_switch(product):
+    # 给缺价原料补上较高价格：两次对比都应选 F1，不应报告切换
+    result = price_scenario.simulate(TARGET_DATE, price_scenario.parse_overrides(
+        [{'material_code': 'X', 'unit_price': 20}]))
+    assert result['summary']['switched_products'] == 0
+    assert result['lowest_changes'] == []
+
+
+def test_filled_price_can_switch_to_cheaper_formula(product):
+    result = price_scenario.simulate(TARGET_DATE, price_scenario.parse_overrides(
+        [{'material_code': 'X', 'unit_price': 2}]))
+    change, = result['lowest_changes']
+    assert (change['base_formula_id'], change['new_formula_id']) == (1, 2)
+    assert (change['base_missing_count'], change['new_missing_count']) == (0, 0)
+    assert change['new_cost'] == pytest.approx(5.0)
+    assert change['switched']
@@ -0,0 +1,123 @@
+"""替换关系图：多步候选、替换环与增量更新，与穷举路径/全量重建比较"""
+import itertools
+import math
+import random
+import pytest
+import substitution_graph
+from substitution_graph import SubstitutionGraph, MAX_HOPS
+
+
+def _random_edges(rng, node_count=9, edge_count=18):
+    nodes = [f'M{i}' for i in range(node_count)]
+    edges = {}
+    for source, target in rng.sample([p for p in itertools.permutations(nodes, 2)], edge_count):
+        edges.setdefault(source, {})[target] = (rng.choice([0.5, 0.8, 1.0, 1.25, 2.0]),
+                                                rng.choice([0.3, 0.5, 1.0]))
+    return edges
+
+
+def _brute_candidates(edges, source):
+    """穷举 MAX_HOPS 步以内不重复经过节点的全部路径，每个目标取最小换算系数"""
+    best = {}
+    stack = [((source,), 1.0, 1.0)]
+    while stack:
+        path, factor, max_ratio = stack.pop()
+        if len(path) > MAX_HOPS:
+            continue
+        for target, (edge_factor, edge_ratio) in edges.get(path[-1], {}).items():
+            if target in path:
+                continue
+            item = (factor * edge_factor, min(max_ratio, edge_ratio))
+            if target not in best or item[0] < best[target][0] - 1e-12:
+                best[target] = item
+            stack.append((path + (target,), item[0], item[1]))
+    return best
+
+
+def _brute_components(edges):
+    """互相可达的节点组（节点数大于 1）"""
+    nodes = set(edges) | {t for targets in edges.values() for t in targets}
+
+    def reachable(start):
+        seen, stack = {start}, [start]
+        while stack:
+            for target in edges.get(stack.pop(), {}):
+                if target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return seen
+
+    reach = {node: reachable(node) for node in nodes}
+    components = {frozenset(other for other in nodes if other in reach[node] and node in reach[other])
+                  for node in nodes}
+    return {component for component in components if len(component) > 1}
+
+
+def _brute_consistent(edges, members):
+    """环内每条简单回路的换算系数之积都为 1"""
+    def walk(start, node, product, visited):
+        for target, (factor, _) in edges.get(node, {}).items():
+            if target not in members:
+                continue
+            if target == start:
+                if abs(math.log(product * factor)) > 1e-6:
+                    return False
+            elif target not in visited and not walk(start, target, product * factor, visited | {target}):
+                return False
+        return True
+    return all(walk(start, start, 1.0, {start}) for start in members)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_candidates_match_path_enumeration(seed):
+    edges = _random_edges(random.Random(seed))
+    graph = SubstitutionGraph(edges)
+    for source in edges:
+        expected = _brute_candidates(edges, source)
+        candidates = graph.get_candidates(source)
+        assert {c[0] for c in candidates} == set(expected)
+        for target, factor, max_ratio, path in candidates:
+            assert factor == pytest.approx(expected[target][0])
+            assert path[0] == source and path[-1] == target and len(path) - 1 <= MAX_HOPS
+            assert len(set(path)) == len(path)
+            # 路径上的系数之积即候选的换算系数
+            assert math.prod(edges[a][b][0] for a, b in zip(path, path[1:])) == pytest.approx(factor)
+        assert [c[1] for c in candidates] == sorted(c[1] for c in candidates)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_cycles_match_mutual_reachability(seed):
+    edges = _random_edges(random.Random(100 + seed), node_count=7, edge_count=14)
+    cycles = substitution_graph.find_cycles(edges)
+    assert {frozenset(c['materials']) for c in cycles} == _brute_components(edges)
+    for cycle in cycles:
+        assert cycle['consistent'] == _brute_consistent(edges, set(cycle['materials']))
+
+
+def test_consistent_and_inconsistent_cycle():
+    consistent = {'A': {'B': (2.0, 1.0)}, 'B': {'A': (0.5, 1.0)}}
+    inconsistent = {'A': {'B': (2.0, 1.0)}, 'B': {'A': (1.0, 1.0)}}
+    assert substitution_graph.find_cycles(consistent) == [{'materials': ['A', 'B'], 'consistent': True}]
+    assert substitution_graph.find_cycles(inconsistent) == [{'materials': ['A', 'B'], 'consistent': False}]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_incremental_update_matches_rebuild(seed):
+    rng = random.Random(200 + seed)
+    edges = _random_edges(rng)
+    graph = SubstitutionGraph(edges)
+    for _ in range(5):
+        new_edges = {source: dict(targets) for source, targets in edges.items()}
+        source = rng.choice(sorted(new_edges))
+        if new_edges[source] and rng.random() < 0.5:
+            del new_edges[source][rng.choice(sorted(new_edges[source]))]
+            if not new_edges[source]:
+                del new_edges[source]
+        else:
+            target = rng.choice([f'M{i}' for i in range(9) if f'M{i}' != source])
+            new_edges.setdefault(source, {})[target] = (rng.choice([0.5, 1.0, 2.0]), 1.0)
+        graph.update(new_edges)
+        rebuilt = SubstitutionGraph(new_edges)
+        assert graph.candidates == rebuilt.candidates
+        assert graph.reverse == rebuilt.reverse
+        edges = new_edges
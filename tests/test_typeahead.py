@@ -0,0 +1,51 @@
+"""输入联想索引只在原料字典、产品表变化时重建"""
+import pytest
+from db_pool import pooled_connection
+import search_index
+import typeahead
+
+
+def _execute(sql, params=()):
+    with pooled_connection() as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+@pytest.fixture
+def index(db):
+    search_index.init_search_index()
+    typeahead.invalidate()
+    _execute('''
+        INSERT INTO daily_material_prices (price_date, material_code, material_name, unit_price)
+        VALUES ('2025-01-01', 'M001', '钛白粉', 10)
+    ''')
+    _execute("INSERT INTO products (product_code, product_name) VALUES ('P001', '白色涂料')")
+    yield
+    typeahead.invalidate()
+
+
+def test_price_writes_keep_material_index(index):
+    assert [m['material_code'] for m in typeahead.suggest_materials('m0')] == ['M001']
+    before = search_index.get_index_version('materials')
+    _execute('''
+        INSERT INTO daily_material_prices (price_date, material_code, material_name, unit_price)
+        VALUES ('2025-01-02', 'M001', '钛白粉', 11)
+    ''')
+    _execute("UPDATE daily_material_prices SET unit_price = 12 WHERE material_code = 'M001'")
+    assert search_index.get_index_version('materials') == before
+
+
+def test_new_material_and_product_rename_rebuild(index):
+    assert typeahead.suggest_materials('m002') == []
+    _execute('''
+        INSERT INTO formula_materials (formula_id, material_code, material_name, usage_ratio)
+        VALUES (1, 'M002', '碳酸钙', 0.3)
+    ''')
+    assert [m['material_code'] for m in typeahead.suggest_materials('m00')] == ['M001', 'M002']
+
+    products_version = search_index.get_index_version('products')
+    assert typeahead.suggest_products('白色')[0]['product_code'] == 'P001'
+    _execute("UPDATE products SET product_name = '哑光白涂料' WHERE product_code = 'P001'")
+    assert search_index.get_index_version('products') == products_version + 1
+    assert typeahead.suggest_products('白色') == []
+    assert typeahead.suggest_products('哑光')[0]['product_code'] == 'P001'
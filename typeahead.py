@@ -0,0 +1,125 @@
+"""
+输入联想（typeahead）
+原料、产品的编码和名称建成内存中的有序前缀索引，二分查找取前N条，
+页面输入时按需请求 /api/materials/suggest、/api/products/suggest，不再整表渲染下拉框。
+原料字典或产品表变化（search_index 的触发器递增对应版本号）时只重建该索引，
+价格修改、导入重复数据等不影响编码名称的写入不会触发重建。
+"""
+import threading
+from bisect import bisect_left
+from db_pool import pooled_connection
+from search_index import get_index_version
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class PrefixIndex:
+    """按小写键排序的 (键, 条目序号) 列表，前缀查询为一次二分加顺序读取"""
+
+    def __init__(self, entries, key_fields):
+        self.entries = entries
+        # 每个键字段单独一组，编码匹配优先于名称匹配
+        self.keys = []
+        for field in key_fields:
+            pairs = sorted((str(entry[field]).lower(), i)
+                           for i, entry in enumerate(entries) if entry.get(field))
+            self.keys.append(pairs)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        seen = set()
+        results = []
+        for pairs in self.keys:
+            pos = bisect_left(pairs, (prefix, -1))
+            while pos < len(pairs) and len(results) < limit:
+                key, i = pairs[pos]
+                if not key.startswith(prefix):
+                    break
+                if i not in seen:
+                    seen.add(i)
+                    results.append(self.entries[i])
+                pos += 1
+            if len(results) >= limit:
+                break
+        return results
+
+
+_lock = threading.Lock()
+_indexes = {}   # name -> (索引版本号, PrefixIndex)
+
+
+def _load_materials():
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT material_code, material_name, material_model
+            FROM material_search
+            ORDER BY material_code
+        ''')
+        rows = cursor.fetchall()
+    entries = [{
+        'material_code': row[0],
+        'material_name': row[1],
+        'material_model': row[2]
+    } for row in rows]
+    return PrefixIndex(entries, ['material_code', 'material_name', 'material_model'])
+
+
+def _load_products():
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT product_code, product_name, customer_product_name
+            FROM products
+            ORDER BY product_code
+        ''')
+        rows = cursor.fetchall()
+    entries = [{
+        'product_code': row[0],
+        'product_name': row[1],
+        'customer_product_name': row[2]
+    } for row in rows]
+    return PrefixIndex(entries, ['product_code', 'product_name', 'customer_product_name'])
+
+
+_LOADERS = {
+    'materials': _load_materials,
+    'products': _load_products,
+}
+
+
+def _get_index(name):
+    version = get_index_version(name)
+    with _lock:
+        cached = _indexes.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, _LOADERS[name]())
+            _indexes[name] = cached
+        return cached[1]
+
+
+def normalize_limit(limit):
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def suggest_materials(prefix, limit=DEFAULT_LIMIT):
+    """按原料编码/名称/型号前缀联想"""
+    return _get_index('materials').search(prefix, normalize_limit(limit))
+
+
+def suggest_products(prefix, limit=DEFAULT_LIMIT):
+    """按产品编码/产品名称/客户产品名称前缀联想"""
+    return _get_index('products').search(prefix, normalize_limit(limit))
+
+
+def invalidate():
+    """清空索引，下次查询时重建"""
+    with _lock:
+        _indexes.clear()